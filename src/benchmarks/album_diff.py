@@ -0,0 +1,81 @@
+# Copyright Patrick Perrier, 2015
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Album refresh benchmark: applying a changed album by replacing the whole list vs. by album_diff.
+
+For a synthetic album of Imgur-like IDs, makes a few kinds of edits (images added at the end,
+a few removed from the middle, one moved, nothing) and prints how long it takes to work out
+where the current image went: by finding it in the new list (what replacing the list did, which
+builds the new list's hash table) and with album_diff.diff and AlbumDiff.new_position.
+
+Usage (from the src directory): python benchmarks/album_diff.py [--images N]
+"""
+
+import os
+import atexit
+import sys
+import shutil
+import time
+import random
+import string
+import argparse
+import tempfile
+
+# The package logs (and may write caches) to its data directory; use a scratch one
+if not os.environ.get("IMGURSWITCHER_DATA_DIR"):
+    os.environ["IMGURSWITCHER_DATA_DIR"] = tempfile.mkdtemp(prefix="imgurswitcher-bench-")
+    # Registered before the package's own atexit handlers, so it runs after the log is written out
+    atexit.register(shutil.rmtree, os.environ["IMGURSWITCHER_DATA_DIR"], ignore_errors=True)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from imgurswitcher.album_index import AlbumIndex
+from imgurswitcher import album_diff
+
+def _ms(function):
+    started = time.perf_counter()
+    result = function()
+    return result, (time.perf_counter() - started) * 1000
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--images", type=int, default=100000, help="images in the synthetic album")
+    args = parser.parse_args()
+
+    characters = string.ascii_letters + string.digits
+    rng = random.Random(1)
+    ids = list(dict.fromkeys("".join(rng.choice(characters) for _ in range(7)) for _ in range(args.images + 20)))
+    extra, ids = ids[:20], ids[20:]
+    middle = len(ids) // 2
+    edits = [
+        ("nothing", list(ids)),
+        ("10 added at the end", ids + extra[:10]),
+        ("3 removed in the middle", ids[:middle] + ids[middle + 3:]),
+        ("1 moved 100 places", ids[:middle] + ids[middle + 1:middle + 101] + [ids[middle]] + ids[middle + 101:]),
+        ("1 added at the start", extra[:1] + ids),
+    ]
+    old = AlbumIndex(ids)
+    current = len(ids) * 3 // 4
+    print("Album: %i images, current image at position %i\n" % (len(ids), current))
+    print("%-26s %14s %14s" % ("edit", "replace (ms)", "diff (ms)"))
+    for name, edited in edits:
+        new = AlbumIndex(edited)
+        # A fresh copy each time, so the hash table isn't already there
+        replaced, replace_ms = _ms(lambda: AlbumIndex.from_packed(*new.packed()).position_of(ids[current]))
+        changes, diff_ms = _ms(lambda: album_diff.diff(old, new).new_position(current, ids[current]))
+        if replaced != changes:
+            raise AssertionError("%s: diff puts the current image at %s, not %s" % (name, changes, replaced))
+        print("%-26s %14.2f %14.2f" % (name, replace_ms, diff_ms))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+# Copyright Patrick Perrier, 2015
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Album index benchmark: a list of ID strings (plus a dict, for lookups) vs. album_index.AlbumIndex.
+
+For a synthetic album of Imgur-like IDs (5 and 7 characters), prints the memory each one
+takes (allocated while building it, measured with tracemalloc), how long building it takes,
+the time per ID-to-position lookup and per indexed access, and how long a stored index takes
+to load as a JSON list and in AlbumIndex's packed form.
+
+Usage (from the src directory): python benchmarks/album_index.py [--images N] [--lookups N]
+"""
+
+import os
+import atexit
+import sys
+import shutil
+import json
+import time
+import random
+import string
+import argparse
+import tempfile
+import tracemalloc
+
+# The package logs (and may write caches) to its data directory; use a scratch one
+if not os.environ.get("IMGURSWITCHER_DATA_DIR"):
+    os.environ["IMGURSWITCHER_DATA_DIR"] = tempfile.mkdtemp(prefix="imgurswitcher-bench-")
+    # Registered before the package's own atexit handlers, so it runs after the log is written out
+    atexit.register(shutil.rmtree, os.environ["IMGURSWITCHER_DATA_DIR"], ignore_errors=True)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from imgurswitcher.album_index import AlbumIndex
+
+def _measure(build):
+    """Returns (what build returned, ms it took, bytes it left allocated).
+
+    Times a run without tracemalloc (which slows allocations down a lot), then counts the bytes in a second run.
+    """
+    started = time.perf_counter()
+    build()
+    elapsed = (time.perf_counter() - started) * 1000
+    tracemalloc.start()
+    result = build()
+    allocated = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return result, elapsed, allocated
+
+def _per_call_us(function, arguments):
+    started = time.perf_counter()
+    for argument in arguments:
+        function(argument)
+    return (time.perf_counter() - started) * 1e6 / len(arguments)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--images", type=int, default=100000, help="images in the synthetic album")
+    parser.add_argument("--lookups", type=int, default=2000, help="lookups to time (the list's are a linear scan, so keep this modest)")
+    args = parser.parse_args()
+
+    characters = string.ascii_letters + string.digits
+    rng = random.Random(1)
+    ids = list(dict.fromkeys("".join(rng.choice(characters) for _ in range(rng.choice((5, 7)))) for _ in range(args.images)))
+    as_json = json.dumps(ids)
+    print("Album: %i images\n" % len(ids))
+
+    def list_and_dict():
+        loaded = json.loads(as_json)
+        return loaded, dict((image_id, position) for position, image_id in enumerate(loaded))
+
+    # Build from the JSON, as when loading a stored index, so the ID strings count towards each one
+    id_list, list_ms, list_bytes = _measure(lambda: json.loads(as_json))
+    (_, id_dict), dict_ms, dict_bytes = _measure(list_and_dict)
+    index, index_ms, index_bytes = _measure(lambda: AlbumIndex(json.loads(as_json)))
+    _, table_ms, table_bytes = _measure(lambda: AlbumIndex.from_packed(*index.packed())._build_table())
+    print("%-24s %8.1f KB   built in %6.1f ms" % ("list", list_bytes / 1024, list_ms))
+    print("%-24s %8.1f KB   built in %6.1f ms" % ("list + dict", dict_bytes / 1024, dict_ms))
+    print("%-24s %8.1f KB   built in %6.1f ms" % ("AlbumIndex", index_bytes / 1024, index_ms))
+    print("%-24s %8.1f KB   built in %6.1f ms (on the first lookup)" % ("AlbumIndex + hash table", (index_bytes + table_bytes) / 1024, index_ms + table_ms))
+
+    lookups = [rng.choice(ids) for _ in range(args.lookups)] + ["missing"]
+    if [index.position_of(image_id) for image_id in lookups] != [id_dict.get(image_id) for image_id in lookups]:
+        raise AssertionError("AlbumIndex lookups don't match the dict's")
+    positions = [rng.randrange(len(ids)) for _ in range(args.lookups)]
+    if [index[position] for position in positions] != [id_list[position] for position in positions]:
+        raise AssertionError("AlbumIndex items don't match the list's")
+    print()
+    print("ID -> position:  list.index %9.2f us   dict %6.2f us   AlbumIndex.position_of %6.2f us" % (
+        _per_call_us(lambda image_id: image_id in id_list and id_list.index(image_id), lookups),
+        _per_call_us(id_dict.get, lookups), _per_call_us(index.position_of, lookups)))
+    print("position -> ID:  list       %9.2f us                 AlbumIndex[]           %6.2f us" % (
+        _per_call_us(id_list.__getitem__, positions), _per_call_us(index.__getitem__, positions)))
+
+    # The same as album_cache stores and loads
+    width, packed = index.packed()
+    as_packed = json.dumps({"width": width, "packed": packed.decode('ascii')})
+    def load_packed():
+        stored = json.loads(as_packed)
+        return AlbumIndex.from_packed(stored["width"], stored["packed"].encode('ascii'))
+    _, json_load_ms, _ = _measure(lambda: AlbumIndex(json.loads(as_json)))
+    _, packed_load_ms, _ = _measure(load_packed)
+    print()
+    print("Stored index:    JSON list %.1f KB, loaded in %.1f ms   packed %.1f KB, loaded in %.1f ms" % (
+        len(as_json) / 1024, json_load_ms, len(as_packed) / 1024, packed_load_ms))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+# Copyright Patrick Perrier, 2015
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Album page parsing benchmark: whole-page regex vs. the incremental album_parser, on a synthetic multi-megabyte page.
+
+First parses the page from memory, in the HTTP client's chunk size, and prints the time taken
+and the peak memory allocated while parsing (tracemalloc). Then downloads it from the local
+Imgur stand-in at a limited bandwidth and prints when the first image ID was available and when
+the whole list was, for reading the whole body first (the old way) and for parsing as it comes in.
+
+Usage (from the src directory): python benchmarks/album_parser.py [--images N] [--bandwidth BYTES_PER_SECOND] [--runs N]
+"""
+
+import os
+import atexit
+import re
+import sys
+import shutil
+import time
+import argparse
+import tempfile
+import statistics
+import tracemalloc
+
+# The package logs (and may write caches) to its data directory; use a scratch one
+if not os.environ.get("IMGURSWITCHER_DATA_DIR"):
+    os.environ["IMGURSWITCHER_DATA_DIR"] = tempfile.mkdtemp(prefix="imgurswitcher-bench-")
+    # Registered before the package's own atexit handlers, so it runs after the log is written out
+    atexit.register(shutil.rmtree, os.environ["IMGURSWITCHER_DATA_DIR"], ignore_errors=True)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from benchmarks.imgur_standin import StandinServer
+from imgurswitcher import album_parser
+from imgurswitcher.http_client import HttpClient, CHUNK_SIZE
+
+# What imgur_callbacks used before album_parser
+_OLD_PATTERN = '<div id="([a-zA-Z0-9]+)" class="post-image-container'
+
+def _parse_whole(chunks):
+    return re.findall(_OLD_PATTERN, b"".join(chunks).decode('utf-8'))
+
+def _parse_incremental(chunks):
+    parser = album_parser.AlbumPageParser()
+    for chunk in chunks:
+        parser.feed(chunk)
+    return parser.close()
+
+def _in_memory(name, parse, chunks, expected, runs):
+    times = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        ids = parse(chunks)
+        times.append((time.perf_counter() - started) * 1000)
+    if ids != expected:
+        raise AssertionError("%s found %i IDs, expected %i" % (name, len(ids), len(expected)))
+    tracemalloc.start()
+    parse(chunks)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    print("%-12s in memory: median %7.1f ms   peak allocated %8.1f KB" % (name, statistics.median(times), peak / 1024))
+
+def _over_the_wire(name, incremental, client, url, expected):
+    started = time.perf_counter()
+    first = None
+    with client.get(url) as response:
+        if incremental:
+            parser = album_parser.AlbumPageParser()
+            for chunk in response.iter_chunks():
+                if parser.feed(chunk) and first is None:
+                    first = time.perf_counter()
+            ids = parser.close()
+        else:
+            ids = _parse_whole([response.read()])
+            first = time.perf_counter()
+    done = time.perf_counter()
+    if ids != expected:
+        raise AssertionError("%s found %i IDs, expected %i" % (name, len(ids), len(expected)))
+    print("%-12s download:  first ID after %7.1f ms   all %i IDs after %7.1f ms" % (name, (first - started) * 1000, len(ids), (done - started) * 1000))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--images", type=int, default=30000, help="images in the synthetic album (about 170 bytes of page each)")
+    parser.add_argument("--bandwidth", type=int, default=4 * 1024 * 1024, help="stand-in bandwidth for the download runs, in bytes/s")
+    parser.add_argument("--runs", type=int, default=5, help="runs of each in-memory parse")
+    args = parser.parse_args()
+
+    image_ids = ["i%06i" % i for i in range(args.images)]
+    server = StandinServer({"bench": image_ids}, bandwidth=args.bandwidth).start()
+    page = server.album_page("bench")
+    chunks = [page[start:start + CHUNK_SIZE] for start in range(0, len(page), CHUNK_SIZE)]
+    print("Album page: %i images, %.1f MB, %i chunks of %i KB\n" % (args.images, len(page) / 1024 / 1024, len(chunks), CHUNK_SIZE // 1024))
+
+    try:
+        _in_memory("whole page", _parse_whole, chunks, image_ids, args.runs)
+        _in_memory("incremental", _parse_incremental, chunks, image_ids, args.runs)
+        print()
+        client = HttpClient()
+        url = server.url + "/a/bench/layout/blog"
+        _over_the_wire("whole page", False, client, url, image_ids)
+        _over_the_wire("incremental", True, client, url, image_ids)
+    finally:
+        server.stop()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+# Copyright Patrick Perrier, 2015
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Cancellation latency benchmark: how long a cancelled download takes to actually stop.
+
+Starts downloads of large images from the local Imgur stand-in (throttled so they take
+a while), cancels each one at a random point from another thread, and reports how long
+it took from CancelToken.cancel to the download raising DownloadCancelled, against
+cancellation.CANCEL_LATENCY_BUDGET_MS.
+
+Usage (from the src directory): python benchmarks/cancellation.py [--runs N] [--bandwidth BYTES_PER_SECOND]
+"""
+
+import os
+import atexit
+import sys
+import shutil
+import time
+import random
+import argparse
+import tempfile
+import threading
+import statistics
+
+# The package logs (and may write caches) to its data directory; use a scratch one
+if not os.environ.get("IMGURSWITCHER_DATA_DIR"):
+    os.environ["IMGURSWITCHER_DATA_DIR"] = tempfile.mkdtemp(prefix="imgurswitcher-bench-")
+    # Registered before the package's own atexit handlers, so it runs after the log is written out
+    atexit.register(shutil.rmtree, os.environ["IMGURSWITCHER_DATA_DIR"], ignore_errors=True)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from benchmarks.imgur_standin import StandinServer
+from imgurswitcher import exceptions as xcpt
+from imgurswitcher import cancellation
+from imgurswitcher.http_client import HttpClient
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=20)
+    parser.add_argument("--size", type=int, default=4 * 1024 * 1024, help="image size in bytes")
+    parser.add_argument("--bandwidth", type=int, default=4 * 1024 * 1024, help="stand-in bandwidth, bytes per second")
+    args = parser.parse_args()
+
+    server = StandinServer({"bench": []}, image_size=args.size, bandwidth=args.bandwidth).start()
+    client = HttpClient()
+    latencies = []
+    try:
+        with tempfile.TemporaryDirectory() as directory:
+            for run in range(args.runs):
+                token = cancellation.CancelToken()
+                cancelled_at = []
+                def cancel_later():
+                    time.sleep(random.uniform(0.05, 0.5) * args.size / args.bandwidth)
+                    cancelled_at.append(time.perf_counter())
+                    token.cancel()
+                threading.Thread(target=cancel_later).start()
+                try:
+                    client.download(server.url + "/img%i.jpg" % run, os.path.join(directory, "img.jpg"), token)
+                    print("run %i: download finished before it was cancelled" % run)
+                    continue
+                except xcpt.DownloadCancelled:
+                    latencies.append((time.perf_counter() - cancelled_at[0]) * 1000)
+    finally:
+        server.stop()
+
+    latencies.sort()
+    print("cancellation latency over %i runs: median %.2f ms, p95 %.2f ms, max %.2f ms (budget %i ms)" % (
+        len(latencies), statistics.median(latencies), latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))],
+        latencies[-1], cancellation.CANCEL_LATENCY_BUDGET_MS))
+    print("within budget: %s" % (latencies[-1] <= cancellation.CANCEL_LATENCY_BUDGET_MS))
+
+if __name__ == "__main__":
+    main()
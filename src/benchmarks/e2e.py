@@ -0,0 +1,200 @@
+# Copyright Patrick Perrier, 2015
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""End-to-end benchmark: how long from a key press until the background has changed.
+
+Runs the real callbacks, event queue and worker against the local Imgur stand-in
+(imgur_standin.py). The platform's set_as_background is replaced by a stub that
+records when it was called, so no desktop is needed. Key presses are simulated by putting the
+same events the keyboard hook puts in the event queue.
+
+For each runtime asked for, a fresh interpreter with an empty scratch data directory
+(so a cold image cache and no stored album index) measures:
+
+* startup_ms: from starting the album load until the album index is loaded;
+* key_to_background_ms: p50/p95/p99/mean/max over the simulated key presses;
+* what went over the wire: bytes sent by the stand-in, requests and connections;
+* the pipeline metrics (imgurswitcher.metrics), to see where the time went.
+
+The results are written as JSON (to --output, or stdout) so that runs can be compared
+to catch regressions.
+
+Usage (from the src directory):
+    python benchmarks/e2e.py [--runtime thread pool async] [--presses 50] [--interval-ms 300]
+                             [--image-kb 500] [--latency-ms 50] [--bandwidth-kbps 0] [--page-size 0] [--progressive 0]
+                             [--output results.json]
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import threading
+import subprocess
+
+_SRC_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+_BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+_PACKAGE_DATA_DIR = os.path.join(_SRC_DIR, "imgurswitcher", "data")
+
+ALBUM_ID = "bench1"
+
+# Same as imgurswitcher.DATA_DIR_VARIABLE; not imported so that this process doesn't touch the package's data directory
+DATA_DIR_VARIABLE = "IMGURSWITCHER_DATA_DIR"
+
+def percentiles(values):
+    """Returns a dict with the p50/p95/p99 (nearest rank), mean and max of values."""
+    ordered = sorted(values)
+    if not ordered:
+        return {"count": 0}
+    rank = lambda p: ordered[min(len(ordered) - 1, max(0, int(round(p / 100.0 * len(ordered))) - 1))]
+    return {"count": len(ordered), "p50": rank(50), "p95": rank(95), "p99": rank(99),
+            "mean": sum(ordered) / len(ordered), "max": ordered[-1]}
+
+def _measure_once(args):
+    """Does a single measurement in this (fresh) interpreter and prints it as JSON."""
+    sys.path[:0] = [_SRC_DIR, _BENCH_DIR]
+    from imgur_standin import StandinServer
+    from imgurswitcher import config as cfg
+    from imgurswitcher import event_queue as eq
+    from imgurswitcher import worker
+    from imgurswitcher import metrics
+
+    image_ids = ["img%04d" % i for i in range(args.album_size)]
+    # Imgur's reduced-size variants (the previews of progressive mode) are much smaller than the originals
+    full_size = args.image_kb * 1024
+    image_size = lambda image_id: full_size if image_id in image_ids else max(1024, full_size // 16)
+    server = StandinServer({ALBUM_ID: image_ids}, image_size=image_size,
+                           latency=args.latency_ms / 1000.0, bandwidth=args.bandwidth_kbps * 1024 or None,
+                           page_size=args.page_size or None).start()
+
+    # Local setup only: the config, the queue and a stub platform (no desktop, no keyboard hook)
+    cfg.parse_cfg_file()
+    eq.init()
+    # A key press is done when the album position moves, right after the background was set for it
+    # (in progressive mode, the full image can be swapped in later, without moving the position)
+    background_set = threading.Event()
+    set_times = []
+    cfg.set_as_background = lambda path: set_times.append(time.perf_counter()) or True
+    set_album_pos = cfg.set_album_pos
+    def moved(position, image_id=None):
+        set_album_pos(position, image_id)
+        background_set.set()
+    cfg.set_album_pos = moved
+    cfg.exit_program = lambda: os._exit(1)
+
+    from imgurswitcher import imgur_callbacks
+    from imgurswitcher.imgur_callbacks import ImgurCallbacks, MoveEvent, RandomEvent
+    ImgurCallbacks.imgur_stub = server.url + "/"
+    ImgurCallbacks.album_stub = server.url + "/a/"
+
+    engine = worker.RUNTIMES[args.runtime]()
+    engine.daemon = True
+    engine.start()
+
+    started = time.perf_counter()
+    imgur_callbacks.load_images()
+    ImgurCallbacks._loaded.wait(60)
+    startup_ms = (time.perf_counter() - started) * 1000
+
+    latencies = []
+    for press in range(args.presses):
+        time.sleep(args.interval_ms / 1000.0) # give the prefetcher the time a person would
+        background_set.clear()
+        event = RandomEvent() if args.key == "random" else MoveEvent(1)
+        pressed = time.perf_counter()
+        eq.put((eq.LOW_PRIORITY, event, False))
+        if not background_set.wait(60):
+            raise RuntimeError("Background was not set within 60 seconds of key press %i" % press)
+        latencies.append((set_times[-1] - pressed) * 1000)
+
+    server.stop()
+    print(json.dumps({
+        "runtime": args.runtime,
+        "startup_ms": startup_ms,
+        "key_to_background_ms": percentiles(latencies),
+        "bytes_sent": server.bytes_sent,
+        "requests": server.requests,
+        "connections": server.connections,
+        "image_cache": ImgurCallbacks._cache.stats(),
+        "metrics": metrics.snapshot(),
+    }))
+
+def _run_child(args, runtime):
+    """Runs one measurement in a fresh interpreter with a scratch data directory and returns its results."""
+    data_dir = tempfile.mkdtemp(prefix="imgurswitcher-bench-")
+    try:
+        shutil.copy(os.path.join(_PACKAGE_DATA_DIR, "default.jpg"), data_dir)
+        with open(os.path.join(data_dir, "config.cfg"), 'w') as config_file:
+            config_file.write("url: http://imgur.com/a/%s\nposition: 0\nruntime: %s\nprogressive: %i\n"
+                              % (ALBUM_ID, runtime, args.progressive))
+
+        env = dict(os.environ)
+        env[DATA_DIR_VARIABLE] = data_dir
+        command = [sys.executable, os.path.abspath(__file__), "--child", "--runtime", runtime,
+                   "--presses", str(args.presses), "--interval-ms", str(args.interval_ms), "--key", args.key,
+                   "--album-size", str(args.album_size), "--image-kb", str(args.image_kb),
+                   "--latency-ms", str(args.latency_ms), "--bandwidth-kbps", str(args.bandwidth_kbps),
+                   "--progressive", str(args.progressive), "--page-size", str(args.page_size)]
+        output = subprocess.check_output(command, cwd=_SRC_DIR, env=env)
+        return json.loads(output.decode('utf-8').strip().splitlines()[-1])
+    finally:
+        shutil.rmtree(data_dir, ignore_errors=True)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runtime", nargs="+", default=["thread", "pool", "async"], choices=["thread", "pool", "async"],
+                        help="runtimes to measure (see worker.RUNTIMES)")
+    parser.add_argument("--presses", type=int, default=50, help="number of simulated key presses")
+    parser.add_argument("--interval-ms", type=int, default=300, help="time between key presses")
+    parser.add_argument("--key", choices=["next", "random"], default="next", help="which key to press")
+    parser.add_argument("--album-size", type=int, default=100, help="number of images in the album")
+    parser.add_argument("--image-kb", type=int, default=500, help="size of every image")
+    parser.add_argument("--latency-ms", type=int, default=50, help="stand-in latency per request")
+    parser.add_argument("--bandwidth-kbps", type=int, default=0, help="stand-in bandwidth in KB/s (0 for unlimited)")
+    parser.add_argument("--page-size", type=int, default=0, help="images per album page (0 for one page with all of them)")
+    parser.add_argument("--progressive", type=int, choices=[0, 1], default=0,
+                        help="1 to measure progressive mode (key->background is then the time to the preview)")
+    parser.add_argument("--output", help="file to write the JSON results to (default: stdout)")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        args.runtime = args.runtime[0]
+        _measure_once(args)
+        return
+
+    settings = dict(vars(args))
+    del settings["child"], settings["output"]
+    results = {"benchmark": "e2e", "timestamp": time.time(), "python": platform.python_version(),
+               "settings": settings, "runs": [_run_child(args, runtime) for runtime in args.runtime]}
+
+    for run in results["runs"]:
+        latency = run["key_to_background_ms"]
+        sys.stderr.write("%-7s startup %7.1f ms  key->background p50 %7.1f  p95 %7.1f  p99 %7.1f ms  %9i bytes  %4i requests  %3i connections\n"
+                         % (run["runtime"], run["startup_ms"], latency["p50"], latency["p95"], latency["p99"],
+                            run["bytes_sent"], run["requests"], run["connections"]))
+
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump(results, output_file, indent=2)
+    else:
+        print(json.dumps(results, indent=2))
+
+if __name__ == "__main__":
+    main()
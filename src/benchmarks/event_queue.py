@@ -0,0 +1,103 @@
+# Copyright Patrick Perrier, 2015
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Event queue benchmark: the old queue.PriorityQueue of TupleSortingOn0s against event_queue's per-priority deques.
+
+For each queue, puts a batch of triples (mostly LOW_PRIORITY, like key presses, with some of
+the other priorities mixed in) and then gets them all back out. Reports the time per put
+and per get, and how many items with the same priority came out in a different order
+than they were put (the old heap makes no promise about that; the new queue is FIFO).
+
+Usage (from the src directory): python benchmarks/event_queue.py [--items N] [--repeat N]
+"""
+
+import os
+import atexit
+import sys
+import shutil
+import time
+import queue
+import random
+import argparse
+import tempfile
+
+# The package logs (and may write caches) to its data directory; use a scratch one
+if not os.environ.get("IMGURSWITCHER_DATA_DIR"):
+    os.environ["IMGURSWITCHER_DATA_DIR"] = tempfile.mkdtemp(prefix="imgurswitcher-bench-")
+    # Registered before the package's own atexit handlers, so it runs after the log is written out
+    atexit.register(shutil.rmtree, os.environ["IMGURSWITCHER_DATA_DIR"], ignore_errors=True)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from imgurswitcher import event_queue as eq
+
+class TupleSortingOn0(tuple):
+    """The triples as the old queue needed them: queue.PriorityQueue compares whole tuples, which fails on the callables."""
+    def __lt__(self, rhs):
+        return self[0] < rhs[0]
+    def __gt__(self, rhs):
+        return self[0] > rhs[0]
+    def __le__(self, rhs):
+        return self[0] <= rhs[0]
+    def __ge__(self, rhs):
+        return self[0] >= rhs[0]
+
+def _make_triples(count):
+    rng = random.Random(1234)
+    priorities = [eq.LOW_PRIORITY] * 8 + [eq.MED_PRIORITY, eq.HIGH_PRIORITY, eq.URGENT_PRIORITY]
+    # The callable is just a sequence number here, so the order things came out in can be checked
+    return [TupleSortingOn0((rng.choice(priorities), sequence, False)) for sequence in range(count)]
+
+def _out_of_order(items):
+    """Counts the items that came out before an item with the same priority that was put earlier."""
+    last_seen = {}
+    count = 0
+    for priority, sequence, block in items:
+        if sequence < last_seen.get(priority, -1):
+            count += 1
+        last_seen[priority] = max(sequence, last_seen.get(priority, -1))
+    return count
+
+def _measure(make_queue, triples, repeat):
+    best_put = best_get = None
+    for _ in range(repeat):
+        q = make_queue()
+        started = time.perf_counter()
+        for triple in triples:
+            q.put(triple)
+        put_done = time.perf_counter()
+        items = [q.get() for _ in triples]
+        get_done = time.perf_counter()
+
+        put_ns = (put_done - started) / len(triples) * 1e9
+        get_ns = (get_done - put_done) / len(triples) * 1e9
+        best_put = put_ns if best_put is None else min(best_put, put_ns)
+        best_get = get_ns if best_get is None else min(best_get, get_ns)
+    return best_put, best_get, _out_of_order(items)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--items", type=int, default=10000, help="items per batch")
+    parser.add_argument("--repeat", type=int, default=5, help="batches per queue (the best is reported)")
+    args = parser.parse_args()
+
+    triples = _make_triples(args.items)
+    print("%-38s %10s %10s %14s" % ("", "ns/put", "ns/get", "out of order"))
+    for name, make_queue in (("queue.PriorityQueue(TupleSortingOn0)", queue.PriorityQueue),
+                             ("event_queue._EventQueue", eq._EventQueue)):
+        put_ns, get_ns, out_of_order = _measure(make_queue, triples, args.repeat)
+        print("%-38s %10.0f %10.0f %14i" % (name, put_ns, get_ns, out_of_order))
+
+if __name__ == "__main__":
+    main()
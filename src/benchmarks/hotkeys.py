@@ -0,0 +1,119 @@
+# Copyright Patrick Perrier, 2015
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Keyboard hook micro-benchmark: how long the hook takes per key press.
+
+Compares the old hook (which rebuilt its key -> callback dict, and six queue tuples, on
+every key press) with the current one (a flag test and a lookup in the prebuilt
+hotkeys table) for:
+
+* a key press without ALT (almost every key press);
+* ALT plus a key that isn't bound;
+* ALT plus a bound key (includes putting the event in the queue, where it gets merged
+  with the previous press).
+
+windows.py can't be imported off Windows, so the hook is reproduced here with a fake
+pyHook event; keep it in sync with windows.on_keyboard_event.
+
+Usage (from the src directory): python benchmarks/hotkeys.py [--number N]
+"""
+
+import os
+import atexit
+import sys
+import shutil
+import timeit
+import argparse
+import tempfile
+
+# The package logs (and may write caches) to its data directory; use a scratch one
+if not os.environ.get("IMGURSWITCHER_DATA_DIR"):
+    os.environ["IMGURSWITCHER_DATA_DIR"] = tempfile.mkdtemp(prefix="imgurswitcher-bench-")
+    # Registered before the package's own atexit handlers, so it runs after the log is written out
+    atexit.register(shutil.rmtree, os.environ["IMGURSWITCHER_DATA_DIR"], ignore_errors=True)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from imgurswitcher import event_queue as eq
+from imgurswitcher import imgur_callbacks as callbacks
+from imgurswitcher import hotkeys
+from benchmarks.event_queue import TupleSortingOn0
+
+class FakeKeyboardEvent:
+    """The parts of pyHook's KeyboardEvent the hooks use."""
+
+    def __init__(self, key, alt):
+        self.KeyID = ord(key)
+        self.Key = key
+        self.Alt = 0x20 if alt else 0
+
+    def IsAlt(self):
+        return bool(self.Alt)
+
+    def GetKey(self):
+        return self.Key
+
+def old_on_keyboard_event(event):
+    """The hook as it was before the dispatch table."""
+    callback_dict = {
+        "D": TupleSortingOn0((eq.LOW_PRIORITY, callbacks.MoveEvent(1), False)),
+        "A": TupleSortingOn0((eq.LOW_PRIORITY, callbacks.MoveEvent(-1), False)),
+        "R": TupleSortingOn0((eq.LOW_PRIORITY, callbacks.RandomEvent(), False)),
+        "S": TupleSortingOn0((eq.HIGH_PRIORITY, callbacks.ImgurCallbacks.save_image, True)),
+        "U": TupleSortingOn0((eq.HIGH_PRIORITY, callbacks.ImgurCallbacks.change_url, True)),
+        "Q": TupleSortingOn0((eq.URGENT_PRIORITY, callbacks.ImgurCallbacks.quit_program, True))
+    }
+
+    if(event.IsAlt()):
+        keyPressed = event.GetKey()
+        block = True
+        if keyPressed in callback_dict:
+            eq.put(callback_dict[keyPressed])
+            block = False
+        return block
+    return True
+
+def on_keyboard_event(event):
+    """Same as windows.on_keyboard_event."""
+    return not (event.Alt and hotkeys.on_key_down(event.KeyID))
+
+def _per_call_ns(hook, event, number):
+    # Each repeat starts with an empty queue
+    timer = timeit.Timer(lambda: hook(event))
+    best = None
+    for _ in range(5):
+        eq.init()
+        seconds = timer.timeit(number)
+        best = seconds if best is None else min(best, seconds)
+    return best / number * 1e9
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--number", type=int, default=100000, help="key presses per measurement")
+    args = parser.parse_args()
+
+    eq.set_max_queue_size(0) # unbounded, so putting bound keys never fails
+    hotkeys.load()
+
+    # Repeated presses of a navigation key get merged in the queue, like a held-down key would
+    cases = [("no ALT", FakeKeyboardEvent("K", False)),
+             ("ALT + unbound key", FakeKeyboardEvent("K", True)),
+             ("ALT + bound key (next)", FakeKeyboardEvent("D", True))]
+    print("%-24s %14s %14s" % ("", "old ns/press", "new ns/press"))
+    for name, event in cases:
+        print("%-24s %14.0f %14.0f" % (name, _per_call_ns(old_on_keyboard_event, event, args.number),
+                                       _per_call_ns(on_keyboard_event, event, args.number)))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+# Copyright Patrick Perrier, 2015
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""HTTP client benchmark: pooled keep-alive client vs. plain urllib, against the local Imgur stand-in.
+
+Downloads every image of a synthetic album once with urllib.request.urlretrieve and once with
+the pooled client (one at a time, then with several threads), checks that the bytes are right,
+and prints the wall time, connections opened and the client's per-request timings.
+
+Usage (from the src directory): python benchmarks/http_client.py [--images N] [--size BYTES] [--latency SECONDS] [--threads N]
+"""
+
+import os
+import atexit
+import sys
+import shutil
+import time
+import argparse
+import tempfile
+import statistics
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+# The package logs (and may write caches) to its data directory; use a scratch one
+if not os.environ.get("IMGURSWITCHER_DATA_DIR"):
+    os.environ["IMGURSWITCHER_DATA_DIR"] = tempfile.mkdtemp(prefix="imgurswitcher-bench-")
+    # Registered before the package's own atexit handlers, so it runs after the log is written out
+    atexit.register(shutil.rmtree, os.environ["IMGURSWITCHER_DATA_DIR"], ignore_errors=True)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from benchmarks.imgur_standin import StandinServer
+from imgurswitcher.http_client import HttpClient
+
+def _check(server, image_id, path):
+    with open(path, 'rb') as image_file:
+        if image_file.read() != server.image(image_id):
+            raise AssertionError("Downloaded bytes for %s don't match what the stand-in served" % image_id)
+
+def _run(name, server, image_ids, fetch, threads):
+    server.connections = 0
+    started = time.perf_counter()
+    with tempfile.TemporaryDirectory() as directory:
+        def one(image_id):
+            path = os.path.join(directory, image_id + ".jpg")
+            fetch(server.url + "/" + image_id + ".jpg", path)
+            _check(server, image_id, path)
+        with ThreadPoolExecutor(threads) as pool:
+            list(pool.map(one, image_ids))
+    elapsed = time.perf_counter() - started
+    print("%-28s %8.1f ms total  %6.1f ms/image  %3i connections" % (name, elapsed * 1000, elapsed * 1000 / len(image_ids), server.connections))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--images", type=int, default=40)
+    parser.add_argument("--size", type=int, default=500 * 1024, help="image size in bytes")
+    parser.add_argument("--latency", type=float, default=0.0, help="stand-in latency per request, in seconds")
+    parser.add_argument("--threads", type=int, default=4, help="threads (and pooled connections) for the concurrent runs")
+    args = parser.parse_args()
+
+    image_ids = ["img%05i" % i for i in range(args.images)]
+    server = StandinServer({"bench": image_ids}, image_size=args.size, latency=args.latency).start()
+    try:
+        client = HttpClient(max_connections=args.threads)
+        _run("urllib, sequential", server, image_ids, urllib.request.urlretrieve, 1)
+        _run("pooled client, sequential", server, image_ids, client.download, 1)
+        _run("urllib, %i threads" % args.threads, server, image_ids, urllib.request.urlretrieve, args.threads)
+        _run("pooled client, %i threads" % args.threads, server, image_ids, client.download, args.threads)
+
+        timings = client.timings()
+        print("\nPooled client per-request timings (last %i requests):" % len(timings))
+        print("  reused connections: %i of %i" % (sum(t.reused for t in timings), len(timings)))
+        print("  first byte ms: median %.2f, max %.2f" % (statistics.median(t.first_byte_ms for t in timings), max(t.first_byte_ms for t in timings)))
+        print("  total ms:      median %.2f, max %.2f" % (statistics.median(t.total_ms for t in timings), max(t.total_ms for t in timings)))
+    finally:
+        server.stop()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,187 @@
+# Copyright Patrick Perrier, 2015
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""A local stand-in for imgur.com and i.imgur.com, for benchmarks.
+
+Serves album pages at /a/<album id>/layout/blog (in the post-image-container markup that
+imgur_callbacks parses, with an ETag so conditional GETs work) and synthetic images at
+/<image id>.jpg. Image size, per-request latency and bandwidth are configurable, and album pages
+can be split into pages of page_size images (?page=N, each linking to the pages around it). Speaks HTTP/1.1 with
+keep-alive and counts connections, requests and bytes so that benchmarks can check
+what actually went over the wire.
+
+    server = StandinServer({"album1": ["img1", "img2"]}, image_size=500000, latency=0.05)
+    server.start()
+    ... fetch from server.url + "/a/album1/layout/blog" ...
+    server.stop()
+"""
+
+import sys
+import time
+import socket
+import hashlib
+import threading
+import socketserver
+import http.server
+import urllib.parse
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1" # keep-alive
+
+    def setup(self):
+        super().setup()
+        self.server.standin._count("connections", 0)
+        with self.server.standin._lock:
+            self.server.standin._open.add(self.connection)
+
+    def finish(self):
+        with self.server.standin._lock:
+            self.server.standin._open.discard(self.connection)
+        super().finish()
+
+    def log_message(self, format, *args):
+        pass # keep benchmark output clean
+
+    def do_GET(self):
+        standin = self.server.standin
+        if standin.latency:
+            time.sleep(standin.latency)
+
+        body = None
+        etag = None
+        path, _, query = self.path.partition("?")
+        parts = path.strip("/").split("/")
+        if len(parts) == 4 and parts[0] == "a" and parts[2:] == ["layout", "blog"] and parts[1] in standin.albums:
+            page = int(urllib.parse.parse_qs(query).get("page", ["1"])[0])
+            body = standin.album_page(parts[1], page)
+            if body is not None:
+                etag = '"%s"' % hashlib.md5(body).hexdigest()
+        elif len(parts) == 1 and parts[0].endswith(".jpg"):
+            body = standin.image(parts[0][:-len(".jpg")])
+
+        if body is None:
+            self._respond(404, b"Not found")
+        elif etag is not None and self.headers.get("If-None-Match") == etag:
+            self._respond(304, b"", etag)
+        else:
+            self._respond(200, body, etag)
+
+    def _respond(self, status, body, etag=None):
+        self.send_response(status)
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("Content-Type", "image/jpeg" if self.path.endswith(".jpg") else "text/html")
+        if etag is not None:
+            self.send_header("ETag", etag)
+        self.end_headers()
+        standin = self.server.standin
+        if not standin.bandwidth:
+            self.wfile.write(body)
+        else:
+            # Trickle the body out in 64 KB pieces to simulate a slow connection
+            for start in range(0, len(body), 64 * 1024):
+                try:
+                    self.wfile.write(body[start:start + 64 * 1024])
+                    self.wfile.flush()
+                except OSError:
+                    return # client went away (e.g. a cancelled download)
+                time.sleep(64 * 1024 / standin.bandwidth)
+        standin._count("requests", len(body))
+
+class _Server(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # A client that exits with downloads still going (a benchmark run ending mid-prefetch) isn't an error
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+class StandinServer:
+    """Serves synthetic Imgur albums and images on localhost.
+
+    albums: dict of album ID -> list of image IDs.
+    image_size: size of every image, in bytes, or a callable taking the image ID and returning its size.
+    latency: seconds to wait before answering each request.
+    bandwidth: if given, bytes per second to send response bodies at.
+    page_size: if given, album pages only list this many images each.
+    """
+
+    def __init__(self, albums, image_size=200 * 1024, latency=0.0, bandwidth=None, page_size=None):
+        self.albums = albums
+        self.page_size = page_size
+        self.image_size = image_size
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.connections = 0
+        self.requests = 0
+        self.bytes_sent = 0
+        self._lock = threading.Lock()
+        self._open = set() # sockets of the connections that are open
+        self._server = None
+
+    def album_page(self, album_id, page=1):
+        """Returns page number page of the album page for album_id, as bytes (None if there's no such page)."""
+        image_ids = self.albums[album_id]
+        links = ""
+        if self.page_size:
+            pages = max(1, (len(image_ids) + self.page_size - 1) // self.page_size)
+            if not 1 <= page <= pages:
+                return None
+            image_ids = image_ids[(page - 1) * self.page_size:page * self.page_size]
+            # Like a typical pager: the two pages either side, and the last one
+            links = "".join('<a href="/a/%s/layout/blog?page=%i">%i</a>\n' % (album_id, linked, linked)
+                            for linked in sorted(set(range(max(1, page - 2), min(pages, page + 2) + 1)) | {pages}))
+        rows = ['<div id="%s" class="post-image-container post-image-container-blog">\n'
+                '  <div class="post-image"><img src="//i.imgur.com/%s.jpg"/></div>\n</div>\n' % (image_id, image_id)
+                for image_id in image_ids]
+        return ("<html><body>\n" + "".join(rows) + links + "</body></html>\n").encode('utf-8')
+
+    def image(self, image_id):
+        """Returns the (deterministic, junk) bytes of the image with ID image_id."""
+        size = self.image_size(image_id) if callable(self.image_size) else self.image_size
+        seed = hashlib.sha256(image_id.encode('utf-8')).digest()
+        return (seed * (size // len(seed) + 1))[:size]
+
+    def _count(self, what, sent_bytes):
+        with self._lock:
+            if what == "connections":
+                self.connections += 1
+            else:
+                self.requests += 1
+                self.bytes_sent += sent_bytes
+
+    @property
+    def url(self):
+        """The base URL of the server, e.g. http://127.0.0.1:54321"""
+        return "http://127.0.0.1:%i" % self._server.server_address[1]
+
+    def start(self):
+        self._server = _Server(("127.0.0.1", 0), _Handler)
+        self._server.standin = self
+        threading.Thread(target=self._server.serve_forever, name="StandinServer", daemon=True).start()
+        return self
+
+    def drop_connections(self):
+        """Closes every open connection, like a server timing out its idle keep-alive connections. Call it between requests."""
+        with self._lock:
+            connections = list(self._open)
+        for connection in connections:
+            try:
+                connection.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass # already closed
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
@@ -0,0 +1,134 @@
+# Copyright Patrick Perrier, 2015
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Startup-time benchmark: how long from "import imgurswitcher" until the keyboard hook goes in.
+
+Each run happens in a fresh interpreter so that nothing is already imported. The platform
+main (which installs the keyboard hook first thing) is replaced by a stub that records the
+time it was entered and returns, so the benchmark doesn't need a message pump. Also records
+how long the background album load takes after that, and whether tkinter got imported
+before the hook.
+
+Like e2e.py, it needs no desktop and no network: the runs use the Headless platform, load the
+album from the local Imgur stand-in (imgur_standin.py) and each get an empty scratch data
+directory, so the package's own data directory is left alone.
+
+Usage (from the src directory): python benchmarks/startup.py [--runs N] [--album-size 100] [--latency-ms 50]
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import statistics
+import subprocess
+
+_SRC_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+_PACKAGE_DATA_DIR = os.path.join(_SRC_DIR, "imgurswitcher", "data")
+
+ALBUM_ID = "bench1"
+
+# Same as imgurswitcher.DATA_DIR_VARIABLE and config.PLATFORM_VARIABLE; not imported so that
+# this process doesn't touch the package's data directory
+DATA_DIR_VARIABLE = "IMGURSWITCHER_DATA_DIR"
+PLATFORM_VARIABLE = "IMGURSWITCHER_PLATFORM"
+
+def _measure_once(standin_url):
+    """Does a single measurement in this (fresh) interpreter and prints it as JSON."""
+    sys.path.insert(0, _SRC_DIR)
+    start = time.perf_counter()
+    import imgurswitcher
+    imported = time.perf_counter()
+    imgurswitcher.init()
+    initialized = time.perf_counter()
+
+    # The album is loaded by main's Startup thread, which imports imgur_callbacks; point it at the stand-in there
+    # (importing it here would count its import time towards the hook)
+    start_services = imgurswitcher._start_services
+    def start_services_on_standin():
+        from imgurswitcher.imgur_callbacks import ImgurCallbacks
+        ImgurCallbacks.imgur_stub = standin_url + "/"
+        ImgurCallbacks.album_stub = standin_url + "/a/"
+        start_services()
+    imgurswitcher._start_services = start_services_on_standin
+
+    hooked = []
+    def fake_platform_main():
+        hooked.append(time.perf_counter())
+        hooked.append("tkinter" in sys.modules)
+    imgurswitcher.cfg.Main = fake_platform_main
+    imgurswitcher.main()
+
+    from imgurswitcher.imgur_callbacks import ImgurCallbacks
+    ImgurCallbacks._loaded.wait(60)
+    loaded = time.perf_counter()
+
+    print(json.dumps({
+        "import_ms": (imported - start) * 1000,
+        "init_ms": (initialized - imported) * 1000,
+        "import_to_hook_ms": (hooked[0] - start) * 1000,
+        "hook_to_album_loaded_ms": (loaded - hooked[0]) * 1000,
+        "tkinter_imported_before_hook": hooked[1],
+    }))
+
+def _run_child(standin_url):
+    """Runs one measurement in a fresh interpreter with a scratch data directory and returns its results."""
+    data_dir = tempfile.mkdtemp(prefix="imgurswitcher-bench-")
+    try:
+        shutil.copy(os.path.join(_PACKAGE_DATA_DIR, "default.jpg"), data_dir)
+        with open(os.path.join(data_dir, "config.cfg"), 'w') as config_file:
+            config_file.write("url: http://imgur.com/a/%s\nposition: 0\n" % ALBUM_ID)
+
+        env = dict(os.environ)
+        env[DATA_DIR_VARIABLE] = data_dir
+        env[PLATFORM_VARIABLE] = "Headless"
+        command = [sys.executable, os.path.abspath(__file__), "--child", standin_url]
+        output = subprocess.check_output(command, cwd=_SRC_DIR, env=env)
+        return json.loads(output.decode('utf-8').strip().splitlines()[-1])
+    finally:
+        shutil.rmtree(data_dir, ignore_errors=True)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=10, help="number of fresh-interpreter runs")
+    parser.add_argument("--album-size", type=int, default=100, help="number of images in the album")
+    parser.add_argument("--latency-ms", type=int, default=50, help="stand-in latency per request")
+    parser.add_argument("--child", metavar="STANDIN_URL", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        _measure_once(args.child)
+        return
+
+    # The stand-in runs in this process, so that the children only import what the program does
+    sys.path.insert(0, _SRC_DIR)
+    from benchmarks.imgur_standin import StandinServer
+    server = StandinServer({ALBUM_ID: ["img%04d" % i for i in range(args.album_size)]},
+                           latency=args.latency_ms / 1000.0).start()
+    try:
+        results = [_run_child(server.url) for _ in range(args.runs)]
+    finally:
+        server.stop()
+
+    for key in ("import_ms", "init_ms", "import_to_hook_ms", "hook_to_album_loaded_ms"):
+        values = [result[key] for result in results]
+        print("%-26s median %8.2f  min %8.2f  max %8.2f" % (key, statistics.median(values), min(values), max(values)))
+    print("tkinter imported before hook in %i of %i runs" % (sum(r["tkinter_imported_before_hook"] for r in results), len(results)))
+
+if __name__ == "__main__":
+    main()
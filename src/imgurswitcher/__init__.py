@@ -15,10 +15,17 @@
 
 # Name of the log file. Will be created in the same directory as this script.
 LOG_FILE_NAME = "imgur_switcher_log.txt"
+# The log is rotated (to .1, .1 to .2, ...) when it gets bigger than this, and at every start,
+# so the previous run's log is the .1 file. LOG_BACKUP_COUNT old logs are kept.
+LOG_MAX_BYTES = 1024 * 1024
+LOG_BACKUP_COUNT = 3
 
 import logging
+import logging.handlers
 import os
+import queue
 import atexit
+import threading
 
 
 ###########################################################################
@@ -31,33 +38,114 @@ _pkg_dir, _last_dir = os.path.split(_ROOT)
 if os.path.isfile(_pkg_dir):
     _ROOT = os.path.split(_pkg_dir)[0]
 
+# The data directory can be moved elsewhere by setting this environment variable
+# (the benchmarks use this to run against a scratch directory)
+DATA_DIR_VARIABLE = "IMGURSWITCHER_DATA_DIR"
+_DATA_DIR = os.environ.get(DATA_DIR_VARIABLE) or os.path.join(_ROOT, 'data')
+
 def get_data(path):
-    return os.path.join(_ROOT, 'data', path)
+    return os.path.join(_DATA_DIR, path)
 
 ############################################################################
 
+class _QueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that leaves the formatting of the messages to the log writer thread.
+
+    The stock one formats them on the thread that logs (so that the records could be pickled),
+    but these never leave the process. Arguments are formatted when the record is written,
+    so don't log an object that is about to be changed.
+    """
+
+    def prepare(self, record):
+        return record
+
+def _start_logging():
+    """Sends the log to a background thread that writes it to the (rotated) log file.
+
+    Logging calls only put the record in a queue, so the keyboard hook and the workers
+    never wait on the disk. Does nothing if logging was already set up, like basicConfig.
+    """
+    root = logging.getLogger()
+    if root.handlers:
+        return
+    path = get_data(LOG_FILE_NAME)
+    file_handler = logging.handlers.RotatingFileHandler(path, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUP_COUNT, delay=True)
+    file_handler.setFormatter(logging.Formatter(logging.BASIC_FORMAT))
+    try:
+        if os.path.getsize(path) > 0:
+            file_handler.doRollover()
+    except OSError:
+        pass # no log from a previous run
+
+    log_queue = queue.Queue()
+    listener = logging.handlers.QueueListener(log_queue, file_handler)
+    listener.start()
+    # Registered first so that it runs last: writes out everything that was logged before exiting
+    atexit.register(listener.stop)
+    root.addHandler(_QueueHandler(log_queue))
+
 logger = logging.getLogger(__name__)
-logging.basicConfig(filename=get_data(LOG_FILE_NAME), filemode='w')
+_start_logging()
 logger.setLevel(logging.INFO)
 logger.debug("_ROOT is %s", _ROOT)
 
-# This order matters
+# Importing the package doesn't do any work; call init() and then main().
+# Nothing in here touches the network, so that the keyboard hook goes in
+# as soon as possible. The album is loaded in the background by main.
 from . import event_queue
-from . import config as cfg # also ensures that the initialization is run
-
-# Initialize what needs initializing, specifically in this order
-event_queue.init()
-cfg.set_platform_config()
-
-# Make sure that on exit we call the exit function
-atexit.register(cfg.write_config_to_file)
+from . import config as cfg
 
 # Make available common parts from the package level
 # Worker depends on the event queue being initialized
-from .worker import Worker
-
-# Set the main function to use based on the platform
-main = cfg.Main
+from .worker import Worker, PoolWorker, AsyncWorker, create_worker
+
+_initialized = False
+
+def init():
+    """Reads the configuration, sets up the event queue and the platform-specific configuration.
+
+    Only does local work (no network access), so it is quick. Call before starting
+    a Worker and before main.
+    """
+    global _initialized
+    if _initialized:
+        return
+
+    # Initialize what needs initializing, specifically in this order
+    cfg.init()
+    event_queue.init()
+    cfg.set_platform_config()
+
+    # Make sure that on exit we call the exit function
+    atexit.register(cfg.write_config_to_file)
+    _initialized = True
+
+def _start_services():
+    """Starts loading the album, and everything else that runs alongside the platform main."""
+    from . import imgur_callbacks
+    imgur_callbacks.load_images()
+    from . import metrics_endpoint
+    if cfg.metrics_port:
+        metrics_endpoint.start(cfg.metrics_port)
+    cfg.add_reload_listener(metrics_endpoint.on_config_reload)
+    from . import config_watcher
+    config_watcher.start()
+    from . import album_refresher
+    album_refresher.start()
+
+def main():
+    """Starts loading the album in the background and runs the platform-specific main (which installs the keyboard hook).
+
+    Changes to the config file are picked up while it runs (see config_watcher.py), and the album
+    is checked for changes every refresh_minutes (see album_refresher.py).
+
+    Key presses made before the album has loaded are queued and handled once it has.
+    """
+    init()
+    # Importing imgur_callbacks (and the HTTP client, album indexer etc. with it) takes tens of
+    # milliseconds; that's done on this thread, so that the hook doesn't wait for it
+    threading.Thread(target=_start_services, name="Startup", daemon=True).start()
+    cfg.Main()
 
 
 __all__ = [] # don't want to support using "from imgurswitcher import *""
\ No newline at end of file
@@ -0,0 +1,91 @@
+# Copyright Patrick Perrier, 2015
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Module that keeps the parsed image ID list of each album on disk.
+
+Each album's ID list is stored in its own file (named after the album ID) along with
+the ETag and Last-Modified headers that Imgur sent with the album page. On later starts
+the stored list can be used right away, and the headers let the album page be revalidated
+with a conditional GET instead of being downloaded and parsed again.
+
+The IDs are stored in album_index.AlbumIndex's packed form (one string, every ID padded to
+the same width), which loads much faster than a list of 100000 strings. Files written as a
+list of IDs by older versions are still read.
+"""
+
+import os
+import json
+import logging
+from . import get_data
+from .album_index import AlbumIndex
+
+logger = logging.getLogger(__name__)
+
+# Directory (inside the data directory) where the album index files are kept
+ALBUM_DIR_NAME = "albums"
+
+def _path_for(album_id):
+    return os.path.join(get_data(ALBUM_DIR_NAME), album_id + ".json")
+
+def load(album_id):
+    """Returns the stored index for album_id, or None if there isn't a usable one.
+
+    The index is a dict with the keys "ids" (the image IDs, as an album_index.AlbumIndex), "etag"
+    and "last_modified" (the validators from the album page, either of which may be None) and
+    "last_page" (see album_indexer.fetch; None for an album of one page).
+    """
+    path = _path_for(album_id)
+    try:
+        with open(path, 'r') as index_file:
+            index = json.load(index_file)
+        if "packed" in index:
+            index["ids"] = AlbumIndex.from_packed(index["width"], index["packed"].encode('ascii'))
+        else:
+            index["ids"] = AlbumIndex(index.get("ids") or ())
+    except FileNotFoundError:
+        logger.info("No stored index for album %s", album_id)
+        return None
+    except Exception as e:
+        logger.warning("Could not read stored index for album %s at %s. Reason: %s", album_id, path, e)
+        return None
+
+    if not index["ids"]:
+        logger.warning("Stored index for album %s is empty, ignoring it", album_id)
+        return None
+
+    logger.info("Loaded stored index for album %s (%i images)", album_id, len(index["ids"]))
+    return {"ids": index["ids"], "etag": index.get("etag"), "last_modified": index.get("last_modified"),
+            "last_page": index.get("last_page")}
+
+def save(album_id, ids, etag=None, last_modified=None, last_page=None):
+    """Stores the image ID list (an AlbumIndex, or a list of IDs) and the album page validators for album_id.
+
+    last_page: the number and validators of the album's last page (see album_indexer.fetch), if it has more than one.
+
+    Written to a temporary file and then renamed so that a crash can't leave a half-written index.
+    """
+    path = _path_for(album_id)
+    if not isinstance(ids, AlbumIndex):
+        ids = AlbumIndex(ids)
+    width, packed = ids.packed()
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path + ".tmp", 'w') as index_file:
+            json.dump({"width": width, "packed": packed.decode('ascii'), "etag": etag, "last_modified": last_modified,
+                       "last_page": last_page}, index_file)
+        os.replace(path + ".tmp", path)
+        logger.info("Stored index for album %s (%i images)", album_id, len(ids))
+    except Exception as e:
+        logger.warning("Could not store index for album %s at %s. Reason: %s", album_id, path, e)
@@ -0,0 +1,139 @@
+# Copyright Patrick Perrier, 2015
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Module that works out what changed between two versions of an album's image list.
+
+Albums are mostly edited at the end (new images added) or in one place, so diff first finds
+how much of the start and of the end of the two lists is the same, by comparing the packed
+IDs (see album_index.py) a big slice at a time rather than one ID at a time. Only what is left in
+the middle is compared ID by ID, so the work done in Python grows with the size of the
+change, not the size of the album.
+"""
+
+from bisect import bisect_left
+
+class AlbumDiff:
+    """What changed from one image list to the next.
+
+    added: the IDs that are new, in their new order. removed: the IDs that are gone.
+    moved: the IDs that are in both lists but aren't in the same order as before relative
+    to the others (as few as possible). False in a boolean context if nothing changed.
+    """
+
+    def __init__(self, added, removed, moved, prefix, old_end, new_end, middle_positions):
+        self.added = added
+        self.removed = removed
+        self.moved = moved
+        self._prefix = prefix # length of the common start
+        self._old_end = old_end # where the common end starts in the old list
+        self._new_end = new_end # ... and in the new one
+        self._middle_positions = middle_positions # ID -> new position, for the IDs in both middles
+
+    def __bool__(self):
+        return bool(self.added or self.removed or self.moved or self._old_end != self._new_end)
+
+    def __repr__(self):
+        return "<AlbumDiff: %i added, %i removed, %i moved>" % (len(self.added), len(self.removed), len(self.moved))
+
+    def new_position(self, old_position, image_id):
+        """Returns the position in the new list of image_id, which was at old_position in the old one (None if it was removed)."""
+        if old_position < self._prefix:
+            return old_position
+        if old_position >= self._old_end:
+            return old_position - self._old_end + self._new_end
+        return self._middle_positions.get(image_id)
+
+def _common_length(old_data, new_data, width, count, from_end):
+    """Returns how many IDs (of the first count) are the same at the start (or end) of the packed old_data and new_data."""
+    # startswith/endswith with a memoryview compare in place, where comparing two slices would copy them first
+    new_view = memoryview(new_data)
+    if from_end:
+        same = lambda n: old_data.endswith(new_view[len(new_data) - n * width:])
+    else:
+        same = lambda n: old_data.startswith(new_view[:n * width])
+    # Binary search on the length; each comparison is a memcmp
+    low, high = 0, count
+    while low < high:
+        middle = (low + high + 1) // 2
+        if same(middle):
+            low = middle
+        else:
+            high = middle - 1
+    return low
+
+def _kept_in_order(old_positions):
+    """Returns the set of indices into old_positions of a longest increasing run (not necessarily contiguous) of it."""
+    tails = [] # tails[k]: old position ending the best run of length k + 1 so far
+    tail_indices = []
+    previous = [None] * len(old_positions)
+    for i, position in enumerate(old_positions):
+        k = bisect_left(tails, position)
+        if k == len(tails):
+            tails.append(position)
+            tail_indices.append(i)
+        else:
+            tails[k] = position
+            tail_indices[k] = i
+        previous[i] = tail_indices[k - 1] if k else None
+    kept = set()
+    i = tail_indices[-1] if tail_indices else None
+    while i is not None:
+        kept.add(i)
+        i = previous[i]
+    return kept
+
+def _positions(ids, start, end):
+    """Returns a dict of ID -> position for ids[start:end] (the first one, if an ID is in there twice) and the list of those IDs in order."""
+    positions = {}
+    order = []
+    for position in range(start, end):
+        image_id = ids[position]
+        if image_id not in positions:
+            positions[image_id] = position
+            order.append(image_id)
+    return positions, order
+
+def diff(old, new):
+    """Returns the AlbumDiff from old to new (album_index.AlbumIndex objects).
+
+    The IDs in each list are expected to be unique, as they are in an Imgur album.
+    """
+    old_width, old_data = old.packed()
+    new_width, new_data = new.packed()
+    count = min(len(old), len(new))
+    if old_width == new_width:
+        prefix = _common_length(old_data, new_data, old_width, count, False)
+        suffix = _common_length(old_data, new_data, old_width, count - prefix, True)
+    else:
+        # The IDs are padded differently, so the packed forms can't be compared; do it one at a time
+        prefix = 0
+        while prefix < count and old[prefix] == new[prefix]:
+            prefix += 1
+        suffix = 0
+        while suffix < count - prefix and old[len(old) - 1 - suffix] == new[len(new) - 1 - suffix]:
+            suffix += 1
+    old_end, new_end = len(old) - suffix, len(new) - suffix
+
+    # The orders are kept in lists as well; a dict's isn't its insertion order before Python 3.6
+    old_middle, old_order = _positions(old, prefix, old_end)
+    new_middle, new_order = _positions(new, prefix, new_end)
+
+    added = [image_id for image_id in new_order if image_id not in old_middle]
+    removed = [image_id for image_id in old_order if image_id not in new_middle]
+    both = [image_id for image_id in new_order if image_id in old_middle] # in their new order
+    kept = _kept_in_order([old_middle[image_id] for image_id in both])
+    moved = [image_id for i, image_id in enumerate(both) if i not in kept]
+    return AlbumDiff(added, removed, moved, prefix, old_end, new_end,
+                     dict((image_id, new_middle[image_id]) for image_id in both))
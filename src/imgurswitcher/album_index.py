@@ -0,0 +1,144 @@
+# Copyright Patrick Perrier, 2015
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Module that holds the image ID list of an album in a compact form.
+
+A list of 100000 str objects takes several megabytes, and finding an image in it by ID means
+going through the list. AlbumIndex packs the IDs (which are short and ASCII) into one bytes
+object, each padded to the length of the longest one, and looks IDs up through a hash table
+of positions kept in an array (built the first time it's needed), so position_of is O(1) without
+a Python object per image.
+
+AlbumIndex is read-only, and otherwise works like the list of IDs it was made from (len,
+indexing, iteration, ==), so it can be handed to anything that expects that list.
+"""
+
+import threading
+from array import array
+
+_EMPTY = -1 # free slot in the hash table
+_PAD = b" " # pads the IDs to the same width (never in an ID, and stored as is in JSON, see album_cache.py)
+
+class AlbumIndex:
+    """The image IDs of an album, in album order. ids: an iterable of ID strings (ASCII)."""
+
+    def __init__(self, ids=()):
+        encoded = [image_id.encode('ascii') for image_id in ids]
+        self._width = max(map(len, encoded), default=0)
+        self._count = len(encoded)
+        self._data = b"".join(image_id.ljust(self._width, _PAD) for image_id in encoded)
+        self._table = None # hash table of positions, see _build_table
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_packed(cls, width, data):
+        """Returns the AlbumIndex with the packed form (width, data), as returned by packed."""
+        if width <= 0 or len(data) % width:
+            raise ValueError("Packed album index of %i bytes doesn't hold IDs of width %i" % (len(data), width))
+        index = cls()
+        index._width = width
+        index._count = len(data) // width
+        index._data = bytes(data)
+        return index
+
+    def packed(self):
+        """Returns (width, data): the width each ID is padded to (with spaces) and the packed IDs."""
+        return self._width, self._data
+
+    def __len__(self):
+        return self._count
+
+    def __getitem__(self, position):
+        if position < 0:
+            position += self._count
+        if not 0 <= position < self._count:
+            raise IndexError("album index position out of range")
+        start = position * self._width
+        return self._data[start:start + self._width].rstrip(_PAD).decode('ascii')
+
+    def __iter__(self):
+        for position in range(self._count):
+            yield self[position]
+
+    def __eq__(self, other):
+        if isinstance(other, AlbumIndex):
+            return self._count == other._count and (self._count == 0 or
+                   (self._width == other._width and self._data == other._data) or list(self) == list(other))
+        if isinstance(other, list):
+            return list(self) == other
+        return NotImplemented
+
+    def __repr__(self):
+        return "<AlbumIndex of %i images>" % self._count
+
+    def __sizeof__(self):
+        table = self._table
+        return object.__sizeof__(self) + self._data.__sizeof__() + (table.__sizeof__() if table is not None else 0)
+
+    def _key(self, image_id):
+        """Returns image_id as it is stored in _data, or None if it can't be in there."""
+        try:
+            key = image_id.encode('ascii')
+        except (UnicodeEncodeError, AttributeError):
+            return None
+        if not key or len(key) > self._width or _PAD in key:
+            return None
+        return key.ljust(self._width, _PAD)
+
+    def _build_table(self):
+        """Builds the open-addressing hash table: an array of positions, at least twice as long as there are IDs."""
+        size = 8
+        while size < 2 * self._count:
+            size *= 2
+        mask = size - 1
+        table = array('i', [_EMPTY]) * size
+        data, width = self._data, self._width
+        for position in range(self._count):
+            key = data[position * width:(position + 1) * width]
+            slot = hash(key) & mask
+            while table[slot] != _EMPTY:
+                # A repeated ID keeps its first position
+                other = table[slot]
+                if data[other * width:(other + 1) * width] == key:
+                    break
+                slot = (slot + 1) & mask
+            else:
+                table[slot] = position
+        return table
+
+    def position_of(self, image_id):
+        """Returns the (0-indexed) position of image_id in the album, or None if it isn't in it."""
+        key = self._key(image_id)
+        if key is None:
+            return None
+        table = self._table
+        if table is None:
+            with self._lock:
+                if self._table is None:
+                    self._table = self._build_table()
+                table = self._table
+        mask = len(table) - 1
+        slot = hash(key) & mask
+        data, width = self._data, self._width
+        while True:
+            position = table[slot]
+            if position == _EMPTY:
+                return None
+            if data[position * width:(position + 1) * width] == key:
+                return position
+            slot = (slot + 1) & mask
+
+    def __contains__(self, image_id):
+        return self.position_of(image_id) is not None
@@ -0,0 +1,283 @@
+# Copyright Patrick Perrier, 2015
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Module that downloads the image ID list of an album, all of its pages.
+
+The scriptless album page doesn't always list every image of a very big album; the rest are
+on further pages (?page=2, ?page=3, ...) that it links to. fetch downloads the first page
+(streamed through album_parser, as before), then the pages it links to, up to half of
+config.http_connections of them at a time (the rest are left for the image downloads, so that
+moving through the first pages isn't held up by the loading of the others).
+Pages can link to pages that weren't linked from the first one, so the set of pages to fetch
+grows until every page that is linked to has been fetched.
+
+Pages can come in in any order; their IDs are merged in page order, and on_ids is called
+with the IDs of all the pages in an unbroken run from the first one each time that run
+grows, so a huge album can be used from its first pages while the rest are still loading.
+
+A refresh requests the first page conditionally. If it hasn't changed and the album has more
+pages, the last one is revalidated too, since that is where images added to the album show up
+(and it links to any page added after it). The album is only taken not to have changed if
+neither has; otherwise all of it is fetched again.
+"""
+
+import time
+import logging
+import threading
+from collections import deque
+from . import config as cfg
+from . import worker
+from . import metrics
+from . import album_parser
+from . import exceptions as xcpt
+from .http_client import get_client
+
+logger = logging.getLogger(__name__)
+
+# No more pages than this are fetched for one album (in case of a page that links to pages forever)
+MAX_PAGES = 1000
+
+def page_url(url, page):
+    """Returns the URL of page number page of the album page at url (page 1 is url itself)."""
+    if page == 1:
+        return url
+    return url + ("&" if "?" in url else "?") + "page=%i" % page
+
+class _Merger:
+    """Puts the pages of an album back together in page order, and keeps track of the pages still to fetch.
+
+    Thread-safe. on_ids is called (with the lock held, so the calls are in order) with the IDs
+    of pages 1 to n each time n grows.
+    """
+
+    def __init__(self, on_ids=None):
+        self.ids = []
+        self._on_ids = on_ids
+        self._lock = threading.Lock()
+        self._done = {} # page -> IDs, for the pages that came in before a page in front of them
+        self._known = set([1])
+        self._next = 1 # first page that isn't in ids yet
+        self.validators = {} # page -> (ETag, Last-Modified) of its response
+
+    def add(self, page, ids, links, headers):
+        """Adds the IDs of page, which links to the pages in links. Returns the pages in links that are new, to fetch next.
+
+        headers: the page's response headers, for its validators.
+        """
+        with self._lock:
+            self.validators[page] = (headers.get("ETag"), headers.get("Last-Modified"))
+            self._done[page] = ids
+            new_pages = sorted(link for link in links if link not in self._known and 1 < link <= MAX_PAGES)
+            self._known.update(new_pages)
+            merged = self._next
+            while self._next in self._done:
+                self.ids.extend(self._done.pop(self._next))
+                self._next += 1
+            logger.info("Album page %i in, %i of %i pages merged so far (%i images)", page, self._next - 1,
+                        len(self._known), len(self.ids))
+            if self._next != merged and self._on_ids is not None:
+                self._on_ids(self.ids)
+            return new_pages
+
+def _parser_for(page, on_ids):
+    """Returns (parser, function that feeds it a chunk). The first page passes its IDs to on_ids while it streams in."""
+    parser = album_parser.AlbumPageParser()
+    started = time.perf_counter()
+    def parse(chunk):
+        new_ids = parser.feed(chunk)
+        if new_ids and page == 1:
+            if len(new_ids) == len(parser.ids):
+                metrics.observe_since("album.first_ids_ms", started)
+            if on_ids is not None:
+                on_ids(parser.ids)
+    return parser, parse
+
+def _fetch_page(url, page, headers, merger, on_ids):
+    """Downloads and parses one page. Returns (status, response headers, new pages to fetch)."""
+    parser, parse = _parser_for(page, on_ids)
+    with get_client().get(page_url(url, page), headers) as response:
+        if response.status == 304:
+            return response.status, response.headers, []
+        for chunk in response.iter_chunks():
+            parse(chunk)
+    metrics.increment("album.pages")
+    return response.status, response.headers, merger.add(page, parser.close(), parser.pages, response.headers)
+
+@worker.coroutine
+def _fetch_page_async(url, page, headers, merger, on_ids):
+    """_fetch_page for the asyncio runtime."""
+    from . import async_http_client
+    parser, parse = _parser_for(page, on_ids)
+    with (yield from async_http_client.get_client().get(page_url(url, page), headers)) as response:
+        if response.status == 304:
+            return response.status, response.headers, []
+        while True:
+            chunk = yield from response.read_chunk()
+            if not chunk:
+                break
+            parse(chunk)
+    metrics.increment("album.pages")
+    return response.status, response.headers, merger.add(page, parser.close(), parser.pages, response.headers)
+
+def _page_failed(page, e):
+    # Not an HttpError, so that a 404 for a later page isn't taken for a 404 for the album
+    return xcpt.ImgurSwitcherException("Fetching page %i of the album failed: %s" % (page, e))
+
+def _fetch_rest(url, pages, merger, parallel):
+    """Fetches pages, and the pages they link to, on parallel threads of its own.
+
+    Uses threads of its own rather than the background executor, since it is often running on
+    one of those (and would be waiting on itself). Raises the first error, once the pages being
+    fetched are done.
+    """
+    to_fetch = deque(pages)
+    errors = []
+    busy = [0]
+    changed = threading.Condition()
+
+    def fetch_pages():
+        while True:
+            with changed:
+                # Wait for more pages while the pages being fetched might still link to some
+                while not to_fetch and busy[0] and not errors:
+                    changed.wait()
+                if not to_fetch or errors:
+                    return
+                page = to_fetch.popleft()
+                busy[0] += 1
+            new_pages = []
+            try:
+                new_pages = _fetch_page(url, page, {}, merger, None)[2]
+            except Exception as e:
+                with changed:
+                    errors.append(_page_failed(page, e))
+            with changed:
+                to_fetch.extend(new_pages)
+                busy[0] -= 1
+                changed.notify_all()
+
+    # All of them, even if fewer pages are known so far, since those pages can link to more
+    threads = [threading.Thread(target=fetch_pages, name="AlbumPages-%i" % i, daemon=True) for i in range(parallel)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if errors:
+        raise errors[0]
+
+@worker.coroutine
+def _fetch_all_async(url, headers, merger, on_ids, parallel):
+    """Fetches the first page and then the rest, at most parallel at a time, on the event loop. Returns (status, response headers) of the first page."""
+    import asyncio
+    status, response_headers, to_fetch = yield from _fetch_page_async(url, 1, headers, merger, on_ids)
+    to_fetch = deque(to_fetch)
+    running = set()
+    pages = {} # task -> page it is fetching
+    loop = asyncio.get_event_loop()
+    try:
+        while to_fetch or running:
+            while to_fetch and len(running) < parallel:
+                page = to_fetch.popleft()
+                task = loop.create_task(_fetch_page_async(url, page, {}, merger, None))
+                pages[task] = page
+                running.add(task)
+            done, running = yield from asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                try:
+                    to_fetch.extend(task.result()[2])
+                except Exception as e:
+                    raise _page_failed(pages[task], e)
+    finally:
+        for task in running:
+            task.cancel()
+    return status, response_headers
+
+def _conditional_headers(etag, last_modified):
+    headers = {}
+    if etag:
+        headers["If-None-Match"] = etag
+    if last_modified:
+        headers["If-Modified-Since"] = last_modified
+    return headers
+
+def _page_status(url, page, headers):
+    """Returns the status of a (conditional) request for page, without reading the page."""
+    with get_client().get(page_url(url, page), headers) as response:
+        return response.status
+
+@worker.coroutine
+def _page_status_async(url, page, headers):
+    """_page_status for the asyncio runtime."""
+    from . import async_http_client
+    with (yield from async_http_client.get_client().get(page_url(url, page), headers)) as response:
+        return response.status
+
+def _last_page_changed(url, last_page):
+    """Returns True if the last page of the album (last_page, as returned by fetch) isn't what it was."""
+    headers = _conditional_headers(last_page.get("etag"), last_page.get("last_modified"))
+    if not headers:
+        return True # nothing to revalidate it with
+    executor = worker.background_executor()
+    try:
+        if getattr(executor, "runs_coroutines", False):
+            status = executor.submit(_page_status_async, url, last_page["page"], headers).result()
+        else:
+            status = _page_status(url, last_page["page"], headers)
+    except xcpt.HttpError:
+        return True # e.g. the album has fewer pages now
+    return status != 304
+
+def fetch(url, etag=None, last_modified=None, on_ids=None, parallel=None, last_page=None):
+    """Downloads all the pages of the album page at url and returns the image IDs in them, in order.
+
+    etag, last_modified: the validators of a stored copy of the first page. If given, the
+    request is made conditional, so nothing is downloaded when the album hasn't changed.
+    on_ids: if given, called with the list of the IDs found so far (from the start of the album)
+    each time more of them come in, while the album is still downloading. Shouldn't block.
+    parallel: how many pages to fetch at a time, by default half of config.http_connections.
+    last_page: for an album of more than one page, what fetch returned for it with the stored copy.
+    If the first page hasn't changed, the album is only taken not to have changed if this one hasn't either.
+
+    Returns a tuple (ids, etag, last_modified, last_page) with the new validators; ids is None if the
+    album hasn't changed since the stored copy. last_page is a dict with the number ("page") and the
+    validators ("etag", "last_modified") of the album's last page, or None if it only has the one.
+    Lets the HTTP client's exceptions through.
+    """
+    headers = _conditional_headers(etag, last_modified)
+    parallel = parallel or max(1, cfg.http_connections // 2)
+    merger = _Merger(on_ids)
+
+    executor = worker.background_executor()
+    if getattr(executor, "runs_coroutines", False):
+        # The asyncio runtime does its network I/O on its event loop
+        status, response_headers = executor.submit(_fetch_all_async, url, headers, merger, on_ids, parallel).result()
+    else:
+        status, response_headers, to_fetch = _fetch_page(url, 1, headers, merger, on_ids)
+        if to_fetch:
+            _fetch_rest(url, to_fetch, merger, parallel)
+
+    if status == 304:
+        if last_page is None or not _last_page_changed(url, last_page):
+            return None, etag, last_modified, last_page
+        logger.info("Page 1 of the album at %s is unchanged but its last page (%i) isn't, fetching the whole album", url, last_page["page"])
+        return fetch(url, on_ids=on_ids, parallel=parallel)
+
+    last = max(merger.validators)
+    if last > 1:
+        last_etag, last_last_modified = merger.validators[last]
+        last_page = {"page": last, "etag": last_etag, "last_modified": last_last_modified}
+    else:
+        last_page = None
+    return merger.ids, response_headers.get("ETag"), response_headers.get("Last-Modified"), last_page
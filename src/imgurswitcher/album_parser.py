@@ -0,0 +1,86 @@
+# Copyright Patrick Perrier, 2015
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Module that picks the image IDs out of an album page while it is still downloading.
+
+The album page of a big wallpaper dump is several megabytes of HTML. Rather than wait for
+all of it, decode it and search the whole string, AlbumPageParser is fed the raw chunks as
+they come off the network and hands back the IDs in each one straight away. Only the end of
+the previous chunk (in case an ID is split across two chunks) is kept between feeds, so memory
+use doesn't grow with the page.
+
+It also collects the numbers of the other pages of the album that the page links to
+(?page=N links), for album_indexer to fetch.
+"""
+
+import re
+
+# Image IDs longer than this aren't recognised (Imgur's are 5 to 7 characters)
+MAX_ID_LENGTH = 64
+
+# Picks the image IDs out of an album page. Found by inspecting the source of an imgur album page
+_PREFIX = b'<div id="'
+_SUFFIX = b'" class="post-image-container'
+_IMAGE_ID_PATTERN = re.compile(re.escape(_PREFIX) + ("([a-zA-Z0-9]{1,%i})" % MAX_ID_LENGTH).encode('ascii') + re.escape(_SUFFIX))
+
+# Longest possible match; only a _PREFIX in the last (this - 1) bytes of the data can start one that isn't complete yet
+_MAX_MATCH_LENGTH = len(_PREFIX) + MAX_ID_LENGTH + len(_SUFFIX)
+
+# Picks the page numbers out of the links to the album's other pages, e.g. href="/a/abc12/layout/blog?page=3"
+_PAGE_PATTERN = re.compile(rb"[?&]page=([0-9]{1,6})[\"'&#]")
+
+# Bytes to keep after a chunk, so that a page link cut off at its end is seen whole with the next one
+# (shorter than the shortest image ID match, so none is found twice)
+_KEEP = len("&page=123456\"") - 1
+
+class AlbumPageParser:
+    """Incremental parser for an album page. Call feed with each chunk of the page (bytes), in order.
+
+    ids is the list of all the image IDs found so far, in page order, and pages the set of
+    page numbers linked to so far.
+    """
+
+    def __init__(self):
+        self.ids = []
+        self.pages = set()
+        self._tail = b"" # end of the data fed so far that might hold the start of an ID
+
+    def feed(self, chunk):
+        """Parses the next chunk of the page and returns a list of the image IDs that it completed."""
+        data = self._tail + chunk if self._tail else chunk
+        start = data.rfind(_PREFIX, max(0, len(data) - (_MAX_MATCH_LENGTH - 1)))
+        if start != -1 and _IMAGE_ID_PATTERN.match(data, start) is None:
+            # Might be an ID that the next chunk completes; keep it for then
+            data, self._tail = data[:start], data[start:]
+        else:
+            # All that can be left over is a _PREFIX or a page link that has been cut off part way
+            self._tail = data[-_KEEP:]
+        self.pages.update(int(page) for page in _PAGE_PATTERN.findall(data))
+        new_ids = [image_id.decode('ascii') for image_id in _IMAGE_ID_PATTERN.findall(data)]
+        self.ids.extend(new_ids)
+        return new_ids
+
+    def close(self):
+        """Ends the page and returns all the image IDs in it."""
+        # A _PREFIX held back at the end may have a page link after it that hasn't been searched yet
+        self.pages.update(int(page) for page in _PAGE_PATTERN.findall(self._tail))
+        self._tail = b""
+        return self.ids
+
+def iter_image_ids(chunks):
+    """Yields the image IDs in an album page given as an iterable of chunks (bytes), as soon as each one is complete."""
+    parser = AlbumPageParser()
+    for chunk in chunks:
+        yield from parser.feed(chunk)
@@ -0,0 +1,59 @@
+# Copyright Patrick Perrier, 2015
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Module that checks the current album for changes every config.refresh_minutes while the program is running.
+
+A daemon thread wakes up every POLL_INTERVAL seconds (so a change to refresh_minutes in the
+config file is picked up without a restart) and calls imgur_callbacks.refresh_album once
+refresh_minutes have gone by since the last time. The request is conditional, so an album
+that hasn't changed costs one small response; one that has is diffed against the image list
+in use and only the changes are applied (see album_diff.py).
+"""
+
+import time
+import logging
+import threading
+from . import config as cfg
+from . import imgur_callbacks as callbacks
+
+logger = logging.getLogger(__name__)
+
+# Seconds between checks of whether it is time to refresh
+POLL_INTERVAL = 30.0
+
+_thread = None
+
+def _watch(interval):
+    last_refresh = time.monotonic()
+    while True:
+        time.sleep(interval)
+        minutes = cfg.refresh_minutes
+        if minutes <= 0 or time.monotonic() - last_refresh < minutes * 60:
+            continue
+        last_refresh = time.monotonic()
+        try:
+            logger.info("Checking album %s for changes", cfg.album_id)
+            callbacks.refresh_album()
+        except Exception as e:
+            logger.warning("Refreshing the album failed. Reason: %s", e)
+
+def start(interval=None):
+    """Starts refreshing the album periodically (checking every interval seconds, default POLL_INTERVAL). Does nothing if it has already started."""
+    global _thread
+    if _thread is not None:
+        return
+    _thread = threading.Thread(target=_watch, args=(interval or POLL_INTERVAL,), name="AlbumRefresher", daemon=True)
+    _thread.start()
+    logger.info("Refreshing the album every %i minutes (refresh_minutes, 0 means never)", cfg.refresh_minutes)
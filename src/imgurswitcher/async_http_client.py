@@ -0,0 +1,365 @@
+# Copyright Patrick Perrier, 2015
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Module that holds the asyncio HTTP client used by the asyncio runtime (worker.AsyncWorker).
+
+Does the same job as http_client.HttpClient (keep-alive connections pooled per host, a limit
+on how many connections can be open to a host at once, bodies read in bounded chunks, timings
+recorded) but on asyncio streams, so that one thread can have any number of downloads and
+album page requests going at once. Every network operation gives up after the configured timeout.
+
+A client belongs to the event loop it is first used on. Use the shared instance from get_client
+on the AsyncWorker's loop. Its coroutines are generator-based (see worker.coroutine), so they're
+called with "yield from".
+"""
+
+import io
+import ssl
+import time
+import asyncio
+import logging
+import http.client
+import urllib.parse
+from collections import deque
+from . import config as cfg
+from . import exceptions as xcpt
+from . import metrics
+from .http_client import CHUNK_SIZE, MAX_REDIRECTS, RequestTiming
+from .worker import coroutine
+
+logger = logging.getLogger(__name__)
+
+_REDIRECT_CODES = (301, 302, 303, 307, 308)
+
+class AsyncResponse:
+    """A streamed HTTP response. Use in a with statement, or call close when done.
+
+    Reading the whole body hands the connection back to the pool for reuse; closing
+    the response before that throws the connection away instead.
+    """
+
+    def __init__(self, client, key, reader, writer, status, headers, url, reused, started, connect_ms):
+        self._client = client
+        self._key = key
+        self._reader = reader
+        self._writer = writer
+        self.status = status
+        self.headers = headers
+        self.url = url
+        self._reused = reused
+        self._started = started
+        self._connect_ms = connect_ms
+        self._first_byte_ms = (time.perf_counter() - started) * 1000
+        self.bytes_read = 0
+        self._complete = status in (204, 304) or 100 <= status < 200 # these never have a body
+        self._closed = False
+        self._chunked = headers.get("Transfer-Encoding", "").lower() == "chunked"
+        # Body bytes still to read: of the current chunk if chunked, otherwise of the whole body
+        # (None if no length was given, so the body ends when the server closes the connection)
+        self._remaining = 0 if self._chunked else headers.get("Content-Length")
+        if self._remaining is not None:
+            self._remaining = int(self._remaining)
+            if not self._chunked and self._remaining == 0:
+                self._complete = True
+
+    @coroutine
+    def read_chunk(self, chunk_size=CHUNK_SIZE):
+        """Returns the next chunk of the body, of at most chunk_size bytes, or b"" once all of it has been read."""
+        wait = self._client._wait
+        while not self._complete:
+            if self._remaining is None:
+                chunk = yield from wait(self._reader.read(chunk_size))
+                if not chunk:
+                    self._writer.close()
+                    self._complete = True
+                    break
+                self.bytes_read += len(chunk)
+                return chunk
+            if self._remaining:
+                chunk = yield from wait(self._reader.read(min(self._remaining, chunk_size)))
+                if not chunk:
+                    raise ConnectionError("Connection closed in the middle of the response from %s" % self.url)
+                self._remaining -= len(chunk)
+                self.bytes_read += len(chunk)
+                if not self._remaining:
+                    if self._chunked:
+                        yield from wait(self._reader.readexactly(2)) # the CRLF after each chunk
+                    else:
+                        self._complete = True
+                return chunk
+            # Chunked, and at the start of a chunk
+            size_line = yield from wait(self._reader.readline())
+            self._remaining = int(size_line.split(b";")[0].strip() or b"0", 16)
+            if self._remaining == 0:
+                # Skip the trailers
+                while (yield from wait(self._reader.readline())).strip():
+                    pass
+                self._complete = True
+        return b""
+
+    @coroutine
+    def read(self, max_bytes=None):
+        """Reads and returns the whole body.
+
+        max_bytes: if given, raises ImgurSwitcherException rather than read a body bigger than this.
+        """
+        chunks = []
+        while True:
+            chunk = yield from self.read_chunk()
+            if not chunk:
+                return b"".join(chunks)
+            if max_bytes is not None and self.bytes_read > max_bytes:
+                raise xcpt.ImgurSwitcherException("Response from %s is bigger than %i bytes" % (self.url, max_bytes))
+            chunks.append(chunk)
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        # Only a fully read response leaves the connection in a state where it can be reused
+        reusable = (self._complete and not self._reader.at_eof()
+                    and self.headers.get("Connection", "").lower() != "close")
+        self._client._release(self._key, self._reader, self._writer, reusable)
+        self._client._record(RequestTiming(self.url, self.status, self._reused, self._connect_ms, self._first_byte_ms,
+                                           (time.perf_counter() - self._started) * 1000, self.bytes_read))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+class AsyncHttpClient:
+    """asyncio HTTP client with a keep-alive connection pool per host.
+
+    max_connections: the maximum number of connections open to any one host at once. Requests
+    past that wait for a connection to be handed back.
+    timeout: how long any one network operation (connecting, or waiting for more of the
+    response) can take, in seconds.
+    """
+
+    def __init__(self, max_connections=4, timeout=30):
+        self.max_connections = max_connections
+        self.timeout = timeout
+        # Only ever touched from the loop's thread, so no locking
+        self._idle = {} # (scheme, host, port) -> list of idle (reader, writer) pairs
+        self._slots = {} # (scheme, host, port) -> semaphore limiting the open connections
+        self._timings = deque(maxlen=100) # the most recent request timings
+        self._ssl_context = None
+
+    @coroutine
+    def _wait(self, awaitable):
+        try:
+            return (yield from asyncio.wait_for(awaitable, self.timeout))
+        except asyncio.TimeoutError:
+            raise xcpt.ImgurSwitcherException("Timed out after %i seconds" % self.timeout)
+
+    @coroutine
+    def _acquire(self, key):
+        """Returns (reader, writer, reused) for key, opening a new connection if no idle one is pooled."""
+        if key not in self._slots:
+            self._slots[key] = asyncio.Semaphore(self.max_connections)
+        yield from self._slots[key].acquire()
+
+        idle = self._idle.get(key)
+        while idle:
+            reader, writer = idle.pop()
+            if not reader.at_eof():
+                return reader, writer, True
+            writer.close()
+
+        try:
+            reader, writer = yield from self._connect(key)
+        except BaseException:
+            self._slots[key].release()
+            raise
+        return reader, writer, False
+
+    @coroutine
+    def _connect(self, key):
+        scheme, host, port = key
+        context = None
+        if scheme == "https":
+            if self._ssl_context is None:
+                self._ssl_context = ssl.create_default_context()
+            context = self._ssl_context
+        return (yield from self._wait(asyncio.open_connection(host, port, ssl=context)))
+
+    def _release(self, key, reader, writer, reusable):
+        if reusable:
+            self._idle.setdefault(key, []).append((reader, writer))
+        else:
+            writer.close()
+        self._slots[key].release()
+
+    def _record(self, timing):
+        self._timings.append(timing)
+        metrics.increment("http.requests")
+        metrics.increment("http.bytes", timing.bytes)
+        if timing.reused:
+            metrics.increment("http.reused")
+        metrics.observe("http.first_byte_ms", timing.first_byte_ms)
+        metrics.observe("http.total_ms", timing.total_ms)
+        logger.debug("HTTP %s %i: %i bytes, first byte %.1f ms, total %.1f ms (%s)", timing.url, timing.status, timing.bytes,
+                     timing.first_byte_ms, timing.total_ms, "reused connection" if timing.reused else "connect %.1f ms" % timing.connect_ms)
+
+    def timings(self):
+        """Returns the timings of the most recent requests, oldest first."""
+        return list(self._timings)
+
+    @coroutine
+    def _exchange(self, reader, writer, request):
+        """Sends request and returns (status, headers) once the response head has arrived."""
+        writer.write(request)
+        yield from self._wait(writer.drain())
+        status_line = yield from self._wait(reader.readline())
+        if not status_line:
+            raise ConnectionError("Connection closed before the response arrived")
+        status = int(status_line.split(None, 2)[1])
+
+        head = []
+        while True:
+            line = yield from self._wait(reader.readline())
+            if line in (b"\r\n", b"\n", b""):
+                break
+            head.append(line)
+        return status, http.client.parse_headers(io.BytesIO(b"".join(head) + b"\r\n"))
+
+    @coroutine
+    def _send(self, url, headers):
+        """Sends one GET request (no redirect handling) and returns the AsyncResponse."""
+        parts = urllib.parse.urlsplit(url)
+        default_port = 443 if parts.scheme == "https" else 80
+        key = (parts.scheme, parts.hostname, parts.port or default_port)
+        path = parts.path or "/"
+        if parts.query:
+            path += "?" + parts.query
+
+        lines = ["GET %s HTTP/1.1" % path, "Host: %s" % parts.netloc, "Accept-Encoding: identity"]
+        lines += ["%s: %s" % item for item in headers.items()]
+        request = ("\r\n".join(lines) + "\r\n\r\n").encode('latin-1')
+
+        started = time.perf_counter()
+        reader, writer, reused = yield from self._acquire(key)
+        try:
+            connect_ms = 0 if reused else (time.perf_counter() - started) * 1000
+            try:
+                status, response_headers = yield from self._exchange(reader, writer, request)
+            except (ConnectionError, ValueError, IndexError):
+                if not reused:
+                    raise
+                # The server closed the idle connection on us; try once more on a fresh one
+                logger.debug("Pooled connection to %s went stale, reconnecting", parts.hostname)
+                writer.close()
+                reader, writer = yield from self._connect(key)
+                reused = False
+                connect_ms = (time.perf_counter() - started) * 1000
+                status, response_headers = yield from self._exchange(reader, writer, request)
+        except BaseException:
+            self._release(key, reader, writer, False)
+            raise
+        return AsyncResponse(self, key, reader, writer, status, response_headers, url, reused, started, connect_ms)
+
+    @coroutine
+    def get(self, url, headers=None):
+        """Sends a GET request for url, following redirects, and returns the streamed AsyncResponse.
+
+        Raises exceptions.HttpError if the final status is an error (400 or above).
+        Other statuses, including 304 Not Modified, are returned to the caller.
+        """
+        headers = dict(headers or {})
+        for _ in range(MAX_REDIRECTS + 1):
+            response = yield from self._send(url, headers)
+            if response.status in _REDIRECT_CODES and response.headers.get("Location"):
+                try:
+                    yield from response.read() # so the connection can be reused
+                finally:
+                    response.close()
+                url = urllib.parse.urljoin(url, response.headers["Location"])
+                continue
+            if response.status >= 400:
+                response.close()
+                raise xcpt.HttpError(response.status, url)
+            return response
+        raise xcpt.ImgurSwitcherException("Too many redirects fetching %s" % url)
+
+    @coroutine
+    def fetch(self, url, headers=None, max_bytes=None):
+        """Sends a GET request for url and returns (status, headers, body) once the whole body is in.
+
+        Same redirect and error handling as get.
+        """
+        with (yield from self.get(url, headers)) as response:
+            body = yield from response.read(max_bytes)
+            return response.status, response.headers, body
+
+    @coroutine
+    def download(self, url, path, token=None):
+        """Streams the body of url into the file at path and returns the number of bytes written.
+
+        token: a cancellation.CancelToken. If it is cancelled (from any thread) the download stops
+        straight away and exceptions.DownloadCancelled is raised. The partial file is left for
+        the caller to clean up.
+        """
+        if token is None:
+            return (yield from self._download(url, path, None))
+
+        token.check()
+        loop = asyncio.get_event_loop()
+        # Its own task, so that cancelling the token can stop it wherever it is waiting
+        task = loop.create_task(self._download(url, path, token))
+        stop = lambda: loop.call_soon_threadsafe(task.cancel)
+        token.on_cancel(stop)
+        try:
+            return (yield from task)
+        except asyncio.CancelledError:
+            if token.cancelled:
+                token.check() # raises DownloadCancelled
+            raise
+        finally:
+            token.remove_callback(stop)
+
+    @coroutine
+    def _download(self, url, path, token):
+        with (yield from self.get(url)) as response:
+            with open(path, 'wb') as out_file:
+                while True:
+                    chunk = yield from response.read_chunk()
+                    if not chunk:
+                        break
+                    if token is not None:
+                        token.check()
+                    out_file.write(chunk)
+            return response.bytes_read
+
+    def close(self):
+        """Closes all the idle pooled connections."""
+        for connections in self._idle.values():
+            for reader, writer in connections:
+                writer.close()
+        self._idle = {}
+
+_client = None
+
+def get_client():
+    """Returns the shared AsyncHttpClient, creating it (with the configured limits) on first use.
+
+    Only call from the AsyncWorker's event loop.
+    """
+    global _client
+    if _client is None:
+        _client = AsyncHttpClient(max_connections=cfg.http_connections, timeout=cfg.http_timeout)
+        logger.info("Async HTTP client created with up to %i connections per host", cfg.http_connections)
+    return _client
@@ -0,0 +1,128 @@
+# Copyright Patrick Perrier, 2015
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Module that holds the cancellation token handed to running callbacks and downloads.
+
+Whoever wants a piece of running work to stop calls cancel on its token. The work
+checks the token (or registers a callback with it, e.g. to close the socket it is
+reading from) and raises exceptions.DownloadCancelled. Work that has reached the
+point of no return (e.g. it is about to set the background) calls commit, after
+which the token can no longer be cancelled.
+
+The time from cancel being called to the work noticing is recorded, so that the
+cancellation latency can be checked against CANCEL_LATENCY_BUDGET_MS.
+"""
+
+import time
+import logging
+import threading
+from collections import deque
+from . import exceptions as xcpt
+
+logger = logging.getLogger(__name__)
+
+# Cancellations that take longer than this to be noticed get logged as warnings
+CANCEL_LATENCY_BUDGET_MS = 100
+
+_latencies = deque(maxlen=100) # the most recent cancellation latencies, in milliseconds
+
+class CancelToken:
+    """Token that a piece of running work checks to find out whether it should stop."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._callbacks = []
+        self.cancelled = False
+        self.committed = False
+        self.requeue = False # set if the cancelled work should be run again later
+        self._requested_at = None
+        self._acknowledged = False
+
+    def cancel(self, requeue=False):
+        """Cancels the work holding this token.
+
+        requeue: whether the work should be put back in the event queue once it has stopped.
+
+        Returns True if the token was cancelled by this call, False if it had already been
+        cancelled or committed (in which case the work carries on, or has already stopped).
+        """
+        with self._lock:
+            if self.cancelled or self.committed:
+                return False
+            self.cancelled = True
+            self.requeue = requeue
+            self._requested_at = time.perf_counter()
+            callbacks = list(self._callbacks)
+
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                logger.warning("Cancellation callback %s failed. Reason: %s", callback, e)
+        return True
+
+    def commit(self):
+        """Marks the work as past the point where it can be cancelled.
+
+        Returns False if the token was cancelled first, in which case the work should stop instead.
+        """
+        with self._lock:
+            if self.cancelled:
+                return False
+            self.committed = True
+            return True
+
+    def on_cancel(self, callback):
+        """Registers callback to be called (from the cancelling thread) when the token is cancelled.
+
+        If the token is already cancelled, the callback is called straight away.
+        """
+        with self._lock:
+            if not self.cancelled:
+                self._callbacks.append(callback)
+                return
+        callback()
+
+    def remove_callback(self, callback):
+        with self._lock:
+            if callback in self._callbacks:
+                self._callbacks.remove(callback)
+
+    def check(self):
+        """Raises exceptions.DownloadCancelled if the token has been cancelled."""
+        if self.cancelled:
+            self.acknowledge()
+            raise xcpt.DownloadCancelled("Cancelled")
+
+    def acknowledge(self):
+        """Records how long the work took to notice the cancellation. Only the first call counts."""
+        with self._lock:
+            if not self.cancelled or self._acknowledged:
+                return
+            self._acknowledged = True
+            latency = (time.perf_counter() - self._requested_at) * 1000
+
+        _latencies.append(latency)
+        if latency > CANCEL_LATENCY_BUDGET_MS:
+            logger.warning("Cancellation took %.1f ms to take effect (budget is %i ms)", latency, CANCEL_LATENCY_BUDGET_MS)
+        else:
+            logger.debug("Cancellation took %.1f ms to take effect", latency)
+
+def latency_stats():
+    """Returns a dict with the count, median and maximum of the recent cancellation latencies, in milliseconds."""
+    latencies = sorted(_latencies)
+    if not latencies:
+        return {"count": 0, "median_ms": None, "max_ms": None}
+    return {"count": len(latencies), "median_ms": latencies[len(latencies) // 2], "max_ms": latencies[-1]}
@@ -25,9 +25,11 @@ import os
 import re
 import platform
 import logging
+from collections import namedtuple
 from . import event_queue as eq
 from . import exceptions as xcpt
 from . import dialogs as dialogs
+from . import config_store
 from . import get_data
 
 logger = logging.getLogger(__name__)
@@ -37,11 +39,28 @@ logger = logging.getLogger(__name__)
 # package root
 CONFIG_FILE_NAME = "config.cfg"
 config_file_path = get_data(CONFIG_FILE_NAME)
+_store = None # config_store.ConfigStore for config_file_path; set by parse_cfg_file
+_reload_listeners = [] # called with the dict of changed settings after reload, see add_reload_listener
 
 imgur_album_url = "http://imgur.com/gallery/abaz1" # default album
 album_id = "abaz1" # default album_id
 album_pos = 0 # default position in album (1-indexed). This is the image we are currently on. 
               # 0 means no image (i.e. it's kind of like None)
+current_image = "" # ID of the image at album_pos, so that it can be found again if the album changes; "" if unknown
+prefetch_ahead = 2 # how many images after the current one to keep downloaded
+prefetch_behind = 1 # how many images before the current one to keep downloaded
+cache_mb = 256 # maximum size of the on-disk image cache, in megabytes
+http_connections = 4 # maximum number of simultaneous connections to each host
+http_timeout = 30 # seconds before a stalled HTTP request gives up
+worker_threads = 4 # number of background threads (prefetching, album revalidation)
+runtime = "pool" # which worker runs the event queue: "thread", "pool" or "async" (see worker.RUNTIMES)
+metrics_port = 0 # port of the local Prometheus metrics endpoint (see metrics_endpoint.py); 0 means off
+fit_to_screen = 1 # 1 to scale images down to the screen size before setting them (needs Pillow, see image_fitting.py)
+progressive = 0 # 1 to show a small version of an image that isn't downloaded yet first, and swap in the full one when it is
+refresh_minutes = 60 # how often to check the album for changes while the program is running (see album_refresher.py); 0 means never
+# Key (pressed with ALT) bound to each action, set with key_<action> in the config file (see hotkeys.py).
+# None means the action isn't bound.
+hotkeys = {"next": "D", "prev": "A", "random": "R", "save": "S", "url": "U", "quit": "Q", "stats": None}
 
 _platform = None
 # Platform-specific callback variables that other modules in the package need to use.
@@ -49,9 +68,15 @@ _platform = None
 Main = None
 set_as_background = None
 exit_program = None
+screen_size = None # returns the (width, height) of the screen in pixels, or None if it can't tell; optional
+
 
 # The platforms that are currently supported.
-_supported_platforms = ["Windows"]
+# Headless needs no desktop (see headless.py); it's only used if asked for with PLATFORM_VARIABLE.
+_supported_platforms = ["Windows", "Headless"]
+
+# Environment variable that overrides the detected platform, e.g. IMGURSWITCHER_PLATFORM=Headless
+PLATFORM_VARIABLE = "IMGURSWITCHER_PLATFORM"
 
 def _get_platform():
     """Determine the platform we're running on and return it.
@@ -60,14 +85,14 @@ def _get_platform():
     found and is supported, otherwise throws an ImgurSwitcherException.
     Not intended to be called from outside this module."""
     global _platform
-    _platform = platform.system()
+    _platform = os.environ.get(PLATFORM_VARIABLE) or platform.system()
     if not _platform:
-        dialogs.error_dialog_box("Platform Not Found", "Can't figure out what platform this is running on, somehow. Cannot run program.")
+        dialogs.error_dialog_box("Platform Not Found", "Can't figure out what platform this is running on, somehow. Cannot run program.", wait=True)
         raise xcpt.ImgurSwitcherException("Can't figure out what platform this is running on, somehow. Cannot run program.")
 
     elif _platform not in _supported_platforms:
         dialogs.error_dialog_box("Platform Not Supported", "Sorry, ImgurSwitcher currently does not support your platform (" + _platform + ")." + 
-                                "\n\nFeel free to implement support for it!")
+                                "\n\nFeel free to implement support for it!", wait=True)
         raise xcpt.ImgurSwitcherException("Sorry, ImgurSwitcher currently does not support your platform (" + _platform + "). Feel free to implement support for it!")
 
 def verify_url(url):
@@ -79,25 +104,100 @@ def verify_url(url):
     it's actually valid), so we only have to run the regular expression on the URL once. If this function returns False,
     the caller should immediately do some error handling.
     """
-    match = re.search("(https?)\:\/\/(www\.)?(?:m\.)?imgur\.com/(a|gallery)/([a-zA-Z0-9]+)(#[0-9]+)?", url)
     global album_id
-    if match:
-        album_id = match.group(4) # the piece that is the album's unique ID
+    match_id = album_id_of(url)
+    if match_id is not None:
+        album_id = match_id
         logger.info("URL match successful. URL: %s, Album ID: %s", url, album_id)
         return True
     else:
         logger.warning("URL match unsuccessful. Attempted URL: %s", url)
         return False
 
+def album_id_of(url):
+    """Returns the album ID in url if it is a valid Imgur album URL (see verify_url), None if it isn't. Doesn't set album_id."""
+    match = re.search("(https?)\:\/\/(www\.)?(?:m\.)?imgur\.com/(a|gallery)/([a-zA-Z0-9]+)(#[0-9]+)?", url)
+    return match.group(4) if match else None # the piece that is the album's unique ID
+
+def _set_queue_size(size):
+    # Eh ugly but whatever :p
+    if size < 50:
+        logger.info("Setting max queue size to 200 due to config value being too small")
+        size = 200
+    eq.set_max_queue_size(size)
+
+def _key(text):
+    """Type of the key_<action> settings: a single letter or digit."""
+    if len(text) != 1 or not text.isalnum() or ord(text) >= 128:
+        raise ValueError("not a letter or digit: %r" % text)
+    return text.upper()
+
+def _bind(action):
+    def bind(key):
+        hotkeys[action] = key
+    return bind
+
+# What can be set in the config file.
+# key: the key in the file. type: converts the text after the key (raises ValueError if it can't).
+# target: the name of the global in this module to set, or a function to call with the value.
+# check: if given, values it returns False for are ignored. quiet: don't warn if the key is missing.
+Setting = namedtuple("Setting", ["key", "type", "target", "description", "check", "quiet"])
+Setting.__new__.__defaults__ = (None, False) # check and quiet (namedtuple's defaults argument is 3.7+)
+
+SETTINGS = (
+    Setting("url", str, "imgur_album_url", "Imgur album URL", lambda value: album_id_of(value) is not None),
+    Setting("position", int, "album_pos", "album position", lambda value: value >= 0),
+    Setting("image", str, "current_image", "current image ID", quiet=True),
+    Setting("timeout", int, eq.set_queue_timeout, "queue operation timeout"),
+    Setting("size", int, _set_queue_size, "max queue size"),
+    Setting("prefetch_ahead", int, "prefetch_ahead", "prefetch ahead count", lambda value: value >= 0),
+    Setting("prefetch_behind", int, "prefetch_behind", "prefetch behind count", lambda value: value >= 0),
+    Setting("cache_mb", int, "cache_mb", "image cache size (MB)", lambda value: value >= 0),
+    Setting("http_connections", int, "http_connections", "HTTP connections per host", lambda value: value > 0),
+    Setting("http_timeout", int, "http_timeout", "HTTP timeout", lambda value: value > 0),
+    Setting("worker_threads", int, "worker_threads", "background worker threads", lambda value: value > 0),
+    Setting("runtime", str, "runtime", "runtime", lambda value: value in ("thread", "pool", "async")),
+    Setting("metrics_port", int, "metrics_port", "metrics endpoint port", lambda value: 0 <= value < 65536, quiet=True),
+    Setting("fit_to_screen", int, "fit_to_screen", "fit to screen", lambda value: value in (0, 1), quiet=True),
+    Setting("progressive", int, "progressive", "progressive mode", lambda value: value in (0, 1), quiet=True),
+    Setting("refresh_minutes", int, "refresh_minutes", "album refresh interval (minutes)", lambda value: value >= 0, quiet=True),
+) + tuple(Setting("key_" + action, _key, _bind(action), "key for " + action, quiet=True) for action in hotkeys)
+
+def _apply(setting, values, assign=True):
+    """Sets setting from values (as returned by ConfigStore.read). Returns True if it was set.
+
+    If assign is False, the value is only checked (and True returned if it is valid); see _SWITCHED_BY_LISTENERS.
+    """
+    value = values.get(setting.key)
+    current = " of %s" % globals()[setting.target] if isinstance(setting.target, str) else ""
+    if value is None:
+        # Settings that aren't in the file keep their defaults
+        log = logger.debug if setting.quiet else logger.warning
+        log("Could not get %s from config file; using default value%s", setting.description, current)
+        return False
+    if setting.check is not None and not setting.check(value):
+        logger.warning("Ignoring invalid %s %s in config file; using default value%s", setting.description, value, current)
+        return False
+
+    if not assign:
+        logger.info("New %s %s in config file", setting.description, value)
+        return True
+    if isinstance(setting.target, str):
+        globals()[setting.target] = value
+    else:
+        setting.target(value)
+    logger.info("Setting %s to %s from config file", setting.description, value)
+    return True
+
 def parse_cfg_file():
     """Parses the config file and sets configuration variables.
 
-    Specifically, this function parses the file named in CONFIG_FILE_NAME and
-    sets max_queue_size, queue_op_timeout, and imgur_album_url based on the matching values in
-    the configuration file. If errors occur (e.g. there is no configuration file, file I/O errors,
-    a configuration value is not specified...) then default values are used.
+    Specifically, this function reads the file named in CONFIG_FILE_NAME and sets the
+    variables in SETTINGS from the matching values in it. If errors occur (e.g. there is
+    no configuration file, a value is missing or invalid...) then default values are used.
     """
     global config_file_path
+    global _store
     # Check if the config file exists.
     exists = os.path.isfile(config_file_path)
 
@@ -110,133 +210,116 @@ def parse_cfg_file():
         if exists:
             # Change the path
             config_file_path = os.path.abspath(CONFIG_FILE_NAME)
-            logger.info("Config file found in current directory. Set config file path to %s" % config_file_path)
+            logger.info("Config file found in current directory. Set config file path to %s", config_file_path)
+
+    # Don't lose changes that haven't been written yet when rereading
+    if _store is not None:
+        _store.flush()
+    _store = config_store.ConfigStore(config_file_path, dict((setting.key, setting.type) for setting in SETTINGS))
 
     if exists:
-        with open(config_file_path, 'r') as cfg_file:
-            lines = cfg_file.read()
-            size_match = re.search("size:(?: )*?([0-9]+)", lines)
-            timeout_match = re.search("timeout:(?: )*?([0-9]+)", lines)
-            url_match = re.search("url:(?: )*?([a-zA-Z0-9:/\.]+)", lines)
-            album_pos_match = re.search("position:(?: )*?([0-9]+)", lines)
-
-            # Work with the global config vars
-            global album_pos
-            global imgur_album_url
-
-            # Set the values; if anything fails then defaults will be used.
-            if size_match:
-                # Eh ugly but whatever :p
-                if int(size_match.group(1)) < 50:
-                    eq.set_max_queue_size(200)
-                    logger.info("Setting max queue size to 200 due to config value being too small")
-                else:
-                    eq.set_max_queue_size(int(size_match.group(1)))
-                    logger.info("Setting max queue size to %i from config file", eq.max_queue_size)
-    
-            else:
-                logger.warning("Could not get queue size from config file; using default value of %i", eq.max_queue_size)
-            
-            if timeout_match:
-                eq.set_queue_timeout(int(timeout_match.group(1)))
-                logger.info("Setting queue operation timeout value to %i from config file", eq.queue_op_timeout)
-            else:
-                logger.warning("Could not get queue operation timeout value from config file; using default value of %i", eq.queue_op_timeout)
-
-            if album_pos_match:
-                album_pos = int(album_pos_match.group(1))
-                logger.info("Setting album position to %i from config file", album_pos)
-                if album_pos < 0:
-                    logger.info("Correcting album position to %i since config value file was negative", 0)
-                    album_pos = 0
-                    # The case where album_pos is larger than the number of images in the album is handled in the callbacks.
-            else:
-                logger.warning("Could not get album position from config file; using default value of %i", album_pos)
-
-            url_valid = False
-            if url_match:
-                if verify_url(url_match.group(1)):
-                    imgur_album_url = url_match.group(1)
-                    url_valid = True
-                    logger.info("Setting Imgur album URL to %s from config file", imgur_album_url)
-            else:
-                logger.warning("Could not get imgur album URL from config file; trying default value of %i", imgur_album_url)
-
-            # This checks the default URL if no match was found in the config file,
-            # and also is needed so that the album_key variable is set properly in case of having 
-            # to use the default.
-            if not url_valid and not verify_url(imgur_album_url):
-                # If this is hit, then someone messed with the default value of imgur_album_url and broke it. Go fix it.
-                logger.critical("Default Imgur album URL is not valid! URL: %s Aborting...", imgur_album_url)
-                dialogs.error_dialog_box("URL Not Valid", "Default Imgur album URL is not valid! URL: " + imgur_album_url + "\n\nAborting program...")
-                raise ImgurSwitcherException("You changed the default value of imgur_album_url in config.py and broke the program,"
-                    " because it is no longer a valid Imgur URL. Go fix it!")
+        values = _store.read()
+        for setting in SETTINGS:
+            _apply(setting, values)
+
+        # This sets the album_id variable from the URL (the one from the config file, which was checked
+        # when it was applied, or the default if there wasn't a valid one), and checks the default.
+        if not verify_url(imgur_album_url):
+            # If this is hit, then someone messed with the default value of imgur_album_url and broke it. Go fix it.
+            logger.critical("Default Imgur album URL is not valid! URL: %s Aborting...", imgur_album_url)
+            dialogs.error_dialog_box("URL Not Valid", "Default Imgur album URL is not valid! URL: " + imgur_album_url + "\n\nAborting program...", wait=True)
+            raise xcpt.ImgurSwitcherException("You changed the default value of imgur_album_url in config.py and broke the program,"
+                " because it is no longer a valid Imgur URL. Go fix it!")
     else:
         logger.warning("No config file found, using default values...")
 
+# Settings that are only used when the program starts
+_NEEDS_RESTART = ("http_connections", "http_timeout", "worker_threads", "runtime")
+
+# Settings that reload only checks and passes on to the listeners, which apply them themselves:
+# the album in use (album_id and imgur_album_url) only changes once the new one has loaded
+_SWITCHED_BY_LISTENERS = ("url",)
+
+def config_modified():
+    """Returns True if the config file was changed (other than by this program) since it was last read."""
+    return _store is not None and _store.modified()
+
+def add_reload_listener(listener):
+    """Calls listener(changed) after every reload that changed something.
+
+    changed is a dict of config file key (e.g. "url", "key_next") -> new value. Listeners are
+    called on the thread that called reload, after the variables in here have been set (other
+    than the ones for _SWITCHED_BY_LISTENERS, which are left to the listeners).
+    """
+    _reload_listeners.append(listener)
+
+def reload():
+    """Applies the settings that were changed in the config file since it was last read or written.
+
+    Unlike reset, nothing else is touched: the event queue keeps its events, and settings that
+    weren't changed keep their current values (even if they differ from the file, e.g. album_pos
+    before it's written). Invalid new values are ignored. Returns the dict of applied changes.
+    """
+    if _store is None:
+        return {}
+    changes = _store.changes()
+    applied = dict((setting.key, changes[setting.key]) for setting in SETTINGS
+                   if setting.key in changes and _apply(setting, changes, setting.key not in _SWITCHED_BY_LISTENERS))
+    if not applied:
+        return applied
+
+    logger.info("Applied changes from config file: %s", ", ".join(sorted(applied)))
+    for key in _NEEDS_RESTART:
+        if key in applied:
+            logger.warning("The new %s will be used after ImgurSwitcher is restarted", key)
+    for listener in list(_reload_listeners):
+        try:
+            listener(applied)
+        except Exception:
+            logger.exception("Config reload listener %s failed", listener)
+    return applied
+
+def set_album_pos(position, image_id=None):
+    """Sets album_pos, and current_image to image_id (the ID of the image at position, if known).
+
+    They're written to the config file a little later (see config_store.FLUSH_DELAY), so this doesn't do any file I/O.
+    """
+    global album_pos
+    global current_image
+    album_pos = position
+    current_image = image_id or ""
+    if _store is not None:
+        _store.set("position", position)
+        _store.set("image", current_image)
+
 def write_config_to_file():
     """Writes album_pos and imgur_album_url to the config file.
 
     Call this immediately before quitting to save state for the next run, or after changing
     the values of imgur_album_url and/or album_pos to force the changes to take hold.
+    If there is no config file, one is created (with the queue settings as well).
     """
-
     global config_file_path
-    # Check to see if the config file exists.
     # The correct path to it should have been set by parse_cfg_file before this.
-    if os.path.isfile(config_file_path):
-        with open(config_file_path, "r+") as cfg_file:
-            lines = cfg_file.read()
-            
-            # delete the first previous occurrence of the position line and the url line, then clear the text from the
-            # file and write in the new text
-
-            result = re.subn("url:(?: )*?(.*)", "url: " + imgur_album_url, lines, 1) # at most one replacement
-            if result[1] == 1:
-                lines = result[0]
-
-            else:
-                lines = "url: " + imgur_album_url + "\n" + lines
+    if _store is None:
+        return
 
-            result = re.subn("position:(?: )*?(.*)", "position: " + str(album_pos), lines, 1) # at most one replacement
-            if result[1] == 1:
-                lines = result[0]
-
-            else:
-                lines += "\nposition: " + str(album_pos)
+    values = {"url": imgur_album_url, "position": album_pos, "image": current_image}
+    exists = os.path.isfile(_store.path)
+    if not exists:
+        logger.warning("Config file does not exist at %s. Attempting to create one there...", _store.path)
+        values.update({"size": eq.max_queue_size, "timeout": eq.queue_op_timeout})
 
-            # Clear text from the file and reset the stream pointer to the beginning of the file
-            cfg_file.seek(0)
-            cfg_file.truncate()
-            cfg_file.write(lines)
+    written = _store.flush(values)
+    if not written and not exists:
+        logger.warning("Unable to create config file at %s. Attempting to create one in current directory...", _store.path)
+        config_file_path = _store.path = os.path.abspath(CONFIG_FILE_NAME)
+        written = _store.flush()
 
-            logger.info("Wrote configuration info to file. URL: %s, album position: %i", imgur_album_url, album_pos)
+    if written:
+        logger.info("Wrote configuration info to file. URL: %s, album position: %i", imgur_album_url, album_pos)
     else:
-        # Config file does NOT exist, so create one.
-        file_handle = None
-        logger.warning("Config file does not exist at %s. Attempting to create one there...", config_file_path)
-        try:
-            # First try the current config path, which is the one that references
-            # the imgurswitcher directory if we managed to get here
-            file_handle = open(config_file_path, 'w')
-        except Exception:
-            # TODO: Refine this error handling
-            logger.warning("Unable to create config file at %s. Attempting to create one in current directory...", config_file_path)
-            try:
-                file_handle = open(os.path.abspath(CONFIG_FILE_NAME), 'w')
-            except Exception:
-                # TODO: refine this error handling
-                logger.error("Unable to create config file.")
-                return
-
-        # file_handle is good if we make it here
-        # Write config info to the new config file
-        file_handle.writeline("url: %s" % imgur_album_url)
-        file_handle.writeline("position: %i" % album_pos)
-        file_handle.writeline("size: %i" % eq.max_queue_size)
-        file_handle.writeline("timeout: %i" % eq.queue_op_timeout)
-        file_handle.close()
-        logger.warning("Created new config file at %s", file_handle.name)
+        logger.error("Unable to write config file.")
 
 
 def set_platform_config():
@@ -244,29 +327,35 @@ def set_platform_config():
 
     platform: the platform string to set the configuration for. This is expected to be one of the strings from _supported_platforms.
 
-    Call this function after having initialized the event queue, but before running the platform main.
+    Call this function after init and after having initialized the event queue, but before running the platform main.
     """
 
     global Main
     global set_as_background
     global exit_program
+    global screen_size
 
     if _platform == "Windows":
         logger.info("Current platform is Windows")
         import imgurswitcher.windows as current_platform
         logger.debug("Successfully imported Windows-specific module")
+    elif _platform == "Headless":
+        logger.info("Running headless")
+        import imgurswitcher.headless as current_platform
     # Add other supported platform configurations here.
     
     Main = current_platform.main
     set_as_background = current_platform.set_as_background
     exit_program = current_platform.exit_program
+    screen_size = getattr(current_platform, "screen_size", None)
     logger.info("Platform-specific callbacks were set")
 
-def _init():
+def init():
     """Function that gets the platform and reads the config file.
 
     Does NOT set the platform config, because that would cause a circular reference whenever
     the platform-specific modules get imported (they import config.py). Call that in __init__.py.
+    Only reads local files, so this is quick.
     """
     logger.info("Initializing configuration settings")
     platform = _get_platform() # don't try/except this because we WANT to fail if this throws
@@ -276,12 +365,10 @@ def _init():
 def reset():
     """Function that resets program configuration.
 
-    Specifically, rereads the config file and clears the event queue.
+    Specifically, rereads the config file and clears the event queue. To pick up changes
+    to the config file without losing queued events, use reload.
     """
     logger.info("Resetting program settings")
     parse_cfg_file()
     eq.reset()
-    logger.info("Program settings reset.")
-
-
-_init() # do initialization and setup on first import
\ No newline at end of file
+    logger.info("Program settings reset.")
\ No newline at end of file
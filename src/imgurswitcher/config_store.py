@@ -0,0 +1,168 @@
+# Copyright Patrick Perrier, 2015
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Module that reads and writes the "key: value" lines of the config file.
+
+ConfigStore converts the values with a schema (key -> type) when reading, and writes changed
+values back without touching the rest of the file (comments, unknown keys and the order
+of the lines are kept). Writes go to a temporary file that is then renamed over the config
+file, so a crash part way through can't leave a half-written config.
+
+Values that change often (like the album position, which changes on every key press) are
+set with set, which only remembers the value and starts a timer; they are all written
+together FLUSH_DELAY seconds later, or straight away by flush (e.g. at exit).
+
+The store remembers what the file held when it last read or wrote it, so that modified and
+changes can tell edits made by someone else (e.g. the user, in a text editor) from its own writes.
+"""
+
+import os
+import re
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Seconds to wait after a value is set before writing it, so a burst of changes is one write
+FLUSH_DELAY = 2.0
+
+_LINE_PATTERN = re.compile(r"^([a-z_]+):[ \t]*(.*?)\s*$")
+
+class ConfigStore:
+    """The config file at path, read and written with schema (a dict of key -> type, e.g. int or str).
+
+    Thread-safe. Keys that aren't in the schema are kept in the file but never returned.
+    """
+
+    def __init__(self, path, schema, flush_delay=None):
+        self.path = path
+        self._schema = schema
+        self._flush_delay = flush_delay if flush_delay is not None else FLUSH_DELAY
+        self._lock = threading.Lock()
+        self._lines = [] # lines of the file as last read or written
+        self._values = {} # key -> value in the file as last read or written
+        self._mtime = None # modification time of the file as last read or written
+        self._external = False # True if flush found (and kept) changes that read hasn't seen yet
+        self._dirty = {} # key -> value that hasn't been written yet
+        self._timer = None
+
+    def _stat(self):
+        try:
+            return os.stat(self.path).st_mtime_ns
+        except OSError:
+            return None
+
+    def read(self):
+        """Reads the file and returns a dict of key -> value (converted to its schema type).
+
+        Only the first line for each key counts. Values that can't be converted are logged and left out.
+        Returns an empty dict if the file can't be read.
+        """
+        mtime = self._stat()
+        try:
+            with open(self.path, 'r') as cfg_file:
+                lines = cfg_file.read().splitlines()
+        except Exception as e:
+            logger.warning("Could not read config file at %s. Reason: %s", self.path, e)
+            lines = []
+
+        values = {}
+        for line in lines:
+            match = _LINE_PATTERN.match(line)
+            if match is None or match.group(1) in values or match.group(1) not in self._schema:
+                continue
+            key, text = match.groups()
+            try:
+                values[key] = self._schema[key](text)
+            except ValueError:
+                logger.warning("Ignoring invalid value %r for %s in config file", text, key)
+        with self._lock:
+            self._lines = lines
+            self._values = dict(values)
+            self._mtime = mtime
+            self._external = False
+        return values
+
+    def modified(self):
+        """Returns True if the file was changed (by something other than this store) since it was last read or written."""
+        return self._external or self._stat() != self._mtime
+
+    def changes(self):
+        """Rereads the file and returns a dict of key -> value of the values that are different from when it was last read or written.
+
+        Keys that were removed from the file aren't included.
+        """
+        with self._lock:
+            old = self._values
+        return dict((key, value) for key, value in self.read().items() if old.get(key) != value)
+
+    def set(self, key, value):
+        """Remembers value for key and writes it (with anything else that was set) after the flush delay."""
+        with self._lock:
+            self._dirty[key] = value
+            if self._timer is None:
+                self._timer = threading.Timer(self._flush_delay, self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+
+    def flush(self, values=None):
+        """Writes the values that were set (and values, a dict of key -> value, if given) now.
+
+        Returns True if the file was written (or there was nothing to write), False otherwise;
+        values that couldn't be written stay pending.
+        """
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            if values:
+                self._dirty.update(values)
+            if not self._dirty:
+                return True
+
+            if self._stat() != self._mtime:
+                # Someone else changed the file since it was last read; write on top of their version
+                try:
+                    with open(self.path, 'r') as cfg_file:
+                        self._lines = cfg_file.read().splitlines()
+                    self._external = True
+                except Exception:
+                    pass # it's gone; write what we had
+            lines = list(self._lines)
+            written = set()
+            for i, line in enumerate(lines):
+                match = _LINE_PATTERN.match(line)
+                if match is not None and match.group(1) in self._dirty and match.group(1) not in written:
+                    lines[i] = "%s: %s" % (match.group(1), self._dirty[match.group(1)])
+                    written.add(match.group(1))
+            lines.extend("%s: %s" % (key, value) for key, value in self._dirty.items() if key not in written)
+
+            try:
+                with open(self.path + ".tmp", 'w') as cfg_file:
+                    cfg_file.write("\n".join(lines) + "\n")
+                    cfg_file.flush()
+                    os.fsync(cfg_file.fileno())
+                os.replace(self.path + ".tmp", self.path)
+            except Exception as e:
+                logger.error("Writing config file at %s failed! Reason: %s", self.path, e)
+                return False
+
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("Wrote %s to config file", ", ".join("%s: %s" % item for item in sorted(self._dirty.items())))
+            self._lines = lines
+            self._values.update(self._dirty)
+            self._mtime = self._stat()
+            self._dirty.clear()
+            return True
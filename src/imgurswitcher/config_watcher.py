@@ -0,0 +1,66 @@
+# Copyright Patrick Perrier, 2015
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Module that watches the config file and applies changes to it while the program is running.
+
+A daemon thread checks the file's modification time every POLL_INTERVAL seconds (this works
+the same everywhere, and the config file is small and rarely changes). When it has been changed
+by something other than the program, a reload_config event is put in the event queue, so the
+changes are applied in order with the other events, and without clearing the queue (see
+config.reload; what each setting does when it changes is up to its reload listener).
+"""
+
+import time
+import logging
+import threading
+from . import config as cfg
+from . import event_queue as eq
+from . import imgur_callbacks as callbacks
+
+logger = logging.getLogger(__name__)
+
+# Seconds between checks of the config file
+POLL_INTERVAL = 2.0
+
+_RELOAD = (eq.MED_PRIORITY, callbacks.ImgurCallbacks.reload_config, False)
+
+_thread = None
+
+def _watch(interval):
+    queued_at = None
+    while True:
+        time.sleep(interval)
+        try:
+            if not cfg.config_modified():
+                queued_at = None
+                continue
+            # Once the reload has run the file doesn't count as modified any more. Until then, don't
+            # queue it again (unless it got dropped, or has been waiting for a long time, e.g. behind a dialog).
+            if queued_at is not None and time.monotonic() - queued_at < 30 * interval:
+                continue
+            if eq.put(_RELOAD):
+                logger.info("Config file changed, reloading it")
+                queued_at = time.monotonic()
+        except Exception as e:
+            logger.warning("Checking the config file for changes failed. Reason: %s", e)
+
+def start(interval=None):
+    """Starts watching the config file (every interval seconds, default POLL_INTERVAL). Does nothing if it is already being watched."""
+    global _thread
+    if _thread is not None:
+        return
+    _thread = threading.Thread(target=_watch, args=(interval or POLL_INTERVAL,), name="ConfigWatcher", daemon=True)
+    _thread.start()
+    logger.info("Watching the config file for changes")
@@ -15,15 +15,135 @@
 
 """Module that contains the assorted dialog boxes that ImgurSwitcher uses.
 
-Uses tkinter to provide cross-platform dialog boxes. Rather than have one
-long-running tk instance, create and destroy them as needed since they're 
-not expected to be r
+Uses tkinter to provide cross-platform dialog boxes. Creating a Tk root takes hundreds of
+milliseconds, so rather than make one per dialog, a single hidden root lives on its own
+daemon thread (the dialog thread, started on first use) and every dialog is shown from there.
+The functions in here send the dialog to that thread:
+
+* the ones that return an answer (save_dialog_box, string_input_box, confirm_dialog_box)
+  wait for the user, like before;
+* error_dialog_box and warning_dialog_box are notifications, and return straight away so
+  that e.g. a failed download doesn't hold up the event queue. Repeats of a notification
+  that is still waiting to be shown (or is showing) are folded into it, and repeats within
+  NOTIFICATION_COOLDOWN seconds of it being closed are only logged. A notification that is
+  waited for (wait=True, e.g. before the program exits) is always shown, or waits for the
+  same notification that is already waiting or showing.
 """
 
-import tkinter
-import tkinter.filedialog
-import tkinter.messagebox
-import tkinter.simpledialog
+import time
+import queue
+import logging
+import threading
+from concurrent.futures import Future
+
+logger = logging.getLogger(__name__)
+
+# Seconds after a notification is closed during which the same notification isn't shown again
+NOTIFICATION_COOLDOWN = 30
+
+_lock = threading.Lock()
+_requests = None # queue.Queue of (Future, function, args) for the dialog thread; set on first use
+_thread = None
+_notifications = {} # (kind, title, message) -> [times it was asked for, its Future], while it is waiting or showing
+_closed_at = {} # (kind, title, message) -> time.monotonic() when it was last closed
+
+def _tk():
+    """Imports and returns tkinter.
+
+    Done on first use rather than at import time because importing tkinter is slow,
+    and it shouldn't hold up installing the keyboard hook.
+    """
+    import tkinter
+    import tkinter.filedialog
+    import tkinter.messagebox
+    import tkinter.simpledialog
+    return tkinter
+
+def _run_dialogs():
+    """Body of the dialog thread: shows the dialogs that are sent to it, one at a time."""
+    root = None
+    while True:
+        future, function, args = _requests.get()
+        if not future.set_running_or_notify_cancel():
+            continue
+        try:
+            if root is None:
+                tkinter = _tk()
+                root = tkinter.Tk()
+                root.withdraw() # hide the main tk window
+            result = function(root, *args)
+            root.update() # let tk finish closing the dialog
+            future.set_result(result)
+        except BaseException as e:
+            future.set_exception(e)
+
+def _submit(function, *args):
+    """Runs function(root, *args) on the dialog thread and returns a concurrent.futures.Future for its result."""
+    future = Future()
+    _send(future, function, args)
+    return future
+
+def _send(future, function, args):
+    """Runs function(root, *args) on the dialog thread, passing its outcome on to future."""
+    global _requests, _thread
+    with _lock:
+        if _thread is None:
+            _requests = queue.Queue()
+            _thread = threading.Thread(target=_run_dialogs, name="Dialogs", daemon=True)
+            _thread.start()
+    _requests.put((future, function, args))
+
+def _ask(function, *args):
+    """Shows a dialog that returns an answer and waits for it."""
+    if threading.current_thread() is _thread:
+        raise RuntimeError("Can't wait for a dialog from the dialog thread")
+    return _submit(function, *args).result()
+
+def _notify(kind, title, message, wait):
+    """Shows a notification, unless it is a repeat (see the module docstring). If wait is True, waits until it is closed."""
+    key = (kind, title, message)
+    with _lock:
+        pending = _notifications.get(key)
+        if pending is not None:
+            pending[0] += 1
+            future = pending[1]
+            logger.info("%s dialog already showing, not showing it again: %s", kind.capitalize(), message)
+        elif not wait and time.monotonic() - _closed_at.get(key, float("-inf")) < NOTIFICATION_COOLDOWN:
+            logger.info("%s dialog was closed less than %i seconds ago, not showing it again: %s", kind.capitalize(),
+                        NOTIFICATION_COOLDOWN, message)
+            return
+        else:
+            future = Future()
+            _notifications[key] = [1, future]
+
+    if pending is None:
+        future.add_done_callback(_log_failure)
+        _send(future, _show_notification, (key,))
+    if wait:
+        future.exception()
+
+def _log_failure(future):
+    if future.exception() is not None:
+        logger.error("Showing dialog failed! Reason: %s", future.exception())
+
+def _show_notification(root, key):
+    kind, title, message = key
+    with _lock:
+        repeats = _notifications[key][0]
+    if repeats > 1:
+        message += "\n\n(This happened %i times.)" % repeats
+    try:
+        messagebox = _tk().messagebox
+        show = messagebox.showerror if kind == "error" else messagebox.showwarning
+        show(title=title, message=message, parent=root)
+    finally:
+        with _lock:
+            del _notifications[key]
+            _closed_at[key] = time.monotonic()
+
+def _save_dialog(root, title, defaultextension, initialdir, initialfile):
+    return _tk().filedialog.asksaveasfilename(title=title, defaultextension=defaultextension,
+                                              initialfile=initialfile, initialdir=initialdir, parent=root)
 
 def save_dialog_box(title = "Save File As...", defaultextension = "", 
                     initialdir=None, initialfile=None, filetypes=None):
@@ -39,14 +159,10 @@ def save_dialog_box(title = "Save File As...", defaultextension = "",
     Returns the file name the user wants to save the file as if successful,
     None if not.
     """
+    return _ask(_save_dialog, title, defaultextension, initialdir, initialfile)
 
-    root = tkinter.Tk()
-    root.withdraw() # hide the main tk window
-    filename = tkinter.filedialog.asksaveasfilename(title=title, defaultextension=defaultextension,
-                                                    initialfile=initialfile, initialdir=initialdir)
-    root.destroy()
-    
-    return filename
+def _string_input(root, title, prompt, initialvalue):
+    return _tk().simpledialog.askstring(title=title, prompt=prompt, initialvalue=initialvalue, parent=root)
 
 def string_input_box(title="String Entry", prompt="Enter a string: ", initialvalue=""):
     """Show a dialog box where a string can be input.
@@ -56,43 +172,32 @@ def string_input_box(title="String Entry", prompt="Enter a string: ", initialval
     initialvalue: The initial value of the string in the entry box.
     Returns the string that was input, or None if the window was exited.
     """
-    
-    root = tkinter.Tk()
-    root.withdraw() # hide the main tk window
-    result = tkinter.simpledialog.askstring(title=title, prompt=prompt, initialvalue=initialvalue)
-    root.destroy()
-    
-    return result
-
-def error_dialog_box(title="ImgurSwitcher", message="An error occurred."):
+    return _ask(_string_input, title, prompt, initialvalue)
+
+def error_dialog_box(title="ImgurSwitcher", message="An error occurred.", wait=False):
     """Shows an error dialog box.
 
     title: The title of the dialog box.
     message: The message to show.
+    wait: if True, waits until the user has closed it (e.g. before the program exits).
 
     Returns nothing.
     """
-    
-    root = tkinter.Tk()
-    root.withdraw() # hide the main tk window
-    result = tkinter.messagebox.showerror(title=title, message=message)
-    root.destroy()
-    
-
-def warning_dialog_box(title="ImgurSwitcher", message="A warning occurred."):
+    _notify("error", title, message, wait)
+
+def warning_dialog_box(title="ImgurSwitcher", message="A warning occurred.", wait=False):
     """Shows a warning dialog box.
 
     title: The title of the dialog box.
     message: The message to show.
+    wait: if True, waits until the user has closed it.
 
     Returns nothing.
     """
-    
-    root = tkinter.Tk()
-    root.withdraw() # hide the main tk window
-    result = tkinter.messagebox.showwarning(title=title, message=message)
-    root.destroy()
-    
+    _notify("warning", title, message, wait)
+
+def _confirm(root, title, message):
+    return _tk().messagebox.askokcancel(title=title, message=message, parent=root)
 
 def confirm_dialog_box(title="ImgurSwitcher", message="Do you want to proceed?"):
     """Shows a confirm dialog box.
@@ -102,10 +207,4 @@ def confirm_dialog_box(title="ImgurSwitcher", message="Do you want to proceed?")
 
     Returns what the user selected (True or False for Ok or Cancel).
     """
-    
-    root = tkinter.Tk()
-    root.withdraw() # hide the main tk window
-    result = tkinter.messagebox.askokcancel(title=title, message=message)
-    root.destroy()
-    
-    return result
\ No newline at end of file
+    return _ask(_confirm, title, message)
@@ -20,10 +20,23 @@ callbacks). Import as many times as you like, but DON'T TOUCH _event_queue DIREC
 module's put and get_and_exec methods instead (go read them for further info). This allows
 for proper event blocking management and proper argument validation, since the queue expects a 
 specific input format.
+
+Items come out in priority order (lowest number first) and, within a priority, in the order
+they were put, so two queued ALT+D presses always run in the order they were pressed.
+
+Events whose callable is a CoalescingEvent can be merged into an event of the same kind that
+is still waiting in the queue, or can cancel earlier waiting events that they make pointless.
+This is how a burst of key presses ends up costing one download instead of one per press.
 """
 
+import time
 import queue
+import bisect
 import logging
+import threading
+from collections import deque
+from .cancellation import CancelToken
+from . import metrics
 
 # Queue priorities
 LOW_PRIORITY = 10
@@ -36,8 +49,20 @@ max_queue_size = 200
 queue_op_timeout = 10  # seconds
 
 _event_queue = None
-_blocked = False # Used to block adding to the event queue in certain situations.
-_reset_flag = False
+
+# Guards the queue's blocked and reset_requested flags and the coalescing state below.
+# Taken before the queue's own lock when both are needed.
+_lock = threading.Lock()
+_pending = [] # CoalescingEvents that are in the queue and haven't been taken out yet
+_last_put = None # the callable most recently put in the queue, while it is still waiting
+_running = [] # (callable, CancelToken) of each event being executed right now
+_times = {} # CancelToken of each taken event -> time it was put, for metrics
+
+_put_listeners = [] # called with no arguments after every put, see add_put_listener
+
+# True while the runtime runs blocking events on a lane of their own (see worker.PoolWorker). An
+# urgent blocking event then doesn't wait for the running events, so it doesn't interrupt them.
+separate_blocking_lane = False
 
 logger = logging.getLogger(__name__)
 
@@ -49,6 +74,9 @@ def set_queue_timeout(timeout):
 def set_max_queue_size(size):
     global max_queue_size
     max_queue_size = size
+    if _event_queue is not None:
+        # Applies straight away; if the queue holds more than size events, they're kept and puts fail until it drains
+        _event_queue.maxsize = size
     logger.debug("Event queue size set to %i", max_queue_size)
 
 def put(trip: tuple):
@@ -57,23 +85,65 @@ def put(trip: tuple):
     trip: a triple with an integer as the first item, a callable object as the second (e.g. a function), and a bool as the third:
     (int, callable, bool).
 
-    Internally, this adds the triple trip to the queue if _blocked is False.
-    If triple[2] is True, then _blocked is set to True so that no more items can be added until get_and_exec
-    unblocks the queue.
+    Internally, this adds the triple trip to the queue if the queue isn't blocked.
+    If triple[2] is True, then the queue is blocked so that no more items can be added until get_and_exec
+    unblocks it.
+
+    If trip[1] is a CoalescingEvent and the event put immediately before it is still waiting, trip[1]
+    may be merged into that one instead of being added. It also cancels any waiting events it supersedes.
+
+    Putting an event can also cancel the event that is running right now (through its CancelToken):
+    an event with URGENT_PRIORITY always does (and the running event is put back in the queue
+    afterwards), and a CoalescingEvent does if it preempts the running one.
+
+    Returns False if trip was dropped (because the queue is blocked or full), True otherwise.
     """
-    global _blocked, _event_queue
-    if not _blocked:
-        try:
-            _event_queue.put(trip, False, queue_op_timeout)
-        except queue.Full:
-            logger.error("Insertion of (%i, %s, %s) into event queue failed: queue full!", trip[0], trip[1], trip[2])
-            return
+    global _last_put
+    event = trip[1]
+    with _lock:
+        if _event_queue.blocked:
+            logger.debug("Blocking insertion of (%i, %s, %s) into event queue", trip[0], trip[1], trip[2])
+            metrics.increment("queue.blocked_drops")
+            return False
+
+        merged_into = None
+        if isinstance(event, CoalescingEvent):
+            if _last_put is not None and event.merge_into(_last_put):
+                logger.debug("Merged %s into the waiting %s", event.__name__, _last_put.__name__)
+                metrics.increment("queue.merged")
+                merged_into = _last_put
+            else:
+                for pending in _pending:
+                    if not pending.cancelled and event.supersedes(pending):
+                        logger.debug("%s supersedes the waiting %s", event.__name__, pending.__name__)
+                        pending.cancel()
+                        metrics.increment("queue.superseded")
+
+        if merged_into is None:
+            try:
+                _event_queue.put(trip)
+            except queue.Full:
+                logger.error("Insertion of (%i, %s, %s) into event queue failed: queue full!", trip[0], trip[1], trip[2])
+                metrics.increment("queue.full_rejections")
+                return False
+
+            metrics.increment("queue.put")
+            depth = _event_queue.qsize()
+            metrics.set_gauge("queue.depth", depth)
+            metrics.observe("queue.depth_on_put", depth)
+            if isinstance(event, CoalescingEvent):
+                _pending.append(event)
+            _last_put = event
 
-        if not _blocked and trip[2]:
-            _blocked = True
-            logger.debug("Input queue blocked ")
-    else:
-        logger.debug("Blocking insertion of (%i, %s, %s) into event queue", trip[0], trip[1], trip[2])
+            if trip[2]:
+                _event_queue.blocked = True
+                logger.debug("Input queue blocked ")
+
+        _preempt_running(trip[0], merged_into or event, trip[2])
+
+    if merged_into is None:
+        _notify_put()
+    return True
 
 def get_and_exec():
     """Gets the next item from the queue and calls the callable.
@@ -83,36 +153,135 @@ def get_and_exec():
     callable. It also unblocks the queue (allows it to receive further input) if
     recovered_triple[2] is True.
 
-    Also calls _reset if the _reset_flag was set by an operation, since this should be 
+    Also calls _reset if a reset was requested by an operation, since this should be 
     done when the execution of that operation is complete.
+
+    CoalescingEvents are called with a CancelToken that put cancels if a newer event
+    preempts them. If the cancellation asked for it, the event is put back in the queue.
+
+    Equivalent to execute(*take()); runtimes that run events on other threads call those separately.
     """
+    execute(*take())
 
+def take(block=True, blocking=None):
+    """Waits for the next item in the queue and returns (triple, token) for passing to execute.
 
-    global _blocked, _event_queue
-    triple = _event_queue.get()
+    From here on the item counts as running: nothing more can be merged into it, and
+    put can cancel it through token.
+
+    block: if False, raises queue.Empty straight away instead of waiting when the queue is empty.
+    blocking: if True or False, only an item whose triple[2] is that is taken (the others stay
+    where they are), for runtimes that run blocking items apart from the others.
+    """
+    global _last_put
+    triple, put_at = _event_queue.get_entry(block, blocking)
+    token = CancelToken()
+    metrics.observe("queue.wait_ms", (time.perf_counter() - put_at) * 1000)
+    metrics.set_gauge("queue.depth", _event_queue.qsize())
+
+    # Once it's out of the queue nothing else can be merged into it
+    with _lock:
+        if triple[1] in _pending:
+            _pending.remove(triple[1])
+        if _last_put is triple[1]:
+            _last_put = None
+        _running.append((triple[1], token))
+        _times[token] = put_at
+    return triple, token
+
+def execute(triple, token):
+    """Calls the callable of a triple returned by take, then does the queue's bookkeeping for it.
+
+    Thread-safe, so several items can be executed at once by different threads.
+    """
     logger.debug("Executing callback: %s", triple[1].__name__)
-    triple[1]()
-    _event_queue.task_done()
+    started = time.perf_counter()
+    try:
+        if isinstance(triple[1], CoalescingEvent):
+            triple[1](token)
+        else:
+            triple[1]()
+    finally:
+        with _lock:
+            _running.remove((triple[1], token))
+            put_at = _times.pop(token, started)
+            # Done here so that a callback that raises doesn't leave the queue blocked for good.
+            # See if we need to reset the queue. Holding the lock keeps anything
+            # from being put while we're trying to change things
+            if _event_queue.reset_requested:
+                _reset()
+                _event_queue.blocked = False
+            # If triple[2] is true then this means that this item has blocked the queue,
+            # so unblock it
+            elif triple[2]:
+                _event_queue.blocked = False
+        _event_queue.task_done()
+        metrics.observe_since("event.run_ms." + triple[1].__name__, started)
+        metrics.observe_since("event.total_ms." + triple[1].__name__, put_at)
     logger.debug("Done executing callback: %s", triple[1].__name__)
-    
-    # See if we need to reset the queue. If yes then reset and return
-    if _reset_flag:
-        # Block queue temporarily to prevent more items being loaded
-        # while we're trying to change things
-        _blocked = True
-        _reset()
-        _blocked = False
-        return
-
-    # If triple[2] is true then this means that this item has blocked the queue,
-    # so unblock it
-    if _blocked and triple[2]:
-        _blocked = False 
+
+    if token.cancelled and token.requeue:
+        _requeue(triple)
+
+def _preempt_running(priority, event, blocking):
+    """Cancels the running events that the event just put (or merged into) should preempt.
+
+    Call with _lock held.
+    """
+    for running, token in _running:
+        if priority == URGENT_PRIORITY:
+            if blocking and separate_blocking_lane:
+                # It runs on its own lane, without waiting for the running events
+                continue
+            if isinstance(running, CoalescingEvent) and token.cancel(requeue=True):
+                logger.info("Urgent event %s interrupted the running %s", event.__name__, running.__name__)
+                metrics.increment("queue.preempted")
+        elif isinstance(event, CoalescingEvent) and isinstance(running, CoalescingEvent) and event.preempts(running):
+            if token.cancel():
+                event.absorb(running)
+                logger.debug("%s interrupted the running %s", event.__name__, running.__name__)
+                metrics.increment("queue.preempted")
+
+def _requeue(triple):
+    """Puts an interrupted event back in the queue, even if the queue is blocked.
+
+    It goes in front of the other events with its priority, since it was taken out before them.
+    """
+    with _lock:
+        try:
+            _event_queue.put(triple, front=True)
+        except queue.Full:
+            logger.error("Could not put interrupted %s back in the event queue: queue full!", triple[1].__name__)
+            return
+        if isinstance(triple[1], CoalescingEvent):
+            _pending.append(triple[1])
+    logger.debug("Put interrupted %s back in the event queue", triple[1].__name__)
+    metrics.increment("queue.requeued")
+    _notify_put()
+
+def join():
+    """Blocks until every item put in the queue so far has been executed."""
+    _event_queue.join()
+
+def add_put_listener(listener):
+    """Registers listener to be called (with no arguments, on the putting thread) after an item is put in the queue.
+
+    For runtimes that don't wait in take, e.g. one running an asyncio loop, to find out
+    that there is something to take. Keep listeners quick; the platform hook calls put.
+    """
+    _put_listeners.append(listener)
+
+def _notify_put():
+    for listener in _put_listeners:
+        try:
+            listener()
+        except Exception as e:
+            logger.warning("Event queue put listener %s failed. Reason: %s", listener, e)
 
 def init():
     """Initializes the event queue."""
     global _event_queue
-    _event_queue = queue.PriorityQueue(max_queue_size)
+    _event_queue = _EventQueue(max_queue_size)
     logger.info("Event queue initialized with size %i", max_queue_size)
 
 def reset():
@@ -122,31 +291,178 @@ def reset():
     at the end of the operation currently being processed. Done this way
     because replacing the event queue in the middle of an operation causes
     errors with task_done()."""
-    global _reset_flag
-    _reset_flag = True
+    with _lock:
+        _event_queue.reset_requested = True
     logger.info("Event queue reset triggered. Will be executed after current item is processed")
 
 def _reset():
-    """Actually does the resetting of the event queue. Internal use only."""
-
-    global _reset_flag
-    if _reset_flag:
-        global _event_queue
-        _event_queue = queue.PriorityQueue(max_queue_size)
-        logger.info("Event queue reset with size %i", max_queue_size)
-        _reset_flag = False
-
-# Need this because the priority queue sometimes
-# throws exceptions when we try and compare two tuples
-# that have the same first value (because it then tries to compare
-# two functions and fails). Use this as a decorator class to fix this
-# problem.
-class TupleSortingOn0(tuple):
-    def __lt__(self, rhs):
-        return self[0] < rhs[0]
-    def __gt__(self, rhs):
-        return self[0] > rhs[0]
-    def __le__(self, rhs):
-        return self[0] <= rhs[0]
-    def __ge__(self, rhs):
-        return self[0] >= rhs[0]
\ No newline at end of file
+    """Actually does the resetting of the event queue. Internal use only.
+
+    Empties the queue in place (rather than replacing it) so that a thread
+    already waiting in take keeps waiting on the right queue. Call with _lock held.
+    """
+    global _last_put
+    _event_queue.clear()
+    _event_queue.maxsize = max_queue_size
+    _event_queue.reset_requested = False
+    del _pending[:]
+    _last_put = None
+    metrics.set_gauge("queue.depth", 0)
+    logger.info("Event queue reset with size %i", max_queue_size)
+
+class _EventQueue:
+    """Queue of (priority, callable, block) triples with one FIFO deque per priority and block value.
+
+    Has the parts of queue.PriorityQueue's interface that this module uses, and raises the
+    same queue.Full and queue.Empty, but never compares items: they come out lowest priority
+    number first and, within a priority, in the order they were put. Blocking and non-blocking
+    items are kept apart so that a taker that only wants one kind (see get_entry) doesn't have
+    to look through the other. There are only ever a few priorities, so put and get are O(1).
+
+    blocked and reset_requested belong to the module's put/execute logic and are
+    guarded by the module's _lock, not by this queue's lock.
+    """
+
+    def __init__(self, maxsize=0):
+        self.maxsize = maxsize # 0 or less means unbounded
+        self.blocked = False # no more items can be put until the blocking item has been executed
+        self.reset_requested = False # set by reset, acted on after the current item is executed
+        self._mutex = threading.Lock()
+        self._not_empty = threading.Condition(self._mutex)
+        self._all_tasks_done = threading.Condition(self._mutex)
+        # (priority, item[2]) -> deque of (sequence number, item, time.perf_counter() when it was put).
+        # The sequence numbers give the order between the two lanes of a priority.
+        self._lanes = {}
+        self._priorities = [] # the priorities in _lanes, sorted
+        self._last_sequence = 0 # of the last item put at the back of its lane
+        self._first_sequence = 0 # of the last item put in front of its lane
+        self._size = 0
+        self._unfinished_tasks = 0
+
+    def qsize(self):
+        with self._mutex:
+            return self._size
+
+    def put(self, item, front=False):
+        """Adds item behind the other items with the same priority (or in front of them, if front is True).
+
+        Never waits; raises queue.Full if the queue is full.
+        """
+        with self._mutex:
+            if 0 < self.maxsize <= self._size:
+                raise queue.Full
+            key = (item[0], bool(item[2]))
+            lane = self._lanes.get(key)
+            if lane is None:
+                lane = self._lanes[key] = deque()
+                if (item[0], not key[1]) not in self._lanes:
+                    bisect.insort(self._priorities, item[0])
+            if front:
+                self._first_sequence -= 1
+                lane.appendleft((self._first_sequence, item, time.perf_counter()))
+            else:
+                self._last_sequence += 1
+                lane.append((self._last_sequence, item, time.perf_counter()))
+            self._size += 1
+            self._unfinished_tasks += 1
+            # All of them, since a taker that only takes some items (see get_entry) may not want this one
+            self._not_empty.notify_all()
+
+    def get(self, block=True):
+        """Removes and returns the next item, waiting for one if block is True (otherwise raises queue.Empty)."""
+        return self.get_entry(block)[0]
+
+    def get_entry(self, block=True, blocking=None):
+        """Same as get, but returns (item, time.perf_counter() when it was put).
+
+        If blocking is True or False, only an item whose item[2] is that is returned (the first
+        one in the usual order); the queue counts as empty if there isn't one.
+        """
+        with self._not_empty:
+            kinds = (False, True) if blocking is None else (bool(blocking),)
+            while True:
+                for priority in self._priorities:
+                    first = None
+                    for kind in kinds:
+                        lane = self._lanes.get((priority, kind))
+                        if lane and (first is None or lane[0][0] < first[0][0]):
+                            first = lane
+                    if first is not None:
+                        self._size -= 1
+                        return first.popleft()[1:]
+                if not block:
+                    raise queue.Empty
+                self._not_empty.wait()
+
+    def get_nowait(self):
+        return self.get(False)
+
+    def clear(self):
+        """Removes all the waiting items; they count as done for task_done/join."""
+        with self._mutex:
+            for lane in self._lanes.values():
+                lane.clear()
+            self._unfinished_tasks -= self._size
+            self._size = 0
+            if self._unfinished_tasks <= 0:
+                self._all_tasks_done.notify_all()
+
+    def task_done(self):
+        """Marks an item that was got as done."""
+        with self._mutex:
+            if self._unfinished_tasks <= 0:
+                raise ValueError("task_done() called too many times")
+            self._unfinished_tasks -= 1
+            if self._unfinished_tasks == 0:
+                self._all_tasks_done.notify_all()
+
+    def join(self):
+        """Blocks until every item put has been got and marked done."""
+        with self._all_tasks_done:
+            while self._unfinished_tasks:
+                self._all_tasks_done.wait()
+
+class CoalescingEvent:
+    """Base class for queued callables that can be merged with, or supersede, other waiting events.
+
+    Subclasses implement run (the actual work, which gets a cancellation.CancelToken) and override
+    merge_into, supersedes and/or preempts. A cancelled event does nothing when it is called.
+    """
+
+    def __init__(self):
+        self.cancelled = False
+
+    @property
+    def __name__(self):
+        return type(self).__name__
+
+    def merge_into(self, pending):
+        """Tries to fold this event into pending, the callable put just before it (which is still waiting).
+
+        Returns True if it did, in which case this event is not added to the queue.
+        """
+        return False
+
+    def supersedes(self, pending):
+        """Returns True if pending (a waiting CoalescingEvent) is made pointless by this event being queued."""
+        return False
+
+    def preempts(self, running):
+        """Returns True if running (the CoalescingEvent being executed) should be interrupted now that this event is queued."""
+        return False
+
+    def absorb(self, interrupted):
+        """Called when this event interrupted the running event interrupted, to take over whatever it still had to do."""
+        pass
+
+    def cancel(self):
+        self.cancelled = True
+
+    def run(self, token):
+        raise NotImplementedError
+
+    def __call__(self, token=None):
+        if self.cancelled:
+            logger.debug("Skipping cancelled %s", self.__name__)
+            return
+        self.run(token if token is not None else CancelToken())
@@ -18,4 +18,21 @@
 class ImgurSwitcherException(Exception):
     """Simple general exception class to use if something goes wrong with this program."""
     def __init__(self, msg=None):
+        # Passed on so that str(e) (and so "%s" % e in the logs) gives the message
+        super().__init__(*(() if msg is None else (msg,)))
         self.message = msg
+
+class HttpError(ImgurSwitcherException):
+    """Exception for an HTTP request that came back with an error status code.
+
+    code: the HTTP status code.
+    url: the URL that was requested.
+    """
+    def __init__(self, code, url):
+        super().__init__("HTTP Error %i fetching %s" % (code, url))
+        self.code = code
+        self.url = url
+
+class DownloadCancelled(ImgurSwitcherException):
+    """Exception for a download that was stopped before it finished because it was no longer wanted."""
+    pass
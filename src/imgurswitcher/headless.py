@@ -0,0 +1,200 @@
+# Copyright Patrick Perrier, 2015
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+""" Module contains the headless ("null") platform functionality.
+
+Has the same main/set_as_background/exit_program surface as the Windows module, but needs
+no desktop: instead of hooking the keyboard it reads commands from a script file (or stdin),
+and instead of changing the desktop background it records when each background was applied.
+It's for running and profiling the whole pipeline on machines without a desktop (e.g. Linux
+build hosts). Select it by setting the IMGURSWITCHER_PLATFORM environment variable to Headless.
+
+Commands, one per line (blank lines and lines starting with # are ignored):
+
+    next [count]      same as ALT+D, count times in a row (default 1)
+    prev [count]      same as ALT+A
+    random [count]    same as ALT+R
+    sleep <seconds>   pause before the next command
+    wait              wait until every queued event has been executed
+    stats [path]      write the metrics (see metrics.py) to the log, and to path if given
+    quit              stop (no confirmation dialog, unlike ALT+Q)
+
+The single-letter hotkeys (d, a, r, q) work too. When the script ends, main waits for the
+queued events to finish and stops.
+
+Other environment variables:
+
+    IMGURSWITCHER_SCRIPT             the command file to read (default: stdin)
+    IMGURSWITCHER_REPORT             a file to write a JSON report of the run to: command to
+                                     background latencies (p50/p95/p99), throughput, the
+                                     times each background was applied and the metrics
+    IMGURSWITCHER_SET_BACKGROUND_MS  how long setting the background should take, to simulate
+                                     the cost of the real call (default 0)
+    IMGURSWITCHER_SCREEN_SIZE        the screen size to fit images to, e.g. 1920x1080 (default:
+                                     none, so images aren't fitted)
+"""
+
+import logging
+logger = logging.getLogger(__name__)
+
+import os
+import sys
+import json
+import time
+import threading
+from . import event_queue as eq
+from . import hotkeys
+from . import metrics
+
+SCRIPT_VARIABLE = "IMGURSWITCHER_SCRIPT"
+REPORT_VARIABLE = "IMGURSWITCHER_REPORT"
+SET_BACKGROUND_MS_VARIABLE = "IMGURSWITCHER_SET_BACKGROUND_MS"
+SCREEN_SIZE_VARIABLE = "IMGURSWITCHER_SCREEN_SIZE"
+
+_quit = threading.Event()
+_lock = threading.Lock()
+_started = None
+_commands = [] # (perf_counter time, command) of each event put in the queue
+_applied = [] # (perf_counter time, path) of each background that was set
+
+_ALIASES = {"d": "next", "a": "prev", "r": "random", "q": "quit"}
+
+def set_as_background(path):
+    set_background_ms = float(os.environ.get(SET_BACKGROUND_MS_VARIABLE) or 0)
+    if set_background_ms:
+        time.sleep(set_background_ms / 1000.0)
+    with _lock:
+        _applied.append((time.perf_counter(), path))
+    logger.debug("Background set to %s (headless)", path)
+    return True
+
+def screen_size():
+    size = os.environ.get(SCREEN_SIZE_VARIABLE)
+    if not size:
+        return None
+    try:
+        width, height = (int(part) for part in size.lower().split("x"))
+        return (width, height)
+    except ValueError:
+        logger.warning("Ignoring bad screen size %s", size)
+        return None
+
+def exit_program():
+    logger.info("Exiting program (headless)...")
+    _quit.set()
+
+def _run_command(line):
+    """Runs one line of the command script."""
+    words = line.split()
+    if not words or words[0].startswith("#"):
+        return
+    command = _ALIASES.get(words[0].lower(), words[0].lower())
+
+    try:
+        if command in ("next", "prev", "random"):
+            for _ in range(int(words[1]) if len(words) > 1 else 1):
+                with _lock:
+                    _commands.append((time.perf_counter(), command))
+                # Same events the keyboard hook puts
+                eq.put(hotkeys.make_event(command))
+        elif command == "sleep":
+            time.sleep(float(words[1]))
+        elif command == "wait":
+            eq.join()
+        elif command == "stats":
+            metrics.dump(words[1] if len(words) > 1 else None)
+        elif command == "quit":
+            exit_program()
+        else:
+            logger.warning("Unknown headless command: %s", line.strip())
+    except (IndexError, ValueError):
+        logger.warning("Bad headless command: %s", line.strip())
+
+def _read_commands():
+    script = os.environ.get(SCRIPT_VARIABLE)
+    logger.info("Reading headless commands from %s", script or "stdin")
+    try:
+        source = open(script, 'r') if script else sys.stdin
+        with source:
+            for line in source:
+                if _quit.is_set():
+                    return
+                _run_command(line)
+        # End of the script: let whatever it queued finish, then stop
+        eq.join()
+    except Exception as e:
+        logger.error("Reading headless commands failed! Reason: %s", e)
+    exit_program()
+
+def _percentile(ordered, percent):
+    return ordered[min(len(ordered) - 1, max(0, int(round(percent / 100.0 * len(ordered))) - 1))]
+
+def report():
+    """Returns a dict describing the run so far.
+
+    The latency of a command is the time from it being put in the queue until the next
+    background was set. Commands that were merged into another one (see
+    event_queue.CoalescingEvent) count towards the background that the merged event set.
+    """
+    with _lock:
+        commands = list(_commands)
+        applied = list(_applied)
+
+    latencies = []
+    next_applied = 0
+    for put_at, command in commands:
+        while next_applied < len(applied) and applied[next_applied][0] < put_at:
+            next_applied += 1
+        if next_applied < len(applied):
+            latencies.append((applied[next_applied][0] - put_at) * 1000)
+
+    elapsed = time.perf_counter() - _started if _started is not None else 0
+    result = {
+        "commands": len(commands),
+        "backgrounds_applied": len(applied),
+        "elapsed_s": elapsed,
+        "backgrounds_per_s": len(applied) / elapsed if elapsed else 0,
+        "applied_at_s": [at - _started for at, path in applied] if _started is not None else [],
+    }
+    latencies.sort()
+    if latencies:
+        result["command_to_background_ms"] = {"count": len(latencies), "p50": _percentile(latencies, 50),
+                                              "p95": _percentile(latencies, 95), "p99": _percentile(latencies, 99),
+                                              "max": latencies[-1]}
+    result["metrics"] = metrics.snapshot()
+    return result
+
+def main():
+    """Headless main function.
+
+    Runs the command script and waits until it is done (or exit_program is called).
+    """
+    global _started
+    logger.info("Starting headless main...")
+    _started = time.perf_counter()
+    threading.Thread(target=_read_commands, name="HeadlessCommands", daemon=True).start()
+    _quit.wait()
+
+    result = report()
+    logger.info("Headless run done: %i commands, %i backgrounds applied in %.1f s", result["commands"],
+                result["backgrounds_applied"], result["elapsed_s"])
+    report_path = os.environ.get(REPORT_VARIABLE)
+    if report_path:
+        try:
+            with open(report_path, 'w') as report_file:
+                json.dump(result, report_file, indent=2)
+        except Exception as e:
+            logger.error("Writing the headless report to %s failed! Reason: %s", report_path, e)
+    logger.debug("Done headless main")
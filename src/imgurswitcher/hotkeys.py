@@ -0,0 +1,122 @@
+# Copyright Patrick Perrier, 2015
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Module that holds the hotkey actions and the dispatch table the keyboard hook uses.
+
+The keyboard hook runs for every key press on the system, so anything slow in it adds
+input lag to everything the user types. imgur_callbacks (and everything it imports) is only
+loaded on the first bound key press, so that importing this module doesn't hold up the hook
+going in. The table of which key does what is built once
+(by load, from config.hotkeys) and is never changed, only replaced by a new one when the
+key bindings in the config file change. on_key_down looks the key up in it without
+allocating anything. Only a key that is actually bound allocates,
+for the event it puts in the queue.
+
+The actions are:
+
+    next    set background to the next image in the album
+    prev    set background to the previous image in the album
+    random  set background to a random image in the album
+    save    save the current image (i.e. copy it so it's not deleted when the image changes)
+    url     change the Imgur album that images are pulled from
+    quit    quit the program
+    stats   write the event pipeline metrics to the log and metrics.json (unbound by default)
+"""
+
+import logging
+from types import MappingProxyType
+from . import config as cfg
+from . import event_queue as eq
+
+logger = logging.getLogger(__name__)
+
+ACTIONS = ("next", "prev", "random", "save", "url", "quit", "stats")
+
+# What each action puts in the queue, set by _load_actions
+_navigation = None
+_commands = None
+
+def _load_actions():
+    global _navigation, _commands
+    from . import imgur_callbacks as callbacks
+
+    # The other actions always put the same thing, so it's made once here.
+    # Format: (priority in event queue, callback to call, block event queue until processed?)
+    _commands = {
+        "save": (eq.HIGH_PRIORITY, callbacks.ImgurCallbacks.save_image, True),
+        "url": (eq.HIGH_PRIORITY, callbacks.ImgurCallbacks.change_url, True),
+        # Quitting is urgent: it interrupts whatever is running (e.g. a slow download)
+        "quit": (eq.URGENT_PRIORITY, callbacks.ImgurCallbacks.quit_program, True),
+        "stats": (eq.LOW_PRIORITY, callbacks.ImgurCallbacks.dump_metrics, False),
+    }
+    # Navigation uses event objects (created per key press) so that bursts get coalesced in the queue.
+    # Set last: make_event checks this one.
+    _navigation = {
+        "next": lambda: callbacks.MoveEvent(1),
+        "prev": lambda: callbacks.MoveEvent(-1),
+        "random": lambda: callbacks.RandomEvent(),
+    }
+
+_table = MappingProxyType({}) # virtual key code -> action; set by load
+
+def make_event(action):
+    """Returns the event queue triple for action (one of ACTIONS)."""
+    if _navigation is None:
+        _load_actions()
+    if action in _navigation:
+        return (eq.LOW_PRIORITY, _navigation[action](), False)
+    return _commands[action]
+
+def build_table(bindings):
+    """Returns the (read-only) dispatch table for bindings, a dict of action -> key.
+
+    Keys are letters or digits, whose virtual key codes are their upper case character codes.
+    If two actions are bound to the same key, the first one (in ACTIONS order) keeps it.
+    """
+    table = {}
+    for action in ACTIONS:
+        key = bindings.get(action)
+        if not key:
+            continue
+        key_id = ord(key.upper())
+        if key_id in table:
+            logger.warning("ALT+%s is bound to both %s and %s; keeping %s", key.upper(), table[key_id], action, table[key_id])
+            continue
+        table[key_id] = action
+    return MappingProxyType(table)
+
+def load():
+    """Builds the dispatch table from config.hotkeys. Call before installing the keyboard hook."""
+    global _table
+    _table = build_table(cfg.hotkeys)
+    logger.info("Hotkeys: %s", ", ".join("ALT+%s %s" % (chr(key_id), action) for key_id, action in sorted(_table.items())))
+
+def _on_config_reload(changed):
+    if any(key.startswith("key_") for key in changed):
+        load()
+
+cfg.add_reload_listener(_on_config_reload)
+
+def on_key_down(key_id):
+    """Puts the event for the key with virtual key code key_id (pressed with ALT) in the queue.
+
+    Returns True if the key is bound (so the key press should be swallowed), False otherwise.
+    """
+    action = _table.get(key_id)
+    if action is None:
+        return False
+    eq.put(make_event(action))
+    logger.debug("Loaded %s into event queue", action)
+    return True
@@ -0,0 +1,325 @@
+# Copyright Patrick Perrier, 2015
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Module that holds the HTTP client used for everything ImgurSwitcher downloads.
+
+urllib opens a new connection (and does a new TLS handshake) for every request. The
+client in this module keeps a pool of keep-alive connections per host instead, limits
+how many connections can be open to a host at once, reads response bodies in bounded
+chunks and records how long each request took. Use the shared instance from get_client.
+"""
+
+import time
+import socket
+import logging
+import functools
+import threading
+import http.client
+import urllib.parse
+from collections import namedtuple, deque
+from . import config as cfg
+from . import exceptions as xcpt
+from . import cancellation
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+# How many bytes to read from a response at a time
+CHUNK_SIZE = 64 * 1024
+
+# How many redirects to follow before giving up
+MAX_REDIRECTS = 5
+
+_REDIRECT_CODES = (301, 302, 303, 307, 308)
+
+# A cancellable request waiting for a free connection checks its token this often, in seconds
+_SLOT_WAIT = cancellation.CANCEL_LATENCY_BUDGET_MS / 2000.0
+
+# Timing information for one request. All times are in milliseconds from the start of the request.
+# connect_ms is 0 if a pooled connection was reused.
+RequestTiming = namedtuple("RequestTiming", ["url", "status", "reused", "connect_ms", "first_byte_ms", "total_ms", "bytes"])
+
+def _shutdown(connection):
+    """Shuts down the socket of connection, if it has one, so that a send or read blocked on it returns (or fails) straight away."""
+    sock = connection.sock
+    if sock is not None:
+        try:
+            sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass # already closed
+
+class Response:
+    """A streamed HTTP response. Use as a context manager, or call close when done.
+
+    Reading the whole body hands the connection back to the pool for reuse; closing
+    the response before that throws the connection away instead.
+
+    token and on_cancel: the cancellation token the request was made with and the callback
+    registered with it, which is removed when the response is closed.
+    """
+
+    def __init__(self, client, key, connection, response, url, reused, started, connect_ms, token=None, on_cancel=None):
+        self._client = client
+        self._key = key
+        self._connection = connection
+        self._response = response
+        self.url = url
+        self.status = response.status
+        self.headers = response.headers
+        self._reused = reused
+        self._started = started
+        self._connect_ms = connect_ms
+        self._first_byte_ms = (time.perf_counter() - started) * 1000
+        self.bytes_read = 0
+        self._closed = False
+        self._aborted = False
+        self._token = token
+        self._on_cancel = on_cancel
+
+    def iter_chunks(self, chunk_size=CHUNK_SIZE):
+        """Yields the body in chunks of at most chunk_size bytes."""
+        while True:
+            chunk = self._response.read(chunk_size)
+            if not chunk:
+                break
+            self.bytes_read += len(chunk)
+            yield chunk
+
+    def read(self, max_bytes=None):
+        """Reads and returns the whole body.
+
+        max_bytes: if given, raises ImgurSwitcherException rather than read a body bigger than this.
+        """
+        chunks = []
+        for chunk in self.iter_chunks():
+            if max_bytes is not None and self.bytes_read > max_bytes:
+                raise xcpt.ImgurSwitcherException("Response from %s is bigger than %i bytes" % (self.url, max_bytes))
+            chunks.append(chunk)
+        return b"".join(chunks)
+
+    def abort(self):
+        """Stops the response from another thread by shutting down its socket.
+
+        Makes a read that is blocked waiting on the network return (or fail) straight away.
+        The connection is not reused afterwards.
+        """
+        self._aborted = True
+        _shutdown(self._connection)
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        if self._token is not None:
+            self._token.remove_callback(self._on_cancel)
+            if self._token.cancelled:
+                self._aborted = True # the token's callback may have shut the socket down
+        # Only a fully read response leaves the connection in a state where it can be reused
+        reusable = self._response.isclosed() and not self._response.will_close and not self._aborted
+        if not self._response.isclosed():
+            self._response.close()
+        self._client._release(self._key, self._connection, reusable)
+        self._client._record(RequestTiming(self.url, self.status, self._reused, self._connect_ms, self._first_byte_ms,
+                                           (time.perf_counter() - self._started) * 1000, self.bytes_read))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+class HttpClient:
+    """HTTP client with a keep-alive connection pool per host.
+
+    max_connections: the maximum number of connections open to any one host at once. Requests
+    past that wait for a connection to be handed back.
+    timeout: socket timeout, in seconds.
+    """
+
+    def __init__(self, max_connections=4, timeout=30):
+        self.max_connections = max_connections
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._idle = {} # (scheme, host, port) -> list of idle connections
+        self._slots = {} # (scheme, host, port) -> semaphore limiting the open connections
+        self._timings = deque(maxlen=100) # the most recent request timings
+
+    def _slot(self, key):
+        with self._lock:
+            if key not in self._slots:
+                self._slots[key] = threading.BoundedSemaphore(self.max_connections)
+            return self._slots[key]
+
+    def _acquire(self, key, token=None):
+        """Returns (connection, reused) for key, opening a new connection if no idle one is pooled.
+
+        If all max_connections are in use, waits for one to be handed back. token: a
+        cancellation.CancelToken; DownloadCancelled is raised if it is cancelled while waiting.
+        """
+        slot = self._slot(key)
+        if token is None:
+            slot.acquire()
+        else:
+            while not slot.acquire(timeout=_SLOT_WAIT):
+                token.check()
+        with self._lock:
+            idle = self._idle.get(key)
+            if idle:
+                return idle.pop(), True
+
+        scheme, host, port = key
+        connection_class = http.client.HTTPSConnection if scheme == "https" else http.client.HTTPConnection
+        return connection_class(host, port, timeout=self.timeout), False
+
+    def _release(self, key, connection, reusable):
+        if reusable:
+            with self._lock:
+                self._idle.setdefault(key, []).append(connection)
+        else:
+            connection.close()
+        self._slot(key).release()
+
+    def _record(self, timing):
+        self._timings.append(timing)
+        metrics.increment("http.requests")
+        metrics.increment("http.bytes", timing.bytes)
+        if timing.reused:
+            metrics.increment("http.reused")
+        metrics.observe("http.first_byte_ms", timing.first_byte_ms)
+        metrics.observe("http.total_ms", timing.total_ms)
+        logger.debug("HTTP %s %i: %i bytes, first byte %.1f ms, total %.1f ms (%s)", timing.url, timing.status, timing.bytes,
+                     timing.first_byte_ms, timing.total_ms, "reused connection" if timing.reused else "connect %.1f ms" % timing.connect_ms)
+
+    def timings(self):
+        """Returns the timings of the most recent requests, oldest first."""
+        return list(self._timings)
+
+    def _send(self, url, headers, token=None):
+        """Sends one GET request (no redirect handling) and returns the Response.
+
+        token: a cancellation.CancelToken. Cancelling it shuts down the connection, so that a
+        request waiting for the response stops and DownloadCancelled is raised.
+        """
+        parts = urllib.parse.urlsplit(url)
+        key = (parts.scheme, parts.hostname, parts.port or (443 if parts.scheme == "https" else 80))
+        path = parts.path or "/"
+        if parts.query:
+            path += "?" + parts.query
+
+        started = time.perf_counter()
+        connection, reused = self._acquire(key, token)
+        on_cancel = functools.partial(_shutdown, connection)
+        try:
+            if token is not None:
+                # Registered before connecting; a connect in progress has no socket to shut down yet,
+                # so the token is checked again once it is done
+                token.on_cancel(on_cancel)
+            connect_ms = 0
+            if not reused:
+                connection.connect()
+                connect_ms = (time.perf_counter() - started) * 1000
+            if token is not None:
+                token.check()
+            try:
+                connection.request("GET", path, headers=headers)
+                response = connection.getresponse()
+            except (http.client.BadStatusLine, ConnectionError):
+                # (BadStatusLine is what an empty response from a closed connection raises on Python 3.4;
+                # RemoteDisconnected, from 3.5 on, is a subclass of it)
+                if not reused or (token is not None and token.cancelled):
+                    raise
+                # The server closed the idle connection on us; try once more on a fresh one
+                logger.debug("Pooled connection to %s went stale, reconnecting", parts.hostname)
+                connection.close()
+                connection.connect()
+                reused = False
+                connect_ms = (time.perf_counter() - started) * 1000
+                connection.request("GET", path, headers=headers)
+                response = connection.getresponse()
+        except BaseException:
+            self._release(key, connection, False)
+            if token is not None:
+                token.remove_callback(on_cancel)
+                token.check() # the shutdown made the request fail; raises DownloadCancelled instead
+            raise
+        return Response(self, key, connection, response, url, reused, started, connect_ms, token, on_cancel)
+
+    def get(self, url, headers=None, token=None):
+        """Sends a GET request for url, following redirects, and returns the streamed Response.
+
+        Raises exceptions.HttpError if the final status is an error (400 or above).
+        Other statuses, including 304 Not Modified, are returned to the caller.
+
+        token: a cancellation.CancelToken. If it is cancelled, waiting for a connection or for the
+        response stops and exceptions.DownloadCancelled is raised; so does reading the body after that.
+        """
+        headers = dict(headers or {})
+        for _ in range(MAX_REDIRECTS + 1):
+            response = self._send(url, headers, token)
+            if response.status in _REDIRECT_CODES and response.headers.get("Location"):
+                response.read() # so the connection can be reused
+                response.close()
+                url = urllib.parse.urljoin(url, response.headers["Location"])
+                continue
+            if response.status >= 400:
+                response.close()
+                raise xcpt.HttpError(response.status, url)
+            return response
+        raise xcpt.ImgurSwitcherException("Too many redirects fetching %s" % url)
+
+    def download(self, url, path, token=None):
+        """Streams the body of url into the file at path and returns the number of bytes written.
+
+        token: a cancellation.CancelToken. If it is cancelled the download stops (also while it
+        is waiting for a connection, or on the network) and exceptions.DownloadCancelled is raised.
+        The partial file is left for the caller to clean up.
+        """
+        if token is not None:
+            token.check()
+        with self.get(url, token=token) as response, open(path, 'wb') as out_file:
+            try:
+                for chunk in response.iter_chunks():
+                    if token is not None:
+                        token.check()
+                    out_file.write(chunk)
+            except (OSError, http.client.HTTPException):
+                if token is not None and token.cancelled:
+                    token.check() # raises DownloadCancelled
+                raise
+
+            if token is not None:
+                # The abort can make the body look like it ended early rather than fail
+                token.check()
+            return response.bytes_read
+
+    def close(self):
+        """Closes all the idle pooled connections."""
+        with self._lock:
+            for connections in self._idle.values():
+                for connection in connections:
+                    connection.close()
+            self._idle = {}
+
+_client = None
+_client_lock = threading.Lock()
+
+def get_client():
+    """Returns the shared HttpClient, creating it (with the configured connection limit) on first use."""
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = HttpClient(max_connections=cfg.http_connections, timeout=cfg.http_timeout)
+            logger.info("HTTP client created with up to %i connections per host", cfg.http_connections)
+        return _client
@@ -0,0 +1,215 @@
+# Copyright Patrick Perrier, 2015
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Module that holds the on-disk image cache.
+
+Downloaded images are kept in a directory under the data directory, one file per
+Imgur image ID, so that going back and forth through an album doesn't download
+the same image twice. The cache has a cap on the total number of bytes it holds
+and evicts the least recently used images first. The LRU order is kept in an index
+file so that the cache survives restarts. Adding an image only schedules a write of the
+index, SAVE_DELAY seconds later, so that a burst of downloads is one write; save_index
+writes it straight away (e.g. at exit).
+"""
+
+import os
+import json
+import logging
+import tempfile
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+# Name of the index file inside the cache directory
+INDEX_FILE_NAME = "index.json"
+
+# Seconds to wait after the cache changes before writing the index, so a burst of changes is one write
+SAVE_DELAY = 2.0
+
+class ImageCache:
+    """Bounded, least-recently-used cache of image files keyed by Imgur image ID.
+
+    directory: the directory to keep the cached images in. Created if it doesn't exist.
+    max_bytes: the maximum total size of the cached images, in bytes.
+    save_delay: seconds between a change and the write of the index it schedules. Defaults to SAVE_DELAY.
+
+    Thread-safe; the callbacks and the prefetcher use the same cache.
+    """
+
+    def __init__(self, directory, max_bytes, save_delay=None):
+        self._dir = directory
+        self.max_bytes = max_bytes
+        self._save_delay = save_delay if save_delay is not None else SAVE_DELAY
+        self._lock = threading.RLock()
+        self._save_lock = threading.Lock() # held while the index is written, so that writes don't share the temporary file
+        self._save_timer = None
+        self._entries = OrderedDict() # image ID -> size in bytes, least recently used first
+        self._total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+        os.makedirs(self._dir, exist_ok=True)
+        self._load_index()
+
+    def _path_for(self, image_id):
+        return os.path.join(self._dir, image_id + ".jpg")
+
+    def temp_path(self, image_id):
+        """Creates an empty file in the cache directory to download image_id to before calling add, and returns its path.
+
+        Every call gets a file of its own, so that two downloads of the same image (e.g. the
+        prefetcher's and the one for a key press) don't write into each other's. The caller
+        removes it if the download fails.
+        """
+        fd, path = tempfile.mkstemp(suffix=".part", prefix=image_id + ".", dir=self._dir)
+        os.close(fd)
+        return path
+
+    def _load_index(self):
+        """Reads the index file, keeping only the entries whose files still exist."""
+        index_path = os.path.join(self._dir, INDEX_FILE_NAME)
+        try:
+            with open(index_path, 'r') as index_file:
+                entries = json.load(index_file)
+        except FileNotFoundError:
+            entries = []
+        except Exception as e:
+            logger.warning("Could not read image cache index at %s, starting with an empty cache. Reason: %s", index_path, e)
+            entries = []
+
+        for image_id, size in entries:
+            if os.path.isfile(self._path_for(image_id)):
+                self._entries[image_id] = size
+                self._total_bytes += size
+
+        # Get rid of files that the index doesn't know about (e.g. interrupted downloads)
+        known = set(image_id + ".jpg" for image_id in self._entries)
+        known.add(INDEX_FILE_NAME)
+        for file_name in os.listdir(self._dir):
+            if file_name not in known:
+                self._remove_file(os.path.join(self._dir, file_name))
+
+        logger.info("Image cache loaded from %s: %i images, %i bytes", self._dir, len(self._entries), self._total_bytes)
+        self._evict()
+
+    def save_index(self):
+        """Writes the index (and so the LRU order) to disk now, instead of when a scheduled write would."""
+        index_path = os.path.join(self._dir, INDEX_FILE_NAME)
+        with self._save_lock:
+            with self._lock:
+                if self._save_timer is not None:
+                    self._save_timer.cancel()
+                    self._save_timer = None
+                entries = list(self._entries.items())
+            try:
+                with open(index_path + ".tmp", 'w') as index_file:
+                    json.dump(entries, index_file)
+                os.replace(index_path + ".tmp", index_path)
+            except Exception as e:
+                logger.warning("Could not write image cache index to %s. Reason: %s", index_path, e)
+
+    def _schedule_save(self):
+        """Writes the index after the save delay, along with any other changes made until then."""
+        with self._lock:
+            if self._save_timer is None:
+                self._save_timer = threading.Timer(self._save_delay, self.save_index)
+                self._save_timer.daemon = True
+                self._save_timer.start()
+
+    def contains(self, image_id):
+        """Returns True if image_id is cached. Doesn't count as a hit or a miss, or change the LRU order."""
+        with self._lock:
+            return image_id in self._entries
+
+    def peek(self, image_id):
+        """Returns the path to the cached image with ID image_id, or None. Like contains, doesn't count or change anything."""
+        with self._lock:
+            if image_id in self._entries:
+                return self._path_for(image_id)
+            return None
+
+    def get(self, image_id):
+        """Returns the path to the cached image with ID image_id (marking it most recently used), or None."""
+        with self._lock:
+            if image_id in self._entries and os.path.isfile(self._path_for(image_id)):
+                self._entries.move_to_end(image_id)
+                self.hits += 1
+                logger.debug("Image cache hit for %s", image_id)
+                return self._path_for(image_id)
+
+            if image_id in self._entries:
+                # Someone deleted the file out from under us
+                self._total_bytes -= self._entries.pop(image_id)
+            self.misses += 1
+            logger.debug("Image cache miss for %s", image_id)
+            return None
+
+    def add(self, image_id, downloaded_path):
+        """Moves the file at downloaded_path into the cache as image_id and returns its new path.
+
+        Evicts least recently used images if the cache is now over its byte cap. The image
+        that was just added is never evicted by this call.
+        """
+        path = self._path_for(image_id)
+        size = os.path.getsize(downloaded_path)
+        with self._lock:
+            os.replace(downloaded_path, path)
+            if image_id in self._entries:
+                self._total_bytes -= self._entries.pop(image_id)
+            self._entries[image_id] = size
+            self._total_bytes += size
+            self._evict(keep=image_id)
+        self._schedule_save()
+        return path
+
+    def remove(self, image_id):
+        """Removes image_id from the cache, if it is there."""
+        with self._lock:
+            if image_id in self._entries:
+                self._total_bytes -= self._entries.pop(image_id)
+                self._remove_file(self._path_for(image_id))
+
+    def resize(self, max_bytes):
+        """Changes the byte cap, evicting least recently used images if the cache is now over it."""
+        with self._lock:
+            self.max_bytes = max_bytes
+            self._evict()
+        self._schedule_save()
+
+    def _evict(self, keep=None):
+        """Removes least recently used images until the cache fits in max_bytes."""
+        with self._lock:
+            for image_id in list(self._entries):
+                if self._total_bytes <= self.max_bytes:
+                    break
+                if image_id == keep:
+                    continue
+                logger.debug("Evicting %s from the image cache", image_id)
+                self.remove(image_id)
+
+    def stats(self):
+        """Returns a dict with the cache's hit/miss counters and its current size."""
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses,
+                    "images": len(self._entries), "bytes": self._total_bytes, "max_bytes": self.max_bytes}
+
+    @staticmethod
+    def _remove_file(path):
+        try:
+            os.remove(path)
+        except OSError:
+            # Doesn't matter, just don't kill the program
+            pass
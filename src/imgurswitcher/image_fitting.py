@@ -0,0 +1,73 @@
+# Copyright Patrick Perrier, 2015
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Module that fits downloaded images to the screen, so that setting the background doesn't have to.
+
+Imgur originals can be huge, and Windows decodes and scales the image every time it is set
+as the background. With Pillow installed (it's optional), each image is decoded once, scaled
+down so that it just covers the screen (like Windows' Fill style) and re-encoded as a JPEG.
+The callbacks keep the result in the image cache next to the original, under
+fitted_id(image_id, screen size), and do the fitting on the background threads.
+
+Without Pillow (or with fit_to_screen: 0 in the config file, or if the platform can't tell
+the screen size) the originals are used, as before.
+"""
+
+import logging
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+logger = logging.getLogger(__name__)
+
+# Quality of the re-encoded images (Pillow's scale: 1 to 95)
+JPEG_QUALITY = 90
+
+def available():
+    """Returns True if images can be fitted (i.e. Pillow is installed)."""
+    return Image is not None
+
+def fitted_id(image_id, screen_size):
+    """Returns the image cache ID of image_id fitted to screen_size (a (width, height) tuple)."""
+    return "%s@%ix%i" % (image_id, screen_size[0], screen_size[1])
+
+def cover_size(image_size, screen_size):
+    """Returns the size image_size has to be scaled down to so it just covers screen_size, or None if it's no bigger than that already."""
+    scale = max(screen_size[0] / image_size[0], screen_size[1] / image_size[1])
+    if scale >= 1:
+        return None
+    return (max(1, round(image_size[0] * scale)), max(1, round(image_size[1] * scale)))
+
+def fit(source, destination, screen_size):
+    """Writes the image in the file source, fitted to screen_size, to the file destination as a JPEG.
+
+    Returns False (without writing anything) if there's nothing to gain: the image is a JPEG
+    that isn't bigger than the screen. Lets Pillow's exceptions through (e.g. for a broken image).
+    """
+    with Image.open(source) as image:
+        size = cover_size(image.size, screen_size)
+        if size is None and image.format == "JPEG":
+            return False
+        if size is not None and image.format == "JPEG":
+            # Lets the JPEG decoder skip most of the work by decoding at a fraction of the full size (no smaller than size)
+            image.draft("RGB", size)
+        fitted = image.convert("RGB") # also takes the first frame of an animated GIF
+        if size is not None:
+            fitted = fitted.resize(size, getattr(Image, "Resampling", Image).LANCZOS)
+        fitted.save(destination, "JPEG", quality=JPEG_QUALITY, optimize=True)
+    logger.debug("Fitted %s to %ix%i", source, fitted.size[0], fitted.size[1])
+    return True
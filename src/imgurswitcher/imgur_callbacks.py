@@ -22,230 +22,606 @@ the appropriate platform-specific module in this package and then update config.
 expose the function/set its implementation (see existing code for examples).
 """
 
-import re
 import os
+import time
 import random
 import shutil
+import atexit
 import logging
-import urllib.request, urllib.parse, urllib.error
+import threading
+from collections import namedtuple
 from . import config as cfg
+from . import event_queue as eq
 from . import dialogs as dialogs
+from . import exceptions as xcpt
+from . import album_cache
+from . import worker
+from . import metrics
+from . import image_fitting
+from . import album_indexer
+from . import album_diff
+from .album_index import AlbumIndex
+from . import cancellation
+from .cancellation import CancelToken
+from .http_client import get_client
 from . import get_data
+from .prefetch import Prefetcher
+from .image_cache import ImageCache
 
 logger = logging.getLogger(__name__)
 
-def _initialize_images():
+# Directory (inside the data directory) where downloaded images are cached
+CACHE_DIR_NAME = "cache"
+
+# Added to an image ID, gives the ID of Imgur's reduced-size variant of the image (h is "huge",
+# 1024 pixels on the longest side). Used for the previews in progressive mode.
+PREVIEW_SUFFIX = "h"
+
+# File (inside the data directory) that the stats hotkey writes the metrics to
+METRICS_FILE_NAME = "metrics.json"
+
+# Where an image ID list returned by _read_image_list came from, so that it can be refreshed:
+# the album, the list itself (a refresh only applies while that very list is in use), the validators
+# of the album page it was read from (and of its last page, see album_indexer.fetch), and whether it
+# has been checked against Imgur yet.
+_AlbumSource = namedtuple("_AlbumSource", ["album_id", "ids", "etag", "last_modified", "last_page", "checked"])
+
+def _album_list_url(album_id):
+    """Returns the URL of the scriptless version of the album page for album_id."""
+    return ImgurCallbacks.album_stub + album_id + "/layout/blog"
+
+def _fetch_image_list(album_id, etag=None, last_modified=None, on_ids=None, last_page=None):
+    """Downloads the album page (all of its pages, see album_indexer.py) for album_id and returns the image IDs in it.
+
+    etag, last_modified, last_page: the validators of a stored copy of the album page. If given, the
+    request is made conditional, so nothing is downloaded when the album hasn't changed.
+    on_ids: if given, called with the list of the IDs found so far each time more of them
+    come in, while the album is still downloading. Shouldn't block.
+
+    Returns a tuple (ids, etag, last_modified, last_page) with the new validators; ids is None if the
+    album page hasn't changed since the stored copy. Lets the HTTP client's exceptions through.
+    """
+    # Parts of this code modified from https://github.com/alexgisby/imgur-album-downloader
+    return album_indexer.fetch(_album_list_url(album_id), etag, last_modified, on_ids, last_page=last_page)
+
+def _abort_on_read_error(reason):
+    """Tells the user that Imgur couldn't be read and terminates the program."""
+    logger.critical("Error reading Imgur: %s. Aborting program...", reason)
+    dialogs.error_dialog_box(message="Error reading Imgur: %s.\n\nImgurSwitcher will shut down." % reason, wait=True)
+    raise xcpt.ImgurSwitcherException("Error reading Imgur: %s" % reason)
+
+def _initialize_images(on_ids=None):
     """Initializes ImgurCallbacks' image ID list from the URL given in the config module.
 
     Should not be called from outside ImgurCallbacks.
-    This function will also cause the program to terminate if the config URL is not valid,
-    or if an error occurs.
+    Used at startup: returns (list, source) from _read_image_list, and causes the program to terminate
+    if the config URL is not valid, or if an error occurs. on_ids is passed on to _read_image_list.
     """
     
     # This should always be True because cfg.parse_cfg_file should always be called before this is,
     # but here for redundancy anyway.
-    if cfg.verify_url(cfg.imgur_album_url):
-        # Read the image ID's into a list and return them.
-        # Parts of this code modified from https://github.com/alexgisby/imgur-album-downloader
-        
-        fullListURL = "http://imgur.com/a/" + cfg.album_id + "/layout/blog" # the scriptless version of the album page
+    if not cfg.verify_url(cfg.imgur_album_url):
+        logger.critical("The provided URL is not a valid Imgur URL! Aborting program...")
+        dialogs.error_dialog_box(message="The provided URL is not a valid Imgur URL!\n\nImgurSwitcher will shut down.", wait=True)
+        raise xcpt.ImgurSwitcherException("The provided URL is not a valid Imgur URL!")
 
-        logger.info("Initializing image ID list to point to %s" % fullListURL)
+    try:
+        return _read_image_list(cfg.album_id, on_ids)
+    except xcpt.ImgurSwitcherException as e:
+        _abort_on_read_error(e)
+
+def _read_image_list(album_id, on_ids=None):
+    """Returns (the image ID list (an AlbumIndex) of album_id, where it came from (an _AlbumSource, or None)).
+
+    If the album's image ID list was stored by an earlier run, it is returned right away, to be
+    revalidated against Imgur once it is in use (see refresh_album). Otherwise the album page is downloaded now;
+    on_ids is passed on to _fetch_image_list, to see the IDs before the whole page is in.
+    The caller sets ImgurCallbacks._source along with _image_ids, once the list is put in use.
+    Raises ImgurSwitcherException (with what went wrong) if the album can't be read.
+    """
+    stored = album_cache.load(album_id)
+    if stored is not None:
+        logger.info("Image list initialized from stored index, revalidating once it is in use")
+        metrics.increment("album.index_loads")
+        return stored["ids"], _AlbumSource(album_id, stored["ids"], stored["etag"], stored["last_modified"], stored["last_page"], False)
 
-        response = None
-        response_code = None
+    logger.info("Initializing image ID list to point to %s", _album_list_url(album_id))
+    try:
+        logger.debug("Attempting to download image list...")
+        ids, etag, last_modified, last_page = _fetch_image_list(album_id, on_ids=on_ids)
+    except xcpt.HttpError as e:
+        if e.code != 404:
+            raise xcpt.ImgurSwitcherException("Error Code %d" % e.code)
+
+        # It COULD be a single-picture gallery, which doesn't play nicely with being turned into an album (404 error).
+        # Try a straight download of the one picture if we get a 404, see if that works.
+        single_url = ImgurCallbacks.imgur_stub + album_id
+        logger.info("404 code, trying single image download from URL %s...", single_url)
         try:
-            logger.debug("Attempting to download image list...")
-            response = urllib.request.urlopen(url=fullListURL)
-            response_code = response.getcode()
+            get_client().get(single_url).close()
+        except xcpt.HttpError as e:
+            raise xcpt.ImgurSwitcherException("Error Code %d" % e.code)
         except Exception as e:
-            response = False
-            response_code = e.code
-        
-        if not response or response.getcode() != 200:
-            # It COULD be a single-picture gallery, which doesn't play nicely with being turned into an album (404 error).
-            # Try a straight download of the one picture if we get a 404, see if that works.
-            if response_code == 404:
-                logger.info("404 code, trying single image download from URL %s...", r"http://i.imgur.com/" + cfg.album_id)
-                fullListURL = r"http://i.imgur.com/" + cfg.album_id # hardcode imgur stub in because we have to 
-                try:
-                    response = urllib.request.urlopen(url=fullListURL)
-                    response_code = response.getcode()
-                except Exception as e:
-                    response = False
-                    response_code = e.code
-                if not response or response.getcode() != 200:
-                    logger.critical("Error reading Imgur: Error Code %d. Aborting program..." % response_code)
-                    dialogs.error_dialog_box("Error reading Imgur: Error Code %d.\n\nImgurSwitcher will shut down." % response_code)
-                    raise cfg.ImgurSwitcherException("Error reading Imgur: Error Code %d" % response_code)
-            else:
-                logger.critical("Error reading Imgur: Error Code %d. Aborting program..." % response_code)
-                dialogs.error_dialog_box("Error reading Imgur: Error Code %d.\n\nImgurSwitcher will shut down." % response_code)
-                raise cfg.ImgurSwitcherException("Error reading Imgur: Error Code %d" % response_code)
+            raise xcpt.ImgurSwitcherException(str(e))
+        logger.info("Single image found. Image list initialized")
+        return AlbumIndex([album_id]), None
+    except Exception as e:
+        raise xcpt.ImgurSwitcherException(str(e))
 
-        html = response.read().decode('utf-8')
-        logger.info("Image list download successful. Image list initialized")
-        return re.findall('<div id="([a-zA-Z0-9]+)" class="post-image-container', html) # found by inspecting the source of an imgur album page
+    ids = AlbumIndex(ids)
+    album_cache.save(album_id, ids, etag, last_modified, last_page)
+    metrics.increment("album.index_downloads")
+    logger.info("Image list download successful. Image list initialized")
+    return ids, _AlbumSource(album_id, ids, etag, last_modified, last_page, True)
 
-    else:
-        logger.critical("The provided URL is not a valid Imgur URL! Aborting program...")
-        dialogs.error_dialog_box("The provided URL is not a valid Imgur URL!\n\nImgurSwitcher will shut down.")
-        raise cfg.ImgurSwitcherException("The provided URL is not a valid Imgur URL!")
+def _read_new_album(album_id):
+    """Returns (image ID list, source) for album_id as _read_image_list does, for switching to it while the program is running.
 
-def _download_image(url):
-    """Helper that downloads images.
+    Unlike _initialize_images, a failure doesn't end the program: the user is told and None is
+    returned, so that the current album can stay in use.
+    """
+    try:
+        return _read_image_list(album_id)
+    except Exception as e:
+        logger.error("Loading album %s failed, staying on the current album. Reason: %s", album_id, e)
+        dialogs.error_dialog_box(title="Album Error", message="Error reading Imgur: %s.\n\nStaying on the current album." % e)
+        return None
 
-    url: the url to download the image from.
+def refresh_album(unchecked_only=False):
+    """Checks the album in use against Imgur in the background, and applies whatever changed in it (see _revalidate_images).
+
+    Called every refresh_minutes by album_refresher, and (with unchecked_only) once an image list
+    from the stored index is in use. Does nothing if the list in use didn't come from _initialize_images
+    (a single image, or an album that is still loading).
+    """
+    source = ImgurCallbacks._source
+    if source is None or source.ids is not ImgurCallbacks._image_ids or source.album_id != cfg.album_id:
+        return
+    if unchecked_only and source.checked:
+        return
+    ImgurCallbacks._source = source._replace(checked=True)
+    worker.background_executor().submit(_revalidate_images, source.album_id, source.ids, source.etag, source.last_modified,
+                                        source.last_page)
+
+def _revalidate_images(album_id, base, etag, last_modified, last_page=None):
+    """Checks an album's image ID list against Imgur and applies the changes to it, if the album changed.
+
+    album_id: the ID of the album.
+    base: the image ID list (an AlbumIndex) in use.
+    etag, last_modified, last_page: the validators of the album page base was read from.
+
+    Runs in a background thread, so errors are only logged; base stays in use.
+    """
+    metrics.increment("album.refreshes")
+    try:
+        ids, etag, last_modified, last_page = _fetch_image_list(album_id, etag, last_modified, last_page=last_page)
+    except Exception as e:
+        logger.warning("Revalidating the index for album %s failed, keeping the current one. Reason: %s", album_id, e)
+        metrics.increment("album.refresh_failures")
+        return
+
+    if ids is None:
+        logger.info("Album %s has not changed", album_id)
+        return
+    if not ids:
+        logger.warning("Album %s came back with no images, keeping the current index", album_id)
+        return
+
+    ids = AlbumIndex(ids)
+    started = time.perf_counter()
+    changes = album_diff.diff(base, ids)
+    metrics.observe_since("album.diff_ms", started)
+    album_cache.save(album_id, ids, etag, last_modified, last_page)
+    worker.run_ordered(_apply_album_changes, album_id, base, _AlbumSource(album_id, ids, etag, last_modified, last_page, True),
+                       changes, wait=False)
+
+def _apply_album_changes(album_id, base, source, changes):
+    """Puts the refreshed image ID list (source.ids) in place of base, which changes (an album_diff.AlbumDiff) goes from.
+
+    Only what changed is dealt with: the images that are gone are dropped from the image cache,
+    and the current image stays current, wherever it is in the album now.
+    """
+    # Only apply the new list if the user hasn't switched albums (or the list wasn't replaced otherwise) in the meantime
+    if album_id != cfg.album_id or ImgurCallbacks._image_ids is not base:
+        return
+    if not changes:
+        # Only the validators are new; base stays in use, so it is still what the next refresh goes from
+        ImgurCallbacks._source = source._replace(ids=base)
+        logger.info("Album %s has not changed", album_id)
+        return
+    ImgurCallbacks._source = source
+    logger.info("Album %s has changed (%i images added, %i removed, %i moved), updating the image list (%i images)",
+                album_id, len(changes.added), len(changes.removed), len(changes.moved), len(source.ids))
+    metrics.increment("album.refresh_changes")
+    metrics.increment("album.diff_added", len(changes.added))
+    metrics.increment("album.diff_removed", len(changes.removed))
+    metrics.increment("album.diff_moved", len(changes.moved))
+
+    ImgurCallbacks._image_ids = source.ids
+    for image_id in changes.removed:
+        _forget_image(image_id)
+    if cfg.album_pos and len(base):
+        old_position = (cfg.album_pos - 1) % len(base)
+        image_id = base[old_position]
+        position = changes.new_position(old_position, image_id)
+        if position is None:
+            logger.info("Image %s is not in the album any more, staying at position %i", image_id, cfg.album_pos)
+        elif position != old_position:
+            logger.info("Image %s is at position %i now (was %i)", image_id, position + 1, old_position + 1)
+            cfg.set_album_pos(position + 1, image_id)
+    ImgurCallbacks._prefetcher.recenter(source.ids, cfg.album_pos)
+
+def _forget_image(image_id):
+    """Drops everything the image cache holds for image_id (the image, its preview and its fitted copy)."""
+    ImgurCallbacks._cache.remove(image_id)
+    ImgurCallbacks._cache.remove(image_id + PREVIEW_SUFFIX)
+    if ImgurCallbacks._screen_size is not None:
+        ImgurCallbacks._cache.remove(image_fitting.fitted_id(image_id, ImgurCallbacks._screen_size))
+
+def _anchor(ids, image_id):
+    """Moves the album position to wherever image_id (the current image) is in ids, the album's new image list.
+
+    This way the same image stays current when images are added to or removed from the album.
+    The position stays as it is if image_id isn't known, or isn't in the album any more.
+    """
+    position = ids.position_of(image_id) if image_id else None
+    if position is None:
+        if image_id:
+            logger.info("Image %s is not in the album any more, staying at position %i", image_id, cfg.album_pos)
+        return
+    if position + 1 != cfg.album_pos or image_id != cfg.current_image:
+        logger.info("Image %s is at position %i now (was %i)", image_id, position + 1, cfg.album_pos)
+        cfg.set_album_pos(position + 1, image_id)
+
+def _download_image(image_id, token=None, quiet=False):
+    """Helper that downloads images into the image cache.
+
+    image_id: the Imgur ID of the image to download.
+    token: a cancellation.CancelToken that stops the download if it gets cancelled.
+    quiet: if True, a failed download is only logged (no error dialog).
 
     Returns the path to the downloaded image, or None
-    if the download was not successful.
+    if the download was not successful (or was cancelled).
     """
+    url = _image_url(image_id)
     logger.info("Downloading image from URL: %s", url)
+    part_path = ImgurCallbacks._cache.temp_path(image_id)
+    started = time.perf_counter()
     try:
-        path_to_image, junk2 = urllib.request.urlretrieve(url, ImgurCallbacks._img_path) # clobbers the old image
-        return os.path.abspath(path_to_image) # We know where the images will be already, more of a sentinel "this worked"
+        executor = worker.background_executor()
+        if getattr(executor, "runs_coroutines", False):
+            # The asyncio runtime does its network I/O on its event loop
+            from . import async_http_client
+            size = executor.submit(async_http_client.get_client().download, url, part_path, token).result()
+        else:
+            size = get_client().download(url, part_path, token)
+        path = ImgurCallbacks._cache.add(image_id, part_path)
+        metrics.observe_since("download.ms", started)
+        metrics.observe("download.bytes", size)
+        return path
+    except xcpt.DownloadCancelled:
+        logger.info("Download from URL: %s was cancelled", url)
+        try:
+            os.remove(part_path)
+        except Exception:
+            pass
+        return None
     except Exception as e:
         logger.error("Download from URL: %s failed! Reason: %s", url, e)    
-        dialogs.error_dialog_box(title="Download Error" , message="Image download failed!")    
+        try:
+            os.remove(part_path)
+        except Exception:
+            pass
+        if not quiet:
+            dialogs.error_dialog_box(title="Download Error" , message="Image download failed!")    
         return None
 
+def _image_url(image_id):
+    """Returns the URL to download the image with ID image_id from."""
+    # Need arbitrary image type extension to get to the page with just the image.
+    # We'll assume that the file is a jpg, because it probably is according to 
+    # my interpretation of https://help.imgur.com/hc/en-us/articles/201424906-What-file-types-are-allowed
+    # Alternatively, future development could read the magic bytes of the image and figure out
+    # what image type it was.
+    return ImgurCallbacks.imgur_stub + image_id + ".jpg"
+
+def _cached_image(image_id, token=None, quiet=False):
+    """Returns the path to the image with ID image_id in the image cache.
+
+    Only goes to the network if the image isn't cached (or about to be, by the prefetcher).
+    Returns None if the image had to be downloaded and that was not successful,
+    or if token got cancelled. quiet is passed on to _download_image.
+    """
+    ImgurCallbacks._prefetcher.wait_for(image_id, token)
+    path = ImgurCallbacks._cache.get(image_id)
+    if path is None and not (token is not None and token.cancelled):
+        path = _download_image(image_id, token, quiet)
+    return path
+
+_fit_lock = threading.Lock()
+_fitting = set() # cache IDs of the fitted images being made right now
+_not_fitted = set() # cache IDs of fitted images that weren't worth making (or failed)
+
+def _fit_image(image_id):
+    """Puts a copy of the cached image image_id, fitted to the screen, in the image cache.
+
+    Does nothing if images aren't being fitted, the image isn't cached, or the fitted copy
+    is already there. Runs in a background thread, since decoding a big image takes a while.
+    """
+    screen_size = ImgurCallbacks._screen_size
+    if screen_size is None:
+        return
+    fitted_id = image_fitting.fitted_id(image_id, screen_size)
+    with _fit_lock:
+        if fitted_id in _fitting or fitted_id in _not_fitted or ImgurCallbacks._cache.contains(fitted_id):
+            return
+        _fitting.add(fitted_id)
+
+    part_path = ImgurCallbacks._cache.temp_path(fitted_id)
+    added = False
+    started = time.perf_counter()
+    try:
+        source = ImgurCallbacks._cache.peek(image_id)
+        if source is not None:
+            if image_fitting.fit(source, part_path, screen_size):
+                ImgurCallbacks._cache.add(fitted_id, part_path)
+                added = True
+                metrics.observe_since("fit.ms", started)
+            else:
+                _not_fitted.add(fitted_id)
+    except Exception as e:
+        logger.warning("Fitting image %s to the screen failed, the original will be used. Reason: %s", image_id, e)
+        _not_fitted.add(fitted_id)
+    finally:
+        if not added:
+            try:
+                os.remove(part_path)
+            except Exception:
+                pass
+        with _fit_lock:
+            _fitting.discard(fitted_id)
+
+def _fitted_image(image_id):
+    """Returns the path to the cached copy of image_id fitted to the screen, or None if there isn't one (yet)."""
+    screen_size = ImgurCallbacks._screen_size
+    if screen_size is None:
+        return None
+    fitted_id = image_fitting.fitted_id(image_id, screen_size)
+    if not ImgurCallbacks._cache.contains(fitted_id):
+        return None
+    return ImgurCallbacks._cache.get(fitted_id)
+
+def _fetch_image(image_id, token=None, preview=False):
+    """Puts the image with ID image_id at ImgurCallbacks._img_path.
+
+    Uses the copy fitted to the screen if there is one. Otherwise the original is used,
+    and a fitted copy is made in the background for next time.
+    If preview is True, the small variant of the image (see PREVIEW_SUFFIX) is used instead,
+    as is; if that can't be downloaded, no error dialog is shown.
+
+    Returns the path to the image, or None if this was not successful.
+    If token is given, it is committed (see cancellation.CancelToken) once the image
+    is on disk; None is returned if it was cancelled before then. If there is no image,
+    the token is left as it was, so that whatever is tried next can still be cancelled.
+    """
+    if preview:
+        cached = _cached_image(image_id + PREVIEW_SUFFIX, token, quiet=True)
+    else:
+        cached = _fitted_image(image_id)
+    if cached is None and not preview:
+        cached = _cached_image(image_id, token)
+        if cached is not None and ImgurCallbacks._screen_size is not None:
+            worker.background_executor().submit(_fit_image, image_id)
+    if cached is None:
+        if token is not None and token.cancelled:
+            token.acknowledge()
+            logger.info("Showing image %s was cancelled", image_id)
+        return None
+    if token is not None and not token.commit():
+        token.acknowledge()
+        logger.info("Showing image %s was cancelled", image_id)
+        return None
+    try:
+        shutil.copyfile(cached, ImgurCallbacks._img_path) # clobbers the old image
+        return ImgurCallbacks._img_path
+    except Exception as e:
+        logger.error("Copying image %s out of the cache failed! Reason: %s", image_id, e)
+        dialogs.error_dialog_box(title="Copy Failed" , message="Setting up the image failed!")
+        return None
+
+def _current_image_id():
+    """Returns the ID of the image at cfg.album_pos, or None if there is no current image."""
+    if cfg.album_pos == 0 or not ImgurCallbacks._image_ids:
+        return None
+    return ImgurCallbacks._image_ids[(cfg.album_pos - 1) % len(ImgurCallbacks._image_ids)]
+
+def _have_full_image(image_id):
+    """Returns True if the full image_id (or its copy fitted to the screen) is cached."""
+    if ImgurCallbacks._cache.contains(image_id):
+        return True
+    screen_size = ImgurCallbacks._screen_size
+    return screen_size is not None and ImgurCallbacks._cache.contains(image_fitting.fitted_id(image_id, screen_size))
+
+_pending_swap = None # CancelToken of the full image download started by the last preview, see _swap_in_later
+_swap_lock = threading.Lock() # so a swap can't set its image after _show_image has cancelled it
+
+def _swap_in_later(image_id):
+    """Downloads the full image_id in the background and then sets it as the background, in place of its preview.
+
+    Only done if image_id is still the current image by then; moving on cancels it.
+    """
+    global _pending_swap
+    _pending_swap = CancelToken()
+    worker.background_executor().submit(_fetch_full_image, image_id, _pending_swap)
+
+def _fetch_full_image(image_id, token):
+    if _cached_image(image_id, token) is None or token.cancelled:
+        return
+    # Not waited for: this is a background thread, and the ordered lane may be waiting on a prefetch queued behind it
+    worker.run_ordered(_swap_in, image_id, token, wait=False)
+
+def _swap_in(image_id, token):
+    with _swap_lock:
+        if token.cancelled or _current_image_id() != image_id:
+            logger.debug("Not swapping in the full image %s, the background has changed since", image_id)
+            metrics.increment("progressive.skipped")
+            return
+        if _fetch_image(image_id) is not None and cfg.set_as_background(ImgurCallbacks._img_path):
+            logger.debug("Swapped in the full image %s", image_id)
+            metrics.increment("progressive.swaps")
+
+def _show_image(index, token=None):
+    """Sets the image at index in the album as the background and moves the album position to it.
+
+    Falls back to the default image if setting the background fails. If token (a
+    cancellation.CancelToken) is cancelled before the image is ready, nothing changes.
+
+    In progressive mode (progressive: 1 in the config file), if the full image isn't cached yet
+    its small variant is shown first, and the full image is swapped in once it has been downloaded.
+    """
+    if _pending_swap is not None:
+        with _swap_lock:
+            _pending_swap.cancel() # the user has moved on
+    image_id = ImgurCallbacks._image_ids[index]
+    preview = bool(cfg.progressive) and not _have_full_image(image_id)
+    result = None
+    if preview:
+        result = _fetch_image(image_id, token, preview=True)
+        if result is None and not (token is not None and token.cancelled):
+            logger.info("Could not get the preview of image %s, getting the full image", image_id)
+            preview = False
+    if not preview:
+        result = _fetch_image(image_id, token)
+
+    if result is not None:
+        started = time.perf_counter()
+        background_set = cfg.set_as_background(ImgurCallbacks._img_path)
+        metrics.observe_since("background.set_ms", started)
+        if background_set:
+            logger.debug("Successfully set background")
+            cfg.set_album_pos((index % len(ImgurCallbacks._image_ids)) + 1, image_id) # yay for the python modulus behaviour!
+            logger.debug("New index is %i", cfg.album_pos)
+            ImgurCallbacks._prefetcher.recenter(ImgurCallbacks._image_ids, cfg.album_pos)
+            if preview:
+                _swap_in_later(image_id)
+
+        else:
+            logger.warning("Setting background failed, trying the default image...")
+            # Delete current image file (and the cached copy, in case it's broken) and try the default
+            ImgurCallbacks._cache.remove(image_id + PREVIEW_SUFFIX if preview else image_id)
+            if ImgurCallbacks._screen_size is not None:
+                ImgurCallbacks._cache.remove(image_fitting.fitted_id(image_id, ImgurCallbacks._screen_size))
+            try:
+                os.remove(ImgurCallbacks._img_path)
+            except Exception as e:
+                # Doesn't matter, just don't kill the program
+                pass 
+            if cfg.set_as_background(ImgurCallbacks._DEFAULT_IMAGE):
+                logger.warning("Successfully set default background")
+            else:
+                logger.critical("Something went terribly wrong...")
+                dialogs.error_dialog_box(title="Critical Failure" , message="Something went terribly wrong...")
+
 class ImgurCallbacks:
     """Holds the callbacks and information they require."""
 
-    _image_ids = _initialize_images()
     imgur_stub = r"http://i.imgur.com/"
+    album_stub = r"http://imgur.com/a/"
     # Windows needs absolute paths or it fails to set background properly (gives a black screen)
     _img_path = get_data("background.jpg")
     _DEFAULT_IMAGE = get_data("default.jpg")
 
+    # These are set up by load_images in a background thread, since they need disk and network access.
+    # _loaded is set once they're ready; callbacks that need them wait for it.
+    _image_ids = AlbumIndex()
+    _cache = None
+    _prefetcher = None
+    _loaded = threading.Event()
+    # The (width, height) to fit images to (see image_fitting.py), or None to use the originals
+    _screen_size = None
+    # Where _image_ids came from (an _AlbumSource), or None if it can't be refreshed
+    _source = None
+    # The URL of the album most recently asked for (by change_url or the config file), while it loads;
+    # a switch to any other album that is still loading is abandoned
+    _requested_url = None
+
     @staticmethod
-    def next_image():
-        """Callback to use to fetch the next image in the album and set it as the background."""
-        # cfg.album_pos is 1-indexed, so it is the index we need (no need for modification)
-        index = (cfg.album_pos) % len(ImgurCallbacks._image_ids)
+    def move(steps, token=None):
+        """Callback to move steps images forward (backward if steps is negative) in the album and set that image as the background.
+
+        A burst of next/previous key presses is merged into a single move (see MoveEvent), so only
+        the image that is landed on gets downloaded. token is a cancellation.CancelToken that stops
+        the move (leaving the album position alone) if it is cancelled before the image is ready.
+        """
+        _wait_until_loaded()
+        if steps == 0:
+            logger.debug("Moves cancelled each other out, nothing to do")
+            return
+
+        album_size = len(ImgurCallbacks._image_ids)
+        if steps > 0:
+            # cfg.album_pos is 1-indexed, so it is the index of the next image (no need for modification)
+            index = (cfg.album_pos + steps - 1) % album_size
+        else:
+            # cfg.album_pos is 1-indexed, so cfg.album_pos is the index number for the NEXT image,
+            # cfg.album_pos -1 is the index of the current image, and cfg.album_pos - 2 is the 
+            # index of the previous image (the one we want for steps == -1). This one will take a bit more special case handling
+
+            # Slight "bug" if the starting cfg.album_pos value is one more than some integer multiple
+            # of the album size; calling this will then get you the same image that you currently have.
+            # This is what it SHOULD do, but maybe something should be done about it?
+            index = -1
+            if cfg.album_pos != 0 and album_size != 1:
+                index = (cfg.album_pos % album_size)-2
+            index = (index + steps + 1) % album_size
         logger.debug("Index is %i", index)
+        _show_image(index, token)
 
-        # Need arbitrary image type extension to get to the page with just the image.
-        # We'll assume that the file is a jpg, because it probably is according to 
-        # my interpretation of https://help.imgur.com/hc/en-us/articles/201424906-What-file-types-are-allowed
-        # Alternatively, future development could read the magic bytes of the image and figure out
-        # what image type it was.
-        image_url = ImgurCallbacks.imgur_stub + ImgurCallbacks._image_ids[index] + ".jpg" 
-        result = _download_image(image_url)
-        
-        if result is not None:
-            if cfg.set_as_background(ImgurCallbacks._img_path):
-                logger.debug("Successfully set background")
-                cfg.album_pos = index + 1
-                logger.debug("New index is %i", cfg.album_pos)
-            
-            else:
-                logger.warning("Setting background failed, trying the default image...")
-                # Delete current image file and try the default
-                try:
-                    os.remove(ImgurCallbacks._img_path)
-                except Exception as e:
-                    # Doesn't matter, just don't kill the program
-                    pass 
-                if cfg.set_as_background(ImgurCallbacks._DEFAULT_IMAGE):
-                    logger.warning("Successfully set default background")
-                else:
-                    logger.critical("Something went terribly wrong...")
-                    dialogs.error_dialog_box(title="Critical Failure" , message="Something went terribly wrong...")
+    @staticmethod
+    def next_image():
+        """Callback to use to fetch the next image in the album and set it as the background."""
+        ImgurCallbacks.move(1)
             
     @staticmethod
     def prev_image():
         """Callback to use to fetch the previous image in the album and set it as the background."""
-        # cfg.album_pos is 1-indexed, so cfg.album_pos is the index number for the NEXT image,
-        # cfg.album_pos -1 is the index of the current image, and cfg.album_pos - 2 is the 
-        # index of the previous image (the one we want). This one will take a bit more special case handling
-
-        # Slight "bug" if the starting cfg.album_pos value is one more than some integer multiple
-        # of the album size; calling this will then get you the same image that you currently have.
-        # This is what it SHOULD do, but maybe something should be done about it?
-        index = -1
-        if cfg.album_pos != 0 and len(ImgurCallbacks._image_ids) != 1:
-            index = (cfg.album_pos % len(ImgurCallbacks._image_ids))-2
-        logger.debug("Index is %i", index)
+        ImgurCallbacks.move(-1)
 
-        # Need arbitrary image type extension to get to the page with just a picture.
-        # We'll assume that the file is a jpg, because it probably is according to 
-        # my interpretation of https://help.imgur.com/hc/en-us/articles/201424906-What-file-types-are-allowed
-        # Alternatively, future development could read the magic bytes of the image and figure out
-        # what image type it was.
-        image_url = ImgurCallbacks.imgur_stub + ImgurCallbacks._image_ids[index] + ".jpg" 
-        result = _download_image(image_url)
-        
-        if result is not None:
-            if cfg.set_as_background(ImgurCallbacks._img_path):
-                logger.debug("Successfully set background")
-                cfg.album_pos = (index % len(ImgurCallbacks._image_ids)) + 1 # yay for the python modulus behaviour!
-                logger.debug("New index is %i", cfg.album_pos)
-            else:
-                logger.warning("Setting background failed, trying the default image...")
-                # Delete current image file and try the default
-                try:
-                    os.remove(ImgurCallbacks._img_path)
-                except Exception as e:
-                    # Doesn't matter, just don't kill the program
-                    pass 
+    @staticmethod
+    def random_image(token=None):
+        """Callback to fetch a random image in the album and set it as the background.
 
-                if cfg.set_as_background(ImgurCallbacks._DEFAULT_IMAGE):
-                    logger.warning("Successfully set default background")
-                else:
-                    logger.critical("Something went terribly wrong...")
-                    dialogs.error_dialog_box(title="Critical Failure" , message="Something went terribly wrong...")
+        token is a cancellation.CancelToken, as for move.
+        """
+        _wait_until_loaded()
 
-    @staticmethod
-    def random_image():
-        """Callback to fetch a random image in the album and set it as the background."""
-                
         index = random.randint(0, len(ImgurCallbacks._image_ids)-1)
         logger.debug("Index is %i", index)
-       
-        # Need arbitrary image type extension to get to the page with just a picture.
-        # We'll assume that the file is a jpg, because it probably is according to 
-        # my interpretation of https://help.imgur.com/hc/en-us/articles/201424906-What-file-types-are-allowed
-        # Alternatively, future development could read the magic bytes of the image and figure out
-        # what image type it was.
-        image_url = ImgurCallbacks.imgur_stub + ImgurCallbacks._image_ids[index] + ".jpg" 
-        result = _download_image(image_url)
-        
-        if result is not None:
-            if cfg.set_as_background(ImgurCallbacks._img_path):
-                logger.debug("Successfully set background")
-                cfg.album_pos = index + 1
-                logger.debug("New index is %i", cfg.album_pos)
-            else:
-                logger.warning("Setting background failed, trying the default image...")
-                # Delete current image file and try the default
-                try:
-                    os.remove(ImgurCallbacks._img_path)
-                except Exception as e:
-                    # Doesn't matter, just don't kill the program
-                    pass 
-
-                if cfg.set_as_background(ImgurCallbacks._DEFAULT_IMAGE):
-                    logger.warning("Successfully set default background")
-                else:
-                    logger.critical("Something went terribly wrong...")
-                    dialogs.error_dialog_box(title="Critical Failure" , message="Something went terribly wrong...")
+        _show_image(index, token)
 
     @staticmethod
     def save_image():
         """Callback to use to save the current image to file.
 
-        More accurately, this will simply copy the file from where it is
-        in the image folder to somewhere the user chooses, since the
-        image was already written to disk to be able to use it as
-        a background.
+        More accurately, this will simply copy the file from the image
+        cache to somewhere the user chooses, since the image was already
+        written to disk to be able to use it as a background. The image is
+        only downloaded again if it has been evicted from the cache.
         """
-        if os.path.isfile(ImgurCallbacks._img_path):
+        _wait_until_loaded()
+        source = None
+        image_id = _current_image_id()
+        if image_id is not None:
+            source = _cached_image(image_id)
+        if source is None and os.path.isfile(ImgurCallbacks._img_path):
+            source = ImgurCallbacks._img_path
+
+        if source is not None:
             filename = dialogs.save_dialog_box(title="Save File As...", initialfile="cool_background.jpg", defaultextension=".jpg")
             if filename:
                 logger.info("Saving file to %s", filename)
                 try:
-                    shutil.copyfile(ImgurCallbacks._img_path, filename)
+                    shutil.copyfile(source, filename)
                 except Exception as e:
                     logger.error("The copy operation failed")
                     dialogs.error_dialog_box(title="Copy Failed" , message="The copy operation failed!")
@@ -258,9 +634,11 @@ class ImgurCallbacks:
     @staticmethod
     def change_url():
         """Callback to use to change the URL of the Imgur album to pull images from."""
+        # Don't let the initial album load finish after (and overwrite) the new album
+        _wait_until_loaded()
         new_url = ""
         first_time = True # used to emulate a do-while loop
-        while (first_time or (new_url is not None and not cfg.verify_url(new_url))):
+        while (first_time or (new_url is not None and cfg.album_id_of(new_url) is None)):
 
             if not first_time:
                 # If we hit this, then the URL was not valid so the user should be prompted.
@@ -275,16 +653,23 @@ class ImgurCallbacks:
             # User cancelled out of the dialog box
             return
 
+        # Apply the change in order with the events that move through the album, so that
+        # none of them sees the new URL with the old album's image list (or vice versa)
+        worker.run_ordered(ImgurCallbacks._apply_url, new_url)
+
+    @staticmethod
+    def _apply_url(new_url):
         logger.info("Changing Imgur album URL to %s", new_url)
-        cfg.imgur_album_url = new_url
-        cfg.album_pos = 0
+        # Only switch cfg.album_id over once the new album has loaded, since the current one stays in use until then
+        loaded = _read_new_album(cfg.album_id_of(new_url))
+        if loaded is None:
+            return
+        # Takes over from a switch the config file asked for that is still loading
+        ImgurCallbacks._requested_url = new_url
+        _switch_album(new_url, loaded, 0)
 
-        # Write out the new config state because cfg.reset rereads the file
+        # Write out the new config state straight away (the events in the queue are kept)
         cfg.write_config_to_file()
-        cfg.reset()
-
-        # Reinitialize the image id's
-        ImgurCallbacks._image_ids = _initialize_images()
 
     @staticmethod
     def quit_program():
@@ -294,4 +679,204 @@ class ImgurCallbacks:
         result = dialogs.confirm_dialog_box(message="Are you sure you want to stop ImgurSwitcher?")
         if result:
             # cfg.write_to_file is automatically called on exit
-            cfg.exit_program()
\ No newline at end of file
+            cfg.exit_program()
+
+    @staticmethod
+    def reload_config():
+        """Callback to use to apply changes made to the config file while the program is running (see config_watcher.py)."""
+        _wait_until_loaded()
+        cfg.reload()
+
+    @staticmethod
+    def dump_metrics():
+        """Callback to use to write the event pipeline metrics (see metrics.py) to the log and to metrics.json."""
+        metrics.dump(get_data(METRICS_FILE_NAME))
+
+class MoveEvent(eq.CoalescingEvent):
+    """Event queue item that moves steps images through the album.
+
+    While it is waiting in the queue, moves queued straight after it are merged into it,
+    so e.g. holding down ALT+D costs one download rather than one per key press. A new
+    move also cancels a move that is running and takes over its steps, so a slow download
+    doesn't hold up the next one.
+    """
+
+    def __init__(self, steps):
+        super().__init__()
+        self.steps = steps
+
+    def merge_into(self, pending):
+        if isinstance(pending, MoveEvent) and not pending.cancelled:
+            pending.steps += self.steps
+            return True
+        return False
+
+    def preempts(self, running):
+        return isinstance(running, MoveEvent)
+
+    def absorb(self, cancelled):
+        self.steps += cancelled.steps
+
+    def run(self, token):
+        ImgurCallbacks.move(self.steps, token)
+
+class RandomEvent(eq.CoalescingEvent):
+    """Event queue item that shows a random image.
+
+    Replaces any random images and moves that are still waiting in the queue (or running), since
+    the background they set would be replaced by this one straight away.
+    """
+
+    def merge_into(self, pending):
+        return isinstance(pending, RandomEvent) and not pending.cancelled
+
+    def supersedes(self, pending):
+        return isinstance(pending, (RandomEvent, MoveEvent))
+
+    def preempts(self, running):
+        return isinstance(running, (RandomEvent, MoveEvent))
+
+    def run(self, token):
+        ImgurCallbacks.random_image(token)
+
+def _fit_size():
+    """Returns the size to fit images to, or None if they shouldn't be (see image_fitting.py)."""
+    if not cfg.fit_to_screen:
+        return None
+    if not image_fitting.available():
+        logger.info("Pillow is not installed, images won't be fitted to the screen")
+        return None
+    screen_size = cfg.screen_size() if cfg.screen_size is not None else None
+    if not screen_size or min(screen_size) <= 0:
+        logger.info("Screen size unknown, images won't be fitted to the screen")
+        return None
+    logger.info("Fitting images to the screen size, %ix%i", screen_size[0], screen_size[1])
+    return tuple(screen_size)
+
+def _load():
+    """Sets up the image cache, the prefetcher and the album's image ID list. Runs in a background thread."""
+    try:
+        ImgurCallbacks._screen_size = _fit_size()
+        ImgurCallbacks._cache = ImageCache(get_data(CACHE_DIR_NAME), cfg.cache_mb * 1024 * 1024)
+        ImgurCallbacks._prefetcher = Prefetcher(_image_url, ImgurCallbacks._cache, cfg.prefetch_ahead, cfg.prefetch_behind,
+                                                  parallel=cfg.worker_threads, process=_fit_image)
+        metrics.add_source("image_cache", ImgurCallbacks._cache.stats)
+        metrics.add_source("cancellation", cancellation.latency_stats)
+        album_id = cfg.album_id
+        ids, source = _initialize_images(lambda ids_so_far: _load_partial(album_id, ids_so_far))
+    except Exception as e:
+        # _initialize_images already told the user what went wrong
+        logger.critical("Loading the album failed, exiting. Reason: %s", e)
+        cfg.exit_program()
+        return
+
+    if album_id != cfg.album_id:
+        # The album was changed while this one was still downloading (possible once _load_partial has let the callbacks go)
+        return
+    ImgurCallbacks._image_ids = ids
+    ImgurCallbacks._source = source
+    _anchor(ids, cfg.current_image)
+    # Start prefetching around wherever we left off last time
+    ImgurCallbacks._prefetcher.recenter(ImgurCallbacks._image_ids, cfg.album_pos)
+    ImgurCallbacks._loaded.set()
+    logger.info("Album loaded, %i images", len(ImgurCallbacks._image_ids))
+    refresh_album(unchecked_only=True)
+
+def _load_partial(album_id, ids_so_far):
+    """Lets the callbacks start on the first part of an album whose page is still downloading.
+
+    Called by _fetch_image_list (during _load) with the IDs found so far. Once they include the
+    current image (or reach the saved album position, if that isn't known), the callbacks are let
+    go with those IDs, which are then topped up as more come in, until _load has the whole list.
+    Until then, going back from the first image and picking a random one only take in the images
+    seen so far.
+    """
+    if album_id != cfg.album_id:
+        return
+    if not ImgurCallbacks._loaded.is_set():
+        if cfg.current_image and cfg.current_image not in ids_so_far:
+            return
+        if not cfg.current_image and len(ids_so_far) <= cfg.album_pos:
+            return
+    elif len(ids_so_far) < 2 * len(ImgurCallbacks._image_ids):
+        # Packing the IDs takes time in proportion to how many there are, so only top up each time they've doubled
+        return
+    ImgurCallbacks._image_ids = AlbumIndex(ids_so_far)
+    if not ImgurCallbacks._loaded.is_set():
+        logger.info("First %i images of the album are in, starting before the rest", len(ids_so_far))
+        _anchor(ImgurCallbacks._image_ids, cfg.current_image)
+        ImgurCallbacks._prefetcher.recenter(ImgurCallbacks._image_ids, cfg.album_pos)
+        ImgurCallbacks._loaded.set()
+
+def load_images():
+    """Starts loading the album (and the image cache) in the background.
+
+    Returns immediately, so that the keyboard hook can be installed without waiting on
+    the network. Key presses made before the album has loaded stay in the event queue
+    until it has.
+    """
+    threading.Thread(target=_load, name="AlbumLoader", daemon=True).start()
+
+def _wait_until_loaded():
+    """Blocks until load_images has finished."""
+    if not ImgurCallbacks._loaded.is_set():
+        logger.info("Album not loaded yet, waiting for it...")
+        ImgurCallbacks._loaded.wait()
+
+def _on_config_reload(changed):
+    """Applies the config file changes that concern the callbacks. Called by config.reload, in order with the events."""
+    if "prefetch_ahead" in changed or "prefetch_behind" in changed:
+        ImgurCallbacks._prefetcher.ahead = cfg.prefetch_ahead
+        ImgurCallbacks._prefetcher.behind = cfg.prefetch_behind
+        ImgurCallbacks._prefetcher.recenter(ImgurCallbacks._image_ids, cfg.album_pos)
+    if "cache_mb" in changed:
+        ImgurCallbacks._cache.resize(cfg.cache_mb * 1024 * 1024)
+    if "fit_to_screen" in changed:
+        ImgurCallbacks._screen_size = _fit_size()
+    if "url" in changed:
+        # Keep going through the current album until the new one's index is loaded (config.reload leaves the URL to us)
+        ImgurCallbacks._requested_url = changed["url"]
+        worker.background_executor().submit(_load_changed_album, changed["url"], changed.get("position", 0))
+
+def _load_changed_album(url, position):
+    """Loads the index of the album the config file was changed to (url) and switches to it. Runs in a background thread."""
+    loaded = _read_new_album(cfg.album_id_of(url))
+    if loaded is None:
+        worker.run_ordered(_keep_album, url, wait=False)
+        return
+    worker.run_ordered(_switch_album, url, loaded, position, wait=False)
+
+def _keep_album(url):
+    """Puts the URL of the album in use back in the config file, after switching to url failed."""
+    if url != ImgurCallbacks._requested_url:
+        # The album was changed again while this one was loading
+        return
+    ImgurCallbacks._requested_url = None
+    cfg.write_config_to_file()
+
+def _switch_album(url, loaded, position):
+    """Puts the album at url in use, at position. loaded is what _read_new_album returned for it."""
+    if url != ImgurCallbacks._requested_url:
+        # The album was changed again while this one was loading
+        return
+    ids, source = loaded
+    ImgurCallbacks._requested_url = None
+    cfg.verify_url(url) # sets cfg.album_id
+    cfg.imgur_album_url = url
+    logger.info("Switching to album %s (%i images) at position %i", cfg.album_id, len(ids), position)
+    ImgurCallbacks._image_ids = ids
+    ImgurCallbacks._source = source
+    cfg.set_album_pos(position)
+    ImgurCallbacks._prefetcher.recenter(ids, position)
+    refresh_album(unchecked_only=True)
+
+cfg.add_reload_listener(_on_config_reload)
+
+def _save_cache():
+    """Saves the image cache's LRU order so that it survives a restart. Called on exit."""
+    if ImgurCallbacks._cache is None:
+        return
+    logger.info("Image cache stats: %s", ImgurCallbacks._cache.stats())
+    ImgurCallbacks._cache.save_index()
+
+atexit.register(_save_cache)
\ No newline at end of file
@@ -0,0 +1,132 @@
+# Copyright Patrick Perrier, 2015
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Module that collects the timing histograms and counters of the event pipeline.
+
+The event queue, the callbacks, the prefetcher and the HTTP clients report into here,
+so that a slow background change can be pinned on queueing, downloading or setting
+the background. Names are dotted, e.g. "queue.wait_ms":
+
+    queue.*        put/merged/superseded/preempted/requeued/blocked_drops/full_rejections counters,
+                   depth gauge, depth_on_put and wait_ms (enqueue to dequeue) histograms
+    event.*        run_ms.<callback> (dequeue to done), total_ms.<callback> (enqueue to done)
+    worker.*       busy_ms.<executor> counters (time the worker threads spent running something)
+    album.*        index_loads/index_downloads/refreshes/refresh_failures/refresh_changes/pages counters,
+                   diff_added/diff_removed/diff_moved counters (images changed by refreshes),
+                   first_ids_ms (request to the first image IDs of a downloaded album page) and
+                   diff_ms (working out what a refresh changed, see album_diff.py) histograms
+    download.*     ms and bytes of the downloads callbacks had to wait for
+    prefetch.*     ms and bytes of the prefetcher's downloads
+    http.*         first_byte_ms/total_ms histograms, requests/reused/bytes counters
+    background.*   set_ms (how long set_as_background took)
+    fit.*          ms (how long fitting an image to the screen took, see image_fitting.py)
+    progressive.*  swaps/skipped counters (full images swapped in for their previews, or not)
+
+Histograms keep the most recent HISTOGRAM_WINDOW values (so percentiles follow what is
+happening now) plus an all-time count and sum. snapshot returns everything as a dict; dump
+writes it to the log or to a file, and metrics_endpoint serves it to Prometheus.
+"""
+
+import time
+import json
+import logging
+import threading
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+# How many of the most recent values each histogram keeps for its percentiles
+HISTOGRAM_WINDOW = 1000
+
+_lock = threading.Lock()
+_histograms = {} # name -> (deque of recent values, [count, sum])
+_counters = {} # name -> number
+_gauges = {} # name -> number
+_sources = {} # name -> callable returning a dict, see add_source
+_started = time.time()
+
+def observe(name, value):
+    """Adds value to the histogram called name."""
+    with _lock:
+        histogram = _histograms.get(name)
+        if histogram is None:
+            histogram = _histograms[name] = (deque(maxlen=HISTOGRAM_WINDOW), [0, 0.0])
+        histogram[0].append(value)
+        histogram[1][0] += 1
+        histogram[1][1] += value
+
+def observe_since(name, started):
+    """Adds the milliseconds since started (a time.perf_counter value) to the histogram called name."""
+    observe(name, (time.perf_counter() - started) * 1000)
+
+def increment(name, amount=1):
+    """Adds amount to the counter called name."""
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + amount
+
+def set_gauge(name, value):
+    """Sets the gauge called name to value."""
+    with _lock:
+        _gauges[name] = value
+
+def add_source(name, source):
+    """Includes source() (a dict, e.g. ImageCache.stats) in every snapshot, under name."""
+    with _lock:
+        _sources[name] = source
+
+def _summarize(values, totals):
+    ordered = sorted(values)
+    summary = {"count": totals[0], "sum": totals[1], "mean": totals[1] / totals[0] if totals[0] else None}
+    if ordered:
+        rank = lambda p: ordered[min(len(ordered) - 1, max(0, int(round(p / 100.0 * len(ordered))) - 1))]
+        summary.update({"window": len(ordered), "p50": rank(50), "p95": rank(95), "p99": rank(99), "max": ordered[-1]})
+    return summary
+
+def snapshot():
+    """Returns the current values of all the histograms, counters, gauges and sources as a dict."""
+    with _lock:
+        histograms = dict((name, (list(values), list(totals))) for name, (values, totals) in _histograms.items())
+        result = {"uptime_s": time.time() - _started, "counters": dict(_counters), "gauges": dict(_gauges)}
+        sources = dict(_sources)
+
+    result["histograms"] = dict((name, _summarize(values, totals)) for name, (values, totals) in sorted(histograms.items()))
+    for name, source in sources.items():
+        try:
+            result[name] = source()
+        except Exception as e:
+            logger.warning("Metrics source %s failed. Reason: %s", name, e)
+    return result
+
+def dump(path=None):
+    """Writes a snapshot to the log, and also to the file at path (as JSON) if path is given."""
+    current = snapshot()
+    logger.info("Metrics: %s", json.dumps(current, sort_keys=True))
+    if path is not None:
+        try:
+            with open(path, 'w') as dump_file:
+                json.dump(current, dump_file, indent=2, sort_keys=True)
+            logger.info("Metrics written to %s", path)
+        except Exception as e:
+            logger.error("Writing metrics to %s failed! Reason: %s", path, e)
+    return current
+
+def reset():
+    """Forgets everything recorded so far (the sources stay registered)."""
+    global _started
+    with _lock:
+        _histograms.clear()
+        _counters.clear()
+        _gauges.clear()
+        _started = time.time()
@@ -0,0 +1,165 @@
+# Copyright Patrick Perrier, 2015
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Module that serves the metrics (see metrics.py) over HTTP in the Prometheus text format.
+
+Off unless metrics_port is set in the config file (changing it while the program runs
+starts, moves or stops the endpoint). It only listens on 127.0.0.1, so a
+Prometheus (or anything else) on the same machine can scrape http://127.0.0.1:<port>/metrics.
+
+Metric names are the dotted metrics.py names with dots turned into underscores and an
+imgurswitcher_ prefix, e.g. queue.wait_ms is imgurswitcher_queue_wait_ms. Counters get a
+_total suffix, histograms are exposed as summaries (p50/p95/p99 of the recent window, plus
+the all-time _sum and _count), and the numbers from the sources (image_cache hits/misses etc.)
+as untyped samples. Per-callback and per-worker names become labels, e.g.
+imgurswitcher_event_run_ms{callback="MoveEvent",quantile="0.95"}.
+"""
+
+import re
+import logging
+import threading
+import socketserver
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from . import metrics
+from . import config as cfg
+
+logger = logging.getLogger(__name__)
+
+PREFIX = "imgurswitcher_"
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# metrics.py name prefix -> label the rest of the name goes in
+_LABELLED = {"event.run_ms.": "callback", "event.total_ms.": "callback", "worker.busy_ms.": "worker"}
+
+_QUANTILES = (("0.5", "p50"), ("0.95", "p95"), ("0.99", "p99"))
+
+_server = None
+
+def _split(name):
+    """Returns (Prometheus metric name, dict of labels) for a metrics.py name."""
+    labels = {}
+    for prefix, label in _LABELLED.items():
+        if name.startswith(prefix):
+            labels[label] = name[len(prefix):]
+            name = prefix[:-1]
+            break
+    return PREFIX + re.sub("[^a-zA-Z0-9_]", "_", name), labels
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    escape = lambda value: str(value).replace("\\", r"\\").replace('"', r'\"').replace("\n", r"\n")
+    return "{" + ",".join('%s="%s"' % (label, escape(value)) for label, value in sorted(labels.items())) + "}"
+
+def _is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+def render(snapshot=None):
+    """Returns snapshot (by default metrics.snapshot()) in the Prometheus text format."""
+    if snapshot is None:
+        snapshot = metrics.snapshot()
+
+    families = {} # Prometheus name -> (type, list of (suffix, labels, value))
+    def add(name, kind, suffix, labels, value):
+        families.setdefault(name, (kind, []))[1].append((suffix, labels, value))
+
+    add(PREFIX + "uptime_seconds", "gauge", "", {}, snapshot["uptime_s"])
+    for name, value in snapshot["counters"].items():
+        family, labels = _split(name)
+        add(family + "_total", "counter", "", labels, value)
+    for name, value in snapshot["gauges"].items():
+        family, labels = _split(name)
+        add(family, "gauge", "", labels, value)
+    for name, summary in snapshot["histograms"].items():
+        family, labels = _split(name)
+        for quantile, key in _QUANTILES:
+            if key in summary:
+                add(family, "summary", "", dict(labels, quantile=quantile), summary[key])
+        add(family, "summary", "_sum", labels, summary["sum"])
+        add(family, "summary", "_count", labels, summary["count"])
+    # Everything else in the snapshot comes from a metrics source (a dict of stats)
+    for source, stats in snapshot.items():
+        if isinstance(stats, dict) and source not in ("counters", "gauges", "histograms"):
+            for key, value in stats.items():
+                if _is_number(value):
+                    add(_split(source + "." + key)[0], "untyped", "", {}, value)
+
+    lines = []
+    for name, (kind, samples) in sorted(families.items()):
+        lines.append("# TYPE %s %s" % (name, kind))
+        for suffix, labels, value in samples:
+            lines.append("%s%s%s %s" % (name, suffix, _format_labels(labels), repr(float(value))))
+    return "\n".join(lines) + "\n"
+
+class _Server(socketserver.ThreadingMixIn, HTTPServer):
+    """HTTPServer that answers each scrape on its own daemon thread (http.server.ThreadingHTTPServer is 3.7+)."""
+    daemon_threads = True
+
+class _Handler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path.split("?")[0] not in ("/", "/metrics"):
+            self.send_error(404)
+            return
+        try:
+            body = render().encode("utf-8")
+        except Exception as e:
+            logger.error("Rendering the metrics failed! Reason: %s", e)
+            self.send_error(500)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # Scrapes come every few seconds; keep them out of the log unless debugging
+        logger.debug("Metrics endpoint: " + format, *args)
+
+def start(port, host="127.0.0.1"):
+    """Starts serving the metrics on host:port in a daemon thread. Does nothing if it is already running.
+
+    Returns True if the endpoint is running. Errors (e.g. the port is taken) are logged, not raised,
+    since the metrics aren't worth stopping the program for.
+    """
+    global _server
+    if _server is not None:
+        return True
+    try:
+        _server = _Server((host, port), _Handler)
+    except OSError as e:
+        logger.error("Starting the metrics endpoint on %s:%i failed! Reason: %s", host, port, e)
+        return False
+    threading.Thread(target=_server.serve_forever, name="MetricsEndpoint", daemon=True).start()
+    logger.info("Serving metrics on http://%s:%i/metrics", host, _server.server_address[1])
+    return True
+
+def stop():
+    """Stops the endpoint if it is running."""
+    global _server
+    if _server is not None:
+        _server.shutdown()
+        _server.server_close()
+        _server = None
+
+def on_config_reload(changed):
+    """Moves the endpoint to the new metrics_port (or stops it, for 0). Registered with config.add_reload_listener."""
+    if "metrics_port" in changed:
+        stop()
+        if cfg.metrics_port:
+            start(cfg.metrics_port)
+        else:
+            logger.info("Metrics endpoint stopped")
@@ -0,0 +1,234 @@
+# Copyright Patrick Perrier, 2015
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Module that keeps the images around the current album position downloaded ahead of time.
+
+The callbacks tell the prefetcher where in the album we are (recenter) and the prefetcher
+downloads the next/previous few images into the image cache on the background executor (a few at
+a time, see worker.background_executor). When the
+user then asks for one of those images, it is already on disk and setting the background is just
+a local file copy. A download that falls out of the window while it is running is abandoned.
+"""
+
+import os
+import time
+import logging
+import threading
+from . import exceptions as xcpt
+from .http_client import get_client
+from .cancellation import CancelToken
+from . import worker
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+def window_indices(album_pos, album_size, ahead, behind):
+    """Returns the album indices (0-indexed) the prefetcher should hold, most important first.
+
+    album_pos: the current (1-indexed) album position, as in config.album_pos.
+    album_size: the number of images in the album.
+    ahead: how many images after the current one to hold.
+    behind: how many images before the current one to hold.
+
+    The order alternates between the next and previous images (next 1, previous 1, next 2...)
+    so that a single step in either direction is always fetched first. The index math
+    matches ImgurCallbacks.next_image and ImgurCallbacks.prev_image.
+    """
+    if album_size <= 0:
+        return []
+
+    next_indices = [(album_pos + k) % album_size for k in range(ahead)]
+    # prev_image uses index -1 when there's no current image
+    prev_start = -1 if album_pos == 0 else album_pos - 2
+    prev_indices = [(prev_start - k) % album_size for k in range(behind)]
+
+    ordered = []
+    for k in range(max(ahead, behind)):
+        for indices in (next_indices, prev_indices):
+            if k < len(indices) and indices[k] not in ordered:
+                ordered.append(indices[k])
+    return ordered
+
+class Prefetcher:
+    """Downloads the images around the current album position in the background.
+
+    url_for: callable that takes an image ID and returns the URL to download it from.
+    cache: the ImageCache to download the images into.
+    ahead: how many images after the current position to keep downloaded.
+    behind: how many images before the current position to keep downloaded.
+    parallel: how many images to download at once.
+    executor: what to run the downloads on (anything with a submit method). Defaults to
+    worker.background_executor(). If it runs coroutines (like AsyncWorker's), the downloads
+    are done with async_http_client on its event loop.
+    process: if given, called with the image ID after each successful download, on a
+    background thread (once the download no longer counts as in flight).
+    """
+
+    def __init__(self, url_for, cache, ahead=2, behind=1, parallel=1, executor=None, process=None):
+        self._url_for = url_for
+        self._cache = cache
+        self._process = process
+        self.ahead = ahead
+        self.behind = behind
+        self.parallel = max(1, parallel)
+        self._executor = executor
+
+        self._cond = threading.Condition()
+        self._wanted = [] # image IDs in the window, most important first
+        self._in_flight = {} # image ID -> the CancelToken of its running download
+        self._attempted = set() # image IDs already fetched (or tried) since the last recenter
+
+    def recenter(self, image_ids, album_pos):
+        """Moves the prefetch window so that it is centered on album_pos.
+
+        image_ids: the album's image ID list.
+        album_pos: the current (1-indexed) album position.
+
+        An in-flight download that is no longer wanted is abandoned. Images
+        that are no longer in the window stay in the cache.
+        """
+        indices = window_indices(album_pos, len(image_ids), self.ahead, self.behind)
+        wanted = [image_ids[i] for i in indices]
+
+        with self._cond:
+            self._wanted = wanted
+            self._attempted = set()
+            for image_id, token in self._in_flight.items():
+                if image_id not in wanted:
+                    token.cancel()
+            logger.debug("Prefetch window recentered on position %i: %s", album_pos, wanted)
+            self._schedule()
+            self._cond.notify_all()
+
+    def wait_for(self, image_id, token=None):
+        """Waits for the download of image_id to finish if the prefetcher is downloading it right now.
+
+        Call this before looking in the cache so that the caller doesn't download
+        an image a second time when it is about to arrive anyway.
+
+        token: a cancellation.CancelToken; the wait stops early if it is cancelled.
+        """
+        if token is not None:
+            token.on_cancel(self._wake)
+        try:
+            with self._cond:
+                while image_id in self._in_flight and image_id in self._wanted and not (token is not None and token.cancelled):
+                    self._cond.wait()
+        finally:
+            if token is not None:
+                token.remove_callback(self._wake)
+
+    def _wake(self):
+        with self._cond:
+            self._cond.notify_all()
+
+    def _schedule(self):
+        """Submits downloads for the images in the window that still need one, up to parallel at a time.
+
+        Must be called with _cond held.
+        """
+        if self._executor is None:
+            self._executor = worker.background_executor()
+
+        for image_id in self._wanted:
+            if len(self._in_flight) >= self.parallel:
+                break
+            # Only try each image once per recenter, so that a failing download or
+            # a cache too small to hold the whole window can't make this spin
+            if image_id in self._attempted or image_id in self._in_flight or self._cache.contains(image_id):
+                continue
+            self._attempted.add(image_id)
+            token = CancelToken()
+            self._in_flight[image_id] = token
+            if getattr(self._executor, "runs_coroutines", False):
+                self._executor.submit(self._run_job_async, image_id, token)
+            else:
+                self._executor.submit(self._run_job, image_id, token)
+
+    def _run_job(self, image_id, token):
+        try:
+            self._download(self._url_for(image_id), image_id, token)
+        except Exception as e:
+            self._log_failure(image_id, e)
+            return
+        finally:
+            self._job_done(image_id)
+        if self._process is not None:
+            self._process(image_id)
+
+    @worker.coroutine
+    def _run_job_async(self, image_id, token):
+        try:
+            yield from self._download_async(self._url_for(image_id), image_id, token)
+        except Exception as e:
+            self._log_failure(image_id, e)
+            return
+        finally:
+            self._job_done(image_id)
+        if self._process is not None:
+            import asyncio
+            # Keep it off the event loop, it's CPU work
+            yield from asyncio.get_event_loop().run_in_executor(None, self._process, image_id)
+
+    @staticmethod
+    def _log_failure(image_id, e):
+        if isinstance(e, xcpt.DownloadCancelled):
+            logger.debug("Prefetch of image %s abandoned, it left the window", image_id)
+        else:
+            # Prefetching is best-effort; the callback will download it
+            # itself (and report any error) if the user asks for it.
+            logger.warning("Prefetch of image %s failed! Reason: %s", image_id, e)
+
+    def _job_done(self, image_id):
+        with self._cond:
+            del self._in_flight[image_id]
+            self._schedule()
+            self._cond.notify_all()
+
+    def _download(self, url, image_id, token):
+        """Streams url into the cache as image_id. recenter cancels token if image_id leaves the window."""
+        part_path = self._cache.temp_path(image_id)
+        started = time.perf_counter()
+        try:
+            size = get_client().download(url, part_path, token)
+            self._cache.add(image_id, part_path)
+            metrics.observe_since("prefetch.ms", started)
+            metrics.observe("prefetch.bytes", size)
+        except BaseException:
+            self._remove(part_path)
+            raise
+
+    @worker.coroutine
+    def _download_async(self, url, image_id, token):
+        """Same as _download, on the event loop."""
+        from . import async_http_client
+        part_path = self._cache.temp_path(image_id)
+        started = time.perf_counter()
+        try:
+            size = yield from async_http_client.get_client().download(url, part_path, token)
+            self._cache.add(image_id, part_path)
+            metrics.observe_since("prefetch.ms", started)
+            metrics.observe("prefetch.bytes", size)
+        except BaseException:
+            self._remove(part_path)
+            raise
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except OSError:
+            # Doesn't matter, just don't kill the program
+            pass
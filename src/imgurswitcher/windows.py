@@ -28,8 +28,7 @@ import pyHook as hook
 import pythoncom as com
 import win32api
 import win32con
-from . import event_queue as eq
-from . import imgur_callbacks as callbacks
+from . import hotkeys
 
 logger.debug("Successful import of all modules in Windows-specific module")
 
@@ -43,6 +42,16 @@ def set_as_background(url):
     return ctypes.windll.user32.SystemParametersInfoW(SPI_SETDESKWALLPAPER, 0, url, 3)
 
 
+def screen_size():
+    """Returns the (width, height) of the primary screen in physical pixels (i.e. not scaled for DPI)."""
+    DESKTOPVERTRES = 117
+    DESKTOPHORZRES = 118
+    hdc = ctypes.windll.user32.GetDC(0)
+    try:
+        return (ctypes.windll.gdi32.GetDeviceCaps(hdc, DESKTOPHORZRES), ctypes.windll.gdi32.GetDeviceCaps(hdc, DESKTOPVERTRES))
+    finally:
+        ctypes.windll.user32.ReleaseDC(0, hdc)
+
 def exit_program():
     logger.info("Exiting program (Windows)...")
     win32api.PostThreadMessage(_main_thread_id, win32con.WM_QUIT, 0, 0)
@@ -50,38 +59,15 @@ def exit_program():
 def on_keyboard_event(event):
     """ Callback that is called whenever a key on the keyboard is hit.
 
-    Only certain key combinations actually matter to this program, and they are listed below:
+    Only ALT plus one of the keys bound in hotkeys matters to this program (by default
+    ALT+D next, ALT+A previous, ALT+R random, ALT+S save, ALT+U change URL, ALT+Q quit;
+    see hotkeys.py). Those key presses are swallowed; everything else is let through.
 
-    ALT+D: Get the next image in the album and set it as the background picture.
-    ALT+A: Get the previous image in the album and set it as the background picture.
-    ALT+R: Get a random image in the album and set it as the background picture.
-    ALT+S: Save the current image to the user's computer (i.e. copy it so it's not deleted when the image changes)
-    ALT+U: Change the Imgur album that pictures are pulled from (by changing the URL in the config file).
-    ALT+Q: Quit this program.
+    This runs for every key press on the system, so it is kept to an attribute test and
+    (with ALT held) a lookup in the prebuilt dispatch table.
     """
-
-    callback_dict = {
-        # Format: 
-        # Key: eq.TupleSortingOn0((priority in event queue, callback to call, block event queue until processed?))
-        "D": eq.TupleSortingOn0((eq.LOW_PRIORITY, callbacks.ImgurCallbacks.next_image, False)),
-        "A": eq.TupleSortingOn0((eq.LOW_PRIORITY, callbacks.ImgurCallbacks.prev_image, False)),
-        "R": eq.TupleSortingOn0((eq.LOW_PRIORITY, callbacks.ImgurCallbacks.random_image, False)),
-        "S": eq.TupleSortingOn0((eq.HIGH_PRIORITY, callbacks.ImgurCallbacks.save_image, True)),
-        "U": eq.TupleSortingOn0((eq.HIGH_PRIORITY, callbacks.ImgurCallbacks.change_url, True)),
-        "Q": eq.TupleSortingOn0((eq.HIGH_PRIORITY, callbacks.ImgurCallbacks.quit_program, True))
-    }
-
-    if(event.IsAlt()):
-        keyPressed = event.GetKey()
-        block = True # True lets the event through
-        if keyPressed in callback_dict:
-            eq.put(callback_dict[keyPressed])
-            logger.debug("Loaded callback: " + callback_dict[keyPressed][1].__name__ + " into event queue")
-            block = False
-            
-        return block
-
-    return True
+    # event.Alt is the ALT flag that IsAlt tests, and KeyID is the virtual key code the table is keyed on
+    return not (event.Alt and hotkeys.on_key_down(event.KeyID))
 
 def main():
     """Windows-specific main function.
@@ -90,6 +76,7 @@ def main():
     """
 
     logger.info("Starting Windows main...")
+    hotkeys.load()
     hookManager = hook.HookManager()
     hookManager.KeyDown = on_keyboard_event
     hookManager.HookKeyboard()
@@ -13,18 +13,335 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
-"""Module contains the worker class for ImgurSwitcher."""
+"""Module contains the worker classes for ImgurSwitcher.
+
+Worker is the original runtime: one thread that runs every queued callback, one after
+another. PoolWorker runs them on an executor-based engine instead:
+
+* an ordered lane (one thread) for the events that change the background, so that
+  the backgrounds get set and album_pos/config changes happen in the order they were asked for;
+* a dialog lane (one thread) for events that wait on the user (the ones that block the
+  queue: save, change URL, quit), so an open dialog doesn't hold up anything else;
+* a pool of worker_threads threads for background work (prefetch downloads and album
+  index refreshes), which runs in parallel with both lanes.
+
+Each lane takes its next event out of the event queue only once it is done with the one before,
+so events wait in the queue, where they are merged, bounded (max_queue_size) and counted.
+
+AsyncWorker has the same two lanes, but takes events off the queue from an asyncio event
+loop (the queue tells the loop about each put) and runs the background work on that loop:
+album page requests and image downloads all go through async_http_client, so a single thread
+handles any number of them at once.
+
+Code that needs a background thread or the ordered lane uses background_executor and
+run_ordered, which work with any of the runtimes (with Worker, run_ordered uses a lane of
+its own that takes turns with the Worker thread, see _ordered_lock). Which runtime run_imgur_switcher.py uses
+is set by config.runtime (see RUNTIMES).
+"""
 
 from threading import Thread
+import time
+import types
+import queue
+import threading
 import logging
+from concurrent.futures import Future
 from . import config as cfg
 from . import event_queue as eq
+from . import metrics
 
 logger = logging.getLogger(__name__)
 
+def _asyncio_coroutine(function):
+    # Python 3.4 only; asyncio is imported here rather than at the top, since only the async runtime needs it
+    # and importing it costs tens of milliseconds before the keyboard hook goes in
+    import asyncio
+    return asyncio.coroutine(function)
+
+# The coroutines run on AsyncWorker's loop are generator-based (yield from), so that they work on
+# Python 3.4, where asyncio.coroutine marks them. That is gone in 3.11; types.coroutine (3.5 on) does the same job.
+# asyncio and async_http_client are only imported by the code that runs with the async runtime.
+coroutine = getattr(types, "coroutine", None) or _asyncio_coroutine
+
+_engine = None # the running PoolWorker, if there is one
+_fallback_executor = None # used for background work when no PoolWorker is running
+_fallback_lane = None # runs run_ordered's functions when no PoolWorker is running
+_fallback_lock = threading.Lock()
+# Held by Worker while it runs a callback and by _fallback_lane while it runs a function, so
+# that they take turns (a lock rather than a queue, since the event queue can drop or reset items)
+_ordered_lock = threading.RLock()
+
 class Worker(Thread):
     """Class that does the invoking of the queued callbacks to avoid blocking the main thread."""
 
     def run(self):
         while True:
-            eq.get_and_exec()
\ No newline at end of file
+            triple, token = eq.take()
+            started = time.perf_counter()
+            try:
+                with _ordered_lock:
+                    eq.execute(triple, token)
+            finally:
+                metrics.increment("worker.busy_ms.Worker", (time.perf_counter() - started) * 1000)
+
+class _DaemonExecutor:
+    """Minimal executor (submit returns a concurrent.futures.Future) that runs on daemon threads.
+
+    Used instead of concurrent.futures.ThreadPoolExecutor, whose threads are waited for at exit,
+    so that a stuck download or an open dialog can't keep the program from exiting (just like
+    with Worker, which is a daemon thread).
+    """
+
+    def __init__(self, threads, name):
+        self.name = name
+        self._jobs = queue.Queue()
+        self.threads = [Thread(target=self._run, name="%s-%i" % (name, i), daemon=True) for i in range(threads)]
+        for thread in self.threads:
+            thread.start()
+
+    def submit(self, function, *args):
+        future = Future()
+        self._jobs.put((future, function, args))
+        return future
+
+    def _run(self):
+        while True:
+            future, function, args = self._jobs.get()
+            if not future.set_running_or_notify_cancel():
+                continue
+            started = time.perf_counter()
+            try:
+                future.set_result(function(*args))
+            except BaseException as e:
+                future.set_exception(e)
+            # Busy time of all the executor's threads together, e.g. worker.busy_ms.Background
+            metrics.increment("worker.busy_ms." + self.name, (time.perf_counter() - started) * 1000)
+
+class PoolWorker(Thread):
+    """Thread that hands queued callbacks out to the engine's lanes (see the module docstring).
+
+    pool_size: the number of threads for background work. Defaults to config.worker_threads.
+
+    Start it the same way as Worker.
+    """
+
+    def __init__(self, pool_size=None):
+        super().__init__(name="PoolWorker")
+        self.pool_size = pool_size if pool_size is not None else cfg.worker_threads
+        self._ordered = None
+        self._dialogs = None
+        self.pool = None
+        self._busy = set() # the lanes running an event
+        self._busy_lock = threading.Lock()
+        self._wakeup = threading.Event() # set when there may be an event to take for a lane that is free
+
+    def start(self):
+        global _engine
+        self._ordered = _DaemonExecutor(1, "OrderedLane")
+        self._dialogs = _DaemonExecutor(1, "DialogLane")
+        self.pool = self._make_pool()
+        _engine = self
+        eq.separate_blocking_lane = True
+        super().start()
+
+    def _make_pool(self):
+        logger.info("Starting pool worker with %i background threads", self.pool_size)
+        return _DaemonExecutor(self.pool_size, "Background")
+
+    def run(self):
+        eq.add_put_listener(self._wake)
+        self._wakeup.set() # there may be events from before it started
+        while True:
+            self._wakeup.wait()
+            # Clear before dispatching so that a put during it isn't missed
+            self._wakeup.clear()
+            self._dispatch()
+
+    def _wake(self):
+        # Called on the putting thread (usually the platform hook), and when a lane is done
+        self._wakeup.set()
+
+    def _dispatch(self):
+        """Takes the next event for each lane that is free and starts it there."""
+        # Events that block the queue are the ones that show dialogs and wait on the user
+        for lane, blocking in ((self._ordered, False), (self._dialogs, True)):
+            with self._busy_lock:
+                if lane in self._busy:
+                    continue
+            try:
+                triple, token = eq.take(block=False, blocking=blocking)
+            except queue.Empty:
+                continue
+            with self._busy_lock:
+                self._busy.add(lane)
+            lane.submit(self._execute, triple, token).add_done_callback(lambda done, lane=lane: self._lane_done(lane))
+
+    def _lane_done(self, lane):
+        with self._busy_lock:
+            self._busy.discard(lane)
+        self._wake()
+
+    @staticmethod
+    def _execute(triple, token):
+        try:
+            eq.execute(triple, token)
+        except Exception:
+            logger.exception("Callback %s failed", triple[1].__name__)
+
+    def run_ordered(self, function, *args, wait=True):
+        """Runs function(*args) on the ordered lane. See the module's run_ordered."""
+        return _run_on_lane(self._ordered, function, args, wait)
+
+class _LoopExecutor:
+    """Executor (submit returns a concurrent.futures.Future) that runs work on an AsyncWorker's event loop.
+
+    Coroutine functions (see coroutine) are run on the loop itself. Plain functions run in the loop's
+    default thread pool, so they can block without holding up the loop.
+    """
+
+    runs_coroutines = True # lets callers submit coroutine functions instead of blocking ones
+
+    def __init__(self, engine):
+        self._engine = engine
+
+    def submit(self, function, *args):
+        import asyncio
+        import inspect
+        loop = self._engine.wait_for_loop()
+        future = Future()
+        if inspect.isgeneratorfunction(function) or asyncio.iscoroutinefunction(function):
+            loop.call_soon_threadsafe(self._start, loop, future, function(*args))
+        else:
+            loop.call_soon_threadsafe(self._start, loop, future, self._in_thread(loop, function, args))
+        return future
+
+    @staticmethod
+    @coroutine
+    def _in_thread(loop, function, args):
+        return (yield from loop.run_in_executor(None, function, *args))
+
+    @staticmethod
+    def _start(loop, future, coro):
+        """Runs coro as a task on loop, and passes its outcome on to future (what asyncio.run_coroutine_threadsafe does, from 3.5 on)."""
+        if not future.set_running_or_notify_cancel():
+            coro.close()
+            return
+        task = loop.create_task(coro)
+
+        def done(task):
+            if task.cancelled():
+                import asyncio
+                future.set_exception(asyncio.CancelledError())
+            elif task.exception() is not None:
+                future.set_exception(task.exception())
+            else:
+                future.set_result(task.result())
+        task.add_done_callback(done)
+
+class AsyncWorker(PoolWorker):
+    """Thread that runs an asyncio event loop for the queue and all the network work (see the module docstring).
+
+    The platform hook's puts are handed to the loop with call_soon_threadsafe. Events are
+    run on the same ordered and dialog lanes as with PoolWorker, since setting the background
+    and showing dialogs block; the downloads they start run on the loop. pool_size is unused.
+
+    Start it the same way as Worker.
+    """
+
+    def __init__(self, pool_size=None):
+        super().__init__(pool_size)
+        self.name = "AsyncWorker"
+        self.loop = None
+        self._loop_ready = threading.Event()
+        self._wakeup = None # an asyncio.Event here
+
+    def _make_pool(self):
+        logger.info("Starting asyncio worker")
+        return _LoopExecutor(self)
+
+    def wait_for_loop(self):
+        """Returns the worker's event loop, waiting for it to be started if need be."""
+        self._loop_ready.wait()
+        return self.loop
+
+    def run(self):
+        import asyncio
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        loop.run_until_complete(self._main())
+
+    @coroutine
+    def _main(self):
+        import asyncio
+        self.loop = asyncio.get_event_loop()
+        self._wakeup = asyncio.Event()
+        self._wakeup.set() # there may be events from before the loop was up
+        eq.add_put_listener(self._wake)
+        self._loop_ready.set()
+
+        while True:
+            yield from self._wakeup.wait()
+            # Clear before dispatching so that a put during it isn't missed
+            self._wakeup.clear()
+            self._dispatch()
+
+    def _wake(self):
+        # Called on the putting thread (usually the platform hook), and when a lane is done
+        self.loop.call_soon_threadsafe(self._wakeup.set)
+
+# The runtimes config.runtime can pick from
+RUNTIMES = {"thread": Worker, "pool": PoolWorker, "async": AsyncWorker}
+
+def create_worker():
+    """Returns a new (not yet started) worker for the runtime set in config.runtime."""
+    return RUNTIMES[cfg.runtime]()
+
+def background_executor():
+    """Returns the executor to run background work (downloads, index refreshes) on.
+
+    This is the PoolWorker's pool if one is running, otherwise a small shared executor.
+    """
+    global _fallback_executor
+    if _engine is not None:
+        return _engine.pool
+    with _fallback_lock:
+        if _fallback_executor is None:
+            _fallback_executor = _DaemonExecutor(cfg.worker_threads, "Background")
+        return _fallback_executor
+
+def run_ordered(function, *args, wait=True):
+    """Runs function(*args) in order with the events that change the background.
+
+    With a PoolWorker that means on its ordered lane; with Worker, on a lane that takes turns
+    with the Worker thread. If wait is True, waits for function and returns its result (or raises
+    its exception). Background work should pass wait=False: the lane may itself be waiting on
+    background work (e.g. a prefetch) queued behind it. The function's exceptions are logged then.
+    Called from the lane (or the Worker thread), function is just called.
+    """
+    if _engine is not None:
+        return _engine.run_ordered(function, *args, wait=wait)
+    if isinstance(threading.current_thread(), Worker):
+        # Already in order
+        return function(*args)
+    global _fallback_lane
+    with _fallback_lock:
+        if _fallback_lane is None:
+            _fallback_lane = _DaemonExecutor(1, "OrderedLane")
+    return _run_on_lane(_fallback_lane, _in_turn, (function, args), wait)
+
+def _in_turn(function, args):
+    with _ordered_lock:
+        return function(*args)
+
+def _run_on_lane(lane, function, args, wait):
+    """Runs function(*args) on lane (a one-thread _DaemonExecutor), inline if this is the lane's thread."""
+    if threading.current_thread() is lane.threads[0]:
+        return function(*args)
+    future = lane.submit(function, *args)
+    if wait:
+        return future.result()
+    future.add_done_callback(lambda done: _log_failure(function, done))
+
+def _log_failure(function, future):
+    if not future.cancelled() and future.exception() is not None:
+        logger.error("%s failed on the ordered lane. Reason: %s", getattr(function, "__name__", function), future.exception())
\ No newline at end of file
@@ -15,10 +15,14 @@
 
 """Runs ImgurSwitcher."""
 
-from imgurswitcher import main, Worker
+from imgurswitcher import init, main, create_worker
+
+# Read the config and set up the event queue (no network access)
+init()
 
 # Common parts
-workThread = Worker()
+# Worker, PoolWorker or AsyncWorker, depending on the runtime set in the config file
+workThread = create_worker()
 workThread.daemon = True
 workThread.start()
 
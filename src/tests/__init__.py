@@ -0,0 +1,25 @@
+# Copyright Patrick Perrier, 2015
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Tests for imgurswitcher. Run them from the src directory: python -m unittest discover -s tests -t . (or python -m pytest tests).
+
+Importing the package starts logging into its data directory, so the tests point
+IMGURSWITCHER_DATA_DIR at a scratch directory before anything imports it.
+"""
+
+import os
+import tempfile
+
+os.environ.setdefault("IMGURSWITCHER_DATA_DIR", tempfile.mkdtemp(prefix="imgurswitcher-tests-"))
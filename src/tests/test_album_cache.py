@@ -0,0 +1,70 @@
+# Copyright Patrick Perrier, 2015
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Tests for album_cache. The index files go in the tests' scratch data directory."""
+
+import os
+import json
+import unittest
+from imgurswitcher import album_cache
+from imgurswitcher.album_index import AlbumIndex
+
+class AlbumCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.album_id = "cache%s" % self.id().rsplit(".", 1)[-1]
+        self.path = album_cache._path_for(self.album_id)
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+
+    def tearDown(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def test_round_trip(self):
+        last_page = {"page": 3, "etag": '"p3"', "last_modified": None}
+        album_cache.save(self.album_id, AlbumIndex(["abc12", "d3"]), '"e1"', "Mon, 01 Jan 2018 00:00:00 GMT", last_page)
+        stored = album_cache.load(self.album_id)
+        self.assertEqual(stored["ids"], ["abc12", "d3"])
+        self.assertIsInstance(stored["ids"], AlbumIndex)
+        self.assertEqual(stored["etag"], '"e1"')
+        self.assertEqual(stored["last_modified"], "Mon, 01 Jan 2018 00:00:00 GMT")
+        self.assertEqual(stored["last_page"], last_page)
+        self.assertFalse(os.path.exists(self.path + ".tmp"))
+
+    def test_list_of_ids(self):
+        album_cache.save(self.album_id, ["abc12", "d3"])
+        stored = album_cache.load(self.album_id)
+        self.assertEqual(stored["ids"], ["abc12", "d3"])
+        self.assertIsNone(stored["etag"])
+        self.assertIsNone(stored["last_page"])
+
+    def test_old_format(self):
+        with open(self.path, 'w') as index_file:
+            json.dump({"ids": ["abc12", "d3"], "etag": '"e1"'}, index_file)
+        stored = album_cache.load(self.album_id)
+        self.assertEqual(stored["ids"], ["abc12", "d3"])
+        self.assertEqual(stored["etag"], '"e1"')
+        self.assertIsNone(stored["last_modified"])
+
+    def test_unusable_files(self):
+        self.assertIsNone(album_cache.load(self.album_id))
+        with open(self.path, 'w') as index_file:
+            index_file.write('{"width": 5, "packed": "abc')
+        self.assertIsNone(album_cache.load(self.album_id))
+        album_cache.save(self.album_id, [])
+        self.assertIsNone(album_cache.load(self.album_id))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,88 @@
+# Copyright Patrick Perrier, 2015
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Tests for album_diff, against a brute-force diff of the same lists."""
+
+import random
+import unittest
+from imgurswitcher import album_diff
+from imgurswitcher.album_index import AlbumIndex
+
+def _longest_common_run(old_order, new_order):
+    """Length of the longest common subsequence of the two lists, the slow way."""
+    lengths = [[0] * (len(new_order) + 1) for _ in range(len(old_order) + 1)]
+    for i, old_id in enumerate(old_order):
+        for j, new_id in enumerate(new_order):
+            if old_id == new_id:
+                lengths[i + 1][j + 1] = lengths[i][j] + 1
+            else:
+                lengths[i + 1][j + 1] = max(lengths[i][j + 1], lengths[i + 1][j])
+    return lengths[-1][-1]
+
+def _edit(rng, ids, count):
+    """Returns ids with count random inserts, removals and moves done to it."""
+    ids = list(ids)
+    for n in range(count):
+        change = rng.choice(("insert", "remove", "move")) if ids else "insert"
+        if change == "insert":
+            ids.insert(rng.randint(0, len(ids)), "new%0*i" % (rng.randint(2, 5), n))
+        elif change == "remove":
+            del ids[rng.randrange(len(ids))]
+        else:
+            ids.insert(rng.randint(0, len(ids) - 1), ids.pop(rng.randrange(len(ids))))
+    return ids
+
+class AlbumDiffTest(unittest.TestCase):
+
+    def _check(self, old, new):
+        changes = album_diff.diff(AlbumIndex(old), AlbumIndex(new))
+        old_set, new_set = set(old), set(new)
+        self.assertEqual(changes.added, [image_id for image_id in new if image_id not in old_set])
+        self.assertEqual(changes.removed, [image_id for image_id in old if image_id not in new_set])
+
+        # As few moves as possible, and the images that didn't move are in the same order in both lists
+        old_order = [image_id for image_id in old if image_id in new_set]
+        new_order = [image_id for image_id in new if image_id in old_set]
+        self.assertEqual(len(changes.moved), len(new_order) - _longest_common_run(old_order, new_order))
+        moved = set(changes.moved)
+        self.assertEqual([image_id for image_id in old_order if image_id not in moved],
+                         [image_id for image_id in new_order if image_id not in moved])
+
+        new_positions = dict((image_id, position) for position, image_id in enumerate(new))
+        for position, image_id in enumerate(old):
+            self.assertEqual(changes.new_position(position, image_id), new_positions.get(image_id))
+        self.assertEqual(bool(changes), old != new)
+
+    def test_against_brute_force(self):
+        rng = random.Random(1234)
+        for _ in range(200):
+            old = ["img%0*i" % (rng.randint(2, 5), i) for i in range(rng.randint(0, 60))]
+            self._check(old, _edit(rng, old, rng.randint(0, 8)))
+
+    def test_edits_at_the_ends(self):
+        old = ["a%05i" % i for i in range(300)]
+        self._check(old, old)
+        self._check(old, old + ["b00001", "b00002"])
+        self._check(old, ["b00001"] + old[1:])
+        self._check(old, old[:90] + old[91:120] + [old[90]] + old[120:])
+
+    def test_different_widths(self):
+        # The packed forms can't be compared when the longest IDs aren't the same length
+        old = ["abc12", "abc13", "abc14"]
+        self._check(old, old + ["longer1"])
+        self._check(old + ["longer1"], ["abc14", "abc12"])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,63 @@
+# Copyright Patrick Perrier, 2015
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Tests for album_index."""
+
+import unittest
+from imgurswitcher.album_index import AlbumIndex
+
+class AlbumIndexTest(unittest.TestCase):
+
+    def test_works_like_the_list(self):
+        ids = ["abc12", "d3", "efgh456", "i"]
+        index = AlbumIndex(ids)
+        self.assertEqual(len(index), 4)
+        self.assertEqual(list(index), ids)
+        self.assertEqual(index, ids)
+        self.assertEqual([index[i] for i in range(-4, 4)], ids + ids)
+        with self.assertRaises(IndexError):
+            index[4]
+        self.assertEqual(len(AlbumIndex()), 0)
+        self.assertEqual(AlbumIndex(), [])
+
+    def test_packed_round_trip(self):
+        index = AlbumIndex(["abc12", "d3", "efgh456"])
+        width, data = index.packed()
+        self.assertEqual(width, 7)
+        copy = AlbumIndex.from_packed(width, data)
+        self.assertEqual(copy, index)
+        self.assertEqual(copy.position_of("d3"), 1)
+        with self.assertRaises(ValueError):
+            AlbumIndex.from_packed(width, data[:-1])
+
+    def test_position_of(self):
+        ids = ["img%i" % i for i in range(5000)]
+        index = AlbumIndex(ids)
+        for position, image_id in enumerate(ids):
+            self.assertEqual(index.position_of(image_id), position)
+        for missing in ("img5000", "img", "", "img12345678", "img 1", "é", None):
+            self.assertIsNone(index.position_of(missing), missing)
+        self.assertIn("img42", index)
+        self.assertNotIn("img42 ", index)
+
+    def test_repeated_id_keeps_its_first_position(self):
+        self.assertEqual(AlbumIndex(["a", "b", "a"]).position_of("a"), 0)
+
+    def test_equality_across_widths(self):
+        self.assertEqual(AlbumIndex(["a", "b"]), AlbumIndex.from_packed(3, b"a  b  "))
+        self.assertNotEqual(AlbumIndex(["a", "b"]), AlbumIndex(["b", "a"]))
+
+if __name__ == "__main__":
+    unittest.main()
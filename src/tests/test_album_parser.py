@@ -0,0 +1,54 @@
+# Copyright Patrick Perrier, 2015
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Tests for album_parser."""
+
+import unittest
+from imgurswitcher.album_parser import AlbumPageParser
+
+def _image(image_id):
+    return '<div id="%s" class="post-image-container">' % image_id
+
+def _parse(page, chunk_size):
+    data = page.encode('ascii')
+    parser = AlbumPageParser()
+    for start in range(0, len(data), chunk_size):
+        parser.feed(data[start:start + chunk_size])
+    parser.close()
+    return parser
+
+class AlbumPageParserTest(unittest.TestCase):
+
+    def test_ids_split_across_chunks(self):
+        ids = ["abc%02i" % i for i in range(20)]
+        page = "<html>" + "<p>text</p>".join(_image(image_id) for image_id in ids) + "</html>"
+        for chunk_size in (1, 7, 64, 4096):
+            self.assertEqual(_parse(page, chunk_size).ids, ids, "chunk size %i" % chunk_size)
+
+    def test_page_links(self):
+        page = _image("abc12") + '<a href="/a/x/layout/blog?page=2">' + _image("def34") + '<a href="/a/x/layout/blog?page=3">'
+        for chunk_size in (1, 5, 4096):
+            self.assertEqual(_parse(page, chunk_size).pages, {2, 3}, "chunk size %i" % chunk_size)
+
+    def test_page_link_at_the_end_after_an_unfinished_prefix(self):
+        # The <div id=" isn't an image, but it is held back in case the next chunk makes it one
+        page = _image("abc12") + '<div id="cc2b3c" class="other"><a href="/a/x/layout/blog?page=45">'
+        for chunk_size in (1, 13, 4096):
+            parser = _parse(page, chunk_size)
+            self.assertEqual(parser.ids, ["abc12"])
+            self.assertEqual(parser.pages, {45}, "chunk size %i" % chunk_size)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,111 @@
+# Copyright Patrick Perrier, 2015
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Tests for refreshing the album in use (imgur_callbacks.refresh_album), against the local Imgur stand-in."""
+
+import os
+import time
+import shutil
+import unittest
+from benchmarks.imgur_standin import StandinServer
+from imgurswitcher import get_data, DATA_DIR_VARIABLE
+from imgurswitcher import config as cfg
+from imgurswitcher import event_queue as eq
+from imgurswitcher import worker
+from imgurswitcher import imgur_callbacks as callbacks
+from imgurswitcher.imgur_callbacks import ImgurCallbacks
+
+ALBUM_ID = "refresh1"
+
+_PACKAGE_DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "imgurswitcher", "data")
+
+def _wait_for(condition, timeout=10.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+class RefreshAlbumTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        if not os.environ.get(DATA_DIR_VARIABLE):
+            # This writes the config file; never the real one
+            raise unittest.SkipTest("%s is not set; run the tests as the tests package" % DATA_DIR_VARIABLE)
+        cls.server = StandinServer({ALBUM_ID: ["img%04d" % i for i in range(20)]}, image_size=1024).start()
+        shutil.copy(os.path.join(_PACKAGE_DATA_DIR, "default.jpg"), get_data("default.jpg"))
+        with open(cfg.config_file_path, 'w') as config_file:
+            config_file.write("url: http://imgur.com/a/%s\nposition: 0\nruntime: thread\n" % ALBUM_ID)
+        cfg.parse_cfg_file()
+        eq.init()
+        cfg.set_as_background = lambda path: True
+        ImgurCallbacks.imgur_stub = cls.server.url + "/"
+        ImgurCallbacks.album_stub = cls.server.url + "/a/"
+        engine = worker.Worker()
+        engine.daemon = True
+        engine.start()
+        callbacks.load_images()
+        # _loaded is set as soon as the first images are in; the whole album is in once there is a _source
+        if not _wait_for(lambda: ImgurCallbacks._source is not None):
+            raise AssertionError("The album did not load")
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.stop()
+
+    def _refresh(self):
+        requests = self.server.requests
+        callbacks.refresh_album()
+        self.assertTrue(_wait_for(lambda: self.server.requests > requests), "the album was not fetched")
+
+    def test_refresh_after_a_new_etag_with_the_same_images(self):
+        ids = ImgurCallbacks._image_ids
+        etag = ImgurCallbacks._source.etag
+
+        # Same images, but the page is different, so its ETag is too
+        album_page = self.server.album_page
+        self.server.album_page = lambda album_id, page=1: album_page(album_id, page) + b"<!-- edited -->"
+        self.addCleanup(delattr, self.server, "album_page")
+        self._refresh()
+        self.assertTrue(_wait_for(lambda: ImgurCallbacks._source.etag != etag), "the new ETag was not taken")
+        self.assertIs(ImgurCallbacks._image_ids, ids)
+        self.assertIs(ImgurCallbacks._source.ids, ids)
+
+        # The next refresh still runs, and picks up an added image
+        self.server.albums[ALBUM_ID] = self.server.albums[ALBUM_ID] + ["img9999"]
+        self._refresh()
+        self.assertTrue(_wait_for(lambda: len(ImgurCallbacks._image_ids) == 21), "the added image was not picked up")
+        self.assertEqual(ImgurCallbacks._image_ids[20], "img9999")
+
+    def test_refresh_picks_up_images_added_to_the_last_page(self):
+        # 20 images in pages of 8: the third and last page has 4
+        self.server.page_size = 8
+        self.addCleanup(setattr, self.server, "page_size", None)
+        ids = ["page%04d" % i for i in range(20)]
+        self.server.albums[ALBUM_ID] = list(ids)
+        self._refresh()
+        self.assertTrue(_wait_for(lambda: list(ImgurCallbacks._image_ids) == ids), "the paginated album was not picked up")
+        self.assertEqual(ImgurCallbacks._source.last_page["page"], 3)
+
+        # The first page (its images and its links) stays the same; only the last one changes
+        self.server.albums[ALBUM_ID].append("page9999")
+        self._refresh()
+        self.assertTrue(_wait_for(lambda: len(ImgurCallbacks._image_ids) == 21), "the image added to the last page was not picked up")
+        self.assertEqual(ImgurCallbacks._image_ids[20], "page9999")
+
+if __name__ == "__main__":
+    unittest.main()
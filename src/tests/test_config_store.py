@@ -0,0 +1,100 @@
+# Copyright Patrick Perrier, 2015
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Tests for config_store."""
+
+import os
+import time
+import shutil
+import tempfile
+import unittest
+from imgurswitcher.config_store import ConfigStore
+
+SCHEMA = {"url": str, "position": int}
+
+class ConfigStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "config.cfg")
+        with open(self.path, 'w') as cfg_file:
+            cfg_file.write("# a comment\nurl: http://imgur.com/a/abc12\nother: kept\nposition: 3\n")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def _text(self):
+        with open(self.path, 'r') as cfg_file:
+            return cfg_file.read()
+
+    def test_read(self):
+        with open(self.path, 'a') as cfg_file:
+            cfg_file.write("position: 4\n")
+        self.assertEqual(ConfigStore(self.path, SCHEMA).read(), {"url": "http://imgur.com/a/abc12", "position": 3})
+
+    def test_invalid_value_is_left_out(self):
+        with open(self.path, 'w') as cfg_file:
+            cfg_file.write("position: three\n")
+        self.assertEqual(ConfigStore(self.path, SCHEMA).read(), {})
+
+    def test_flush_keeps_the_rest_of_the_file(self):
+        store = ConfigStore(self.path, SCHEMA)
+        store.read()
+        self.assertTrue(store.flush({"position": 7, "new_key": 1}))
+        self.assertEqual(self._text(), "# a comment\nurl: http://imgur.com/a/abc12\nother: kept\nposition: 7\nnew_key: 1\n")
+        self.assertEqual(os.listdir(self.directory), ["config.cfg"])
+
+    def test_failed_write_leaves_the_file_alone(self):
+        store = ConfigStore(self.path, SCHEMA)
+        store.read()
+        # The temporary file can't be created, so the config file mustn't be touched
+        os.mkdir(self.path + ".tmp")
+        self.assertFalse(store.flush({"position": 7}))
+        self.assertIn("position: 3\n", self._text())
+        os.rmdir(self.path + ".tmp")
+        # What couldn't be written is still pending
+        self.assertTrue(store.flush())
+        self.assertIn("position: 7\n", self._text())
+
+    def test_set_is_written_once_after_the_delay(self):
+        store = ConfigStore(self.path, SCHEMA, flush_delay=0.2)
+        store.read()
+        for position in range(5, 10):
+            store.set("position", position)
+        self.assertIn("position: 3\n", self._text())
+        deadline = time.monotonic() + 5
+        while "position: 9\n" not in self._text() and time.monotonic() < deadline:
+            time.sleep(0.02)
+        self.assertIn("position: 9\n", self._text())
+        self.assertFalse(store.modified())
+
+    def test_changes_made_by_someone_else(self):
+        store = ConfigStore(self.path, SCHEMA)
+        store.read()
+        self.assertEqual(store.changes(), {})
+        store.flush({"position": 5})
+        self.assertEqual(store.changes(), {}, "its own write isn't a change")
+
+        time.sleep(0.01) # so that the modification time changes
+        with open(self.path, 'w') as cfg_file:
+            cfg_file.write("url: http://imgur.com/a/def34\nposition: 5\n")
+        self.assertTrue(store.modified())
+        # Written on top of the edit, which isn't lost
+        store.flush({"position": 6})
+        self.assertEqual(self._text(), "url: http://imgur.com/a/def34\nposition: 6\n")
+        self.assertEqual(store.changes(), {"url": "http://imgur.com/a/def34"})
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,188 @@
+# Copyright Patrick Perrier, 2015
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Tests for event_queue: ordering, coalescing and preemption, and the navigation events' merging."""
+
+import queue
+import unittest
+from imgurswitcher import event_queue as eq
+from imgurswitcher.imgur_callbacks import MoveEvent, RandomEvent
+
+class _Recorder(eq.CoalescingEvent):
+    """Event that records the tokens it was run with, and can be preempted by another _Recorder."""
+
+    def __init__(self, preempting=False):
+        super().__init__()
+        self.preempting = preempting
+        self.tokens = []
+        self.absorbed = []
+
+    def preempts(self, running):
+        return self.preempting and isinstance(running, _Recorder)
+
+    def absorb(self, interrupted):
+        self.absorbed.append(interrupted)
+
+    def run(self, token):
+        self.tokens.append(token)
+
+def _call():
+    pass
+
+class EventQueueTest(unittest.TestCase):
+    """Ordering of _EventQueue itself."""
+
+    def test_priority_then_fifo(self):
+        q = eq._EventQueue()
+        items = [(10, "a", False), (1, "b", True), (10, "c", True), (5, "d", False), (10, "e", False), (1, "f", False)]
+        for item in items:
+            q.put(item)
+        self.assertEqual([q.get()[1] for _ in items], ["b", "f", "d", "a", "c", "e"])
+        with self.assertRaises(queue.Empty):
+            q.get(block=False)
+
+    def test_front(self):
+        q = eq._EventQueue()
+        q.put((10, "a", False))
+        q.put((10, "b", True))
+        q.put((10, "c", False), front=True)
+        self.assertEqual([q.get()[1] for _ in range(3)], ["c", "a", "b"])
+
+    def test_blocking_filter(self):
+        q = eq._EventQueue()
+        for item in [(10, "a", False), (10, "b", True), (1, "c", False), (10, "d", True)]:
+            q.put(item)
+        self.assertEqual(q.get_entry(False, True)[0][1], "b")
+        self.assertEqual(q.get_entry(False, False)[0][1], "c")
+        self.assertEqual(q.get_entry(False, True)[0][1], "d")
+        with self.assertRaises(queue.Empty):
+            q.get_entry(False, True)
+        self.assertEqual(q.qsize(), 1)
+        self.assertEqual(q.get_entry(False)[0][1], "a")
+
+    def test_full_and_clear(self):
+        q = eq._EventQueue(2)
+        q.put((10, "a", False))
+        q.put((10, "b", False))
+        with self.assertRaises(queue.Full):
+            q.put((10, "c", False))
+        q.get()
+        q.task_done()
+        q.clear()
+        self.assertEqual(q.qsize(), 0)
+        q.join() # everything counts as done
+
+class _ModuleStateTest(unittest.TestCase):
+    """Runs each test on a fresh module queue, and puts the one in use back afterwards.
+
+    A worker thread started by another test may be waiting in the old queue; it stays there.
+    """
+
+    def setUp(self):
+        self._saved = eq._event_queue
+        eq.init()
+        with eq._lock:
+            eq._reset()
+            del eq._running[:]
+
+    def tearDown(self):
+        with eq._lock:
+            eq._reset()
+        eq._event_queue = self._saved
+
+    def _take_all(self):
+        taken = []
+        while True:
+            try:
+                taken.append(eq.take(block=False)[0])
+            except queue.Empty:
+                return taken
+
+class CoalescingTest(_ModuleStateTest):
+
+    def test_blocking_event_blocks_puts_until_executed(self):
+        self.assertTrue(eq.put((eq.HIGH_PRIORITY, _call, True)))
+        self.assertFalse(eq.put((eq.LOW_PRIORITY, _call, False)))
+        eq.execute(*eq.take(block=False))
+        self.assertTrue(eq.put((eq.LOW_PRIORITY, _call, False)))
+
+    def test_urgent_event_interrupts_and_requeues_the_running_one(self):
+        running = _Recorder()
+        eq.put((eq.LOW_PRIORITY, running, False))
+        triple, token = eq.take(block=False)
+        eq.put((eq.URGENT_PRIORITY, _call, False))
+        self.assertTrue(token.cancelled)
+        eq.execute(triple, token)
+        # Back in the queue, behind the urgent event but in front of the other low priority ones
+        eq.put((eq.LOW_PRIORITY, _call, False))
+        self.assertEqual([taken[1] for taken in self._take_all()], [_call, running, _call])
+
+    def test_preempting_event_takes_over(self):
+        running = _Recorder()
+        eq.put((eq.LOW_PRIORITY, running, False))
+        triple, token = eq.take(block=False)
+        newer = _Recorder(preempting=True)
+        eq.put((eq.LOW_PRIORITY, newer, False))
+        self.assertTrue(token.cancelled)
+        self.assertEqual(newer.absorbed, [running])
+        eq.execute(triple, token)
+        self.assertEqual([taken[1] for taken in self._take_all()], [newer], "not put back")
+
+class NavigationEventTest(_ModuleStateTest):
+
+    def test_moves_are_merged(self):
+        first = MoveEvent(1)
+        eq.put((eq.LOW_PRIORITY, first, False))
+        for steps in (1, -1, 1):
+            eq.put((eq.LOW_PRIORITY, MoveEvent(steps), False))
+        taken = self._take_all()
+        self.assertEqual([triple[1] for triple in taken], [first])
+        self.assertEqual(first.steps, 2)
+
+    def test_no_merging_into_a_taken_event(self):
+        eq.put((eq.LOW_PRIORITY, MoveEvent(1), False))
+        triple, token = eq.take(block=False)
+        eq.put((eq.LOW_PRIORITY, MoveEvent(1), False))
+        self.assertEqual(triple[1].steps, 1)
+        self.assertEqual(len(self._take_all()), 1)
+
+    def test_no_merging_across_another_event(self):
+        eq.put((eq.LOW_PRIORITY, MoveEvent(1), False))
+        eq.put((eq.MED_PRIORITY, _call, False))
+        eq.put((eq.LOW_PRIORITY, MoveEvent(1), False))
+        self.assertEqual(len(self._take_all()), 3)
+
+    def test_random_supersedes_waiting_moves(self):
+        moves = [MoveEvent(1), MoveEvent(-1)]
+        eq.put((eq.LOW_PRIORITY, moves[0], False))
+        eq.put((eq.MED_PRIORITY, _call, False))
+        eq.put((eq.LOW_PRIORITY, moves[1], False))
+        first = RandomEvent()
+        eq.put((eq.LOW_PRIORITY, first, False))
+        eq.put((eq.LOW_PRIORITY, RandomEvent(), False))
+        self.assertTrue(all(move.cancelled for move in moves))
+        self.assertFalse(first.cancelled, "the second random image was merged into it")
+        self.assertEqual(len(self._take_all()), 4)
+
+    def test_move_interrupts_a_running_move(self):
+        eq.put((eq.LOW_PRIORITY, MoveEvent(2), False))
+        triple, token = eq.take(block=False)
+        newer = MoveEvent(1)
+        eq.put((eq.LOW_PRIORITY, newer, False))
+        self.assertTrue(token.cancelled)
+        self.assertEqual(newer.steps, 3, "it takes over the interrupted move's steps")
+
+if __name__ == "__main__":
+    unittest.main()
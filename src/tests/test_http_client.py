@@ -0,0 +1,91 @@
+# Copyright Patrick Perrier, 2015
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Tests for http_client, against the local Imgur stand-in."""
+
+import os
+import time
+import shutil
+import tempfile
+import threading
+import unittest
+from benchmarks.imgur_standin import StandinServer
+from imgurswitcher import exceptions as xcpt
+from imgurswitcher.cancellation import CancelToken
+from imgurswitcher.http_client import HttpClient
+
+# Seconds the stand-in waits before answering a slow request; cancelling must not wait for it
+SLOW = 5.0
+
+def _cancel_after(token, seconds):
+    timer = threading.Timer(seconds, token.cancel)
+    timer.start()
+    return timer
+
+class HttpClientTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = StandinServer({}, image_size=1024).start()
+        self.client = HttpClient(max_connections=1, timeout=30)
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "img.jpg")
+
+    def tearDown(self):
+        self.client.close()
+        self.server.stop()
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def test_download(self):
+        for _ in range(2):
+            self.assertEqual(self.client.download(self.server.url + "/abc12.jpg", self.path, CancelToken()), 1024)
+        self.assertEqual(os.path.getsize(self.path), 1024)
+        self.assertEqual(self.server.connections, 1)
+
+    def test_stale_pooled_connection(self):
+        self.assertEqual(self.client.download(self.server.url + "/abc12.jpg", self.path), 1024)
+        # The server closes the kept-alive connection; the next request notices and reconnects
+        self.server.drop_connections()
+        time.sleep(0.1)
+        self.assertEqual(self.client.download(self.server.url + "/abc12.jpg", self.path), 1024)
+        self.assertEqual(self.server.connections, 2)
+
+    def test_cancel_before_the_first_byte(self):
+        self.server.latency = SLOW
+        token = CancelToken()
+        _cancel_after(token, 0.1)
+        started = time.perf_counter()
+        with self.assertRaises(xcpt.DownloadCancelled):
+            self.client.download(self.server.url + "/abc12.jpg", self.path, token)
+        self.assertLess(time.perf_counter() - started, 1.0)
+
+        # The connection was thrown away and its slot handed back
+        self.server.latency = 0.0
+        self.assertEqual(self.client.download(self.server.url + "/abc12.jpg", self.path), 1024)
+
+    def test_cancel_while_waiting_for_a_connection(self):
+        self.server.latency = SLOW
+        # Takes the only connection for SLOW seconds
+        threading.Thread(target=self.client.download, args=(self.server.url + "/busy1.jpg", os.path.join(self.directory, "busy.jpg")),
+                         daemon=True).start()
+        time.sleep(0.1)
+        token = CancelToken()
+        _cancel_after(token, 0.1)
+        started = time.perf_counter()
+        with self.assertRaises(xcpt.DownloadCancelled):
+            self.client.download(self.server.url + "/abc12.jpg", self.path, token)
+        self.assertLess(time.perf_counter() - started, 1.0)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,115 @@
+# Copyright Patrick Perrier, 2015
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Tests for image_cache."""
+
+import os
+import time
+import shutil
+import tempfile
+import threading
+import unittest
+from imgurswitcher.image_cache import ImageCache, INDEX_FILE_NAME
+
+class ImageCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def _add(self, cache, image_id, size=100):
+        path = cache.temp_path(image_id)
+        with open(path, 'wb') as image_file:
+            image_file.write(b"x" * size)
+        return cache.add(image_id, path)
+
+    def test_least_recently_used_is_evicted(self):
+        cache = ImageCache(self.directory, 300)
+        for image_id in ("a", "b", "c"):
+            self._add(cache, image_id)
+        self.assertIsNotNone(cache.get("a"))
+        self._add(cache, "d")
+        self.assertFalse(cache.contains("b"))
+        self.assertFalse(os.path.exists(os.path.join(self.directory, "b.jpg")))
+        for image_id in ("a", "c", "d"):
+            self.assertTrue(cache.contains(image_id), image_id)
+        self.assertEqual(cache.stats()["bytes"], 300)
+
+    def test_image_bigger_than_the_cache_is_kept(self):
+        cache = ImageCache(self.directory, 300)
+        self._add(cache, "a")
+        self._add(cache, "big", 1000)
+        self.assertEqual(cache.peek("big"), os.path.join(self.directory, "big.jpg"))
+        self.assertFalse(cache.contains("a"))
+
+    def test_resize(self):
+        cache = ImageCache(self.directory, 1000)
+        for image_id in ("a", "b", "c"):
+            self._add(cache, image_id)
+        cache.resize(200)
+        self.assertEqual([cache.contains(image_id) for image_id in ("a", "b", "c")], [False, True, True])
+
+    def test_hits_and_misses(self):
+        cache = ImageCache(self.directory, 1000)
+        self._add(cache, "a")
+        self.assertIsNotNone(cache.get("a"))
+        self.assertIsNone(cache.get("b"))
+        os.remove(os.path.join(self.directory, "a.jpg"))
+        self.assertIsNone(cache.get("a"), "the file was deleted")
+        stats = cache.stats()
+        self.assertEqual((stats["hits"], stats["misses"], stats["images"]), (1, 2, 0))
+
+    def test_concurrent_adds(self):
+        cache = ImageCache(self.directory, 10 ** 6, save_delay=0.01)
+
+        def add(thread):
+            for i in range(50):
+                # The same images from every thread, too
+                self._add(cache, "t%i_%i" % (thread, i))
+                self._add(cache, "shared%i" % i)
+        threads = [threading.Thread(target=add, args=(thread,)) for thread in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        stats = cache.stats()
+        self.assertEqual(stats["images"], 8 * 50 + 50)
+        self.assertEqual(stats["bytes"], (8 * 50 + 50) * 100)
+        cache.save_index()
+        self.assertEqual(len(os.listdir(self.directory)), 8 * 50 + 50 + 1, "leftover temporary files")
+
+    def test_index_survives_a_restart(self):
+        cache = ImageCache(self.directory, 1000, save_delay=0.05)
+        for image_id in ("a", "b", "c"):
+            self._add(cache, image_id)
+        cache.get("a")
+        # Written after the delay, without save_index
+        index_path = os.path.join(self.directory, INDEX_FILE_NAME)
+        deadline = time.monotonic() + 5
+        while not os.path.exists(index_path) and time.monotonic() < deadline:
+            time.sleep(0.01)
+        cache.save_index()
+        # Left behind by a download that was interrupted
+        open(os.path.join(self.directory, "d.123.part"), 'w').close()
+
+        reopened = ImageCache(self.directory, 200)
+        self.assertEqual([reopened.contains(image_id) for image_id in ("a", "b", "c")], [True, False, True])
+        self.assertFalse(os.path.exists(os.path.join(self.directory, "d.123.part")))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,87 @@
+# Copyright Patrick Perrier, 2015
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Tests for metrics."""
+
+import os
+import json
+import shutil
+import tempfile
+import unittest
+from imgurswitcher import metrics
+
+class MetricsTest(unittest.TestCase):
+
+    def setUp(self):
+        metrics.reset()
+        self.addCleanup(metrics.reset)
+        sources = dict(metrics._sources)
+        self.addCleanup(metrics._sources.update, sources)
+        self.addCleanup(metrics._sources.clear)
+
+    def test_counters_and_gauges(self):
+        metrics.increment("test.count")
+        metrics.increment("test.count", 4)
+        metrics.set_gauge("test.depth", 3)
+        metrics.set_gauge("test.depth", 1)
+        current = metrics.snapshot()
+        self.assertEqual(current["counters"]["test.count"], 5)
+        self.assertEqual(current["gauges"]["test.depth"], 1)
+
+    def test_histogram(self):
+        for value in range(1, 101):
+            metrics.observe("test.ms", value)
+        summary = metrics.snapshot()["histograms"]["test.ms"]
+        self.assertEqual((summary["count"], summary["sum"], summary["mean"]), (100, 5050, 50.5))
+        self.assertEqual((summary["p50"], summary["p95"], summary["p99"], summary["max"]), (50, 95, 99, 100))
+
+    def test_histogram_window(self):
+        for value in range(metrics.HISTOGRAM_WINDOW + 10):
+            metrics.observe("test.window", value)
+        summary = metrics.snapshot()["histograms"]["test.window"]
+        # Percentiles only from the most recent values, totals from all of them
+        self.assertEqual(summary["window"], metrics.HISTOGRAM_WINDOW)
+        self.assertEqual(summary["count"], metrics.HISTOGRAM_WINDOW + 10)
+        self.assertEqual(summary["max"], metrics.HISTOGRAM_WINDOW + 9)
+        self.assertEqual(summary["p50"], 10 + metrics.HISTOGRAM_WINDOW // 2 - 1)
+
+    def test_sources(self):
+        def failing():
+            raise RuntimeError("broken")
+        metrics.add_source("test_source", lambda: {"images": 2})
+        metrics.add_source("test_failing", failing)
+        current = metrics.snapshot()
+        self.assertEqual(current["test_source"], {"images": 2})
+        self.assertNotIn("test_failing", current)
+
+    def test_dump(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        metrics.increment("test.count")
+        path = os.path.join(directory, "metrics.json")
+        metrics.dump(path)
+        with open(path, 'r') as dump_file:
+            self.assertEqual(json.load(dump_file)["counters"]["test.count"], 1)
+
+    def test_reset(self):
+        metrics.increment("test.count")
+        metrics.observe("test.ms", 1)
+        metrics.reset()
+        current = metrics.snapshot()
+        self.assertNotIn("test.count", current["counters"])
+        self.assertNotIn("test.ms", current["histograms"])
+
+if __name__ == "__main__":
+    unittest.main()